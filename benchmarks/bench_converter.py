@@ -0,0 +1,62 @@
+import glob
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.converters import to_html
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+
+def report(name, seconds, unit='us', scale=1e6):
+    print(f'{name:<40}{seconds * scale:>12.2f} {unit}')
+
+
+def main():
+    """
+    Замеряет создание конвертера, его передачу в другой процесс (pickle),
+    накладные расходы на вызов, разбор (лексер и сборку разделов) и полную
+    конвертацию встроенных страниц
+    """
+    number = 2000
+    report('Converter()', timeit.timeit(to_html.Converter,
+                                        number=number) / number)
+
+    converter = to_html.Converter()
+    pickled = pickle.dumps(converter)
+    report('pickle.loads(converter)',
+           timeit.timeit(lambda: pickle.loads(pickled),
+                         number=number) / number)
+
+    line = r'.B \-\-posix \fBbold\fP and \fIitalic\fP'
+    number = 100000
+    report('convert_line (module function)',
+           timeit.timeit(lambda: to_html.convert_line(line),
+                         number=number) / number)
+    report('convert_line (Converter method)',
+           timeit.timeit(lambda: converter.convert_line(line),
+                         number=number) / number)
+
+    number = 5
+    for page in sorted(glob.glob(os.path.join(man_dir, '*'))):
+        with open(page) as man_page:
+            lines = man_page.readlines()
+        seconds = timeit.timeit(
+            lambda: list(converter.tokenize(lines)),
+            number=number) / number
+        report(f'tokenize {os.path.basename(page)}', seconds, 'ms', 1e3)
+        seconds = timeit.timeit(
+            lambda: list(converter.get_sections(lines)),
+            number=number) / number
+        report(f'get_sections {os.path.basename(page)}', seconds, 'ms', 1e3)
+        seconds = timeit.timeit(
+            lambda: ''.join(converter.convert(lines, 'main.css')),
+            number=number) / number
+        report(f'convert {os.path.basename(page)}', seconds, 'ms', 1e3)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import glob
+import os
+import sys
+from html.parser import HTMLParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.converters import to_html
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+void_elements = {'br', 'meta', 'link', 'img', 'hr', 'input', 'wbr'}
+
+# таблица однострочных тегов до появления отслеживания шрифтов:
+# \fB, \fI и \fR открывали span'ы, закрывал их только \fP
+legacy_single_tags = dict(to_html.single_tags, **{
+    r'\fB': r'<span class="strong">',
+    r'\fI': r'<span class="emphasis">',
+    r'\fR': r'<span class="romanic">',
+    r'\fP': r'</span>',
+})
+
+
+class DomStats(HTMLParser):
+    """
+    Грубо повторяет построение DOM браузером: закрывающий тег закрывает
+    ближайший открытый элемент с тем же именем и все незакрытые внутри него
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.nodes = 0
+        self.max_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.nodes += 1
+        if tag in void_elements:
+            return
+        self.stack.append(tag)
+        self.max_depth = max(self.max_depth, len(self.stack))
+
+    def handle_endtag(self, tag):
+        if tag in self.stack:
+            while self.stack.pop() != tag:
+                pass
+
+
+def dom_stats(converter, page):
+    stats = DomStats()
+    with open(page) as man_page:
+        for chunk in converter.convert(man_page, 'main.css'):
+            stats.feed(chunk)
+    stats.close()
+
+    return stats.nodes, stats.max_depth
+
+
+def main():
+    """
+    Сравнивает количество элементов и глубину DOM встроенных страниц до и
+    после отслеживания шрифтов
+    """
+    before = to_html.Converter(single_tags=legacy_single_tags,
+                               font_classes={})
+    after = to_html.default_converter
+
+    print(f'{"page":<12}{"nodes before":>14}{"depth before":>14}'
+          f'{"nodes after":>14}{"depth after":>14}')
+    for page in sorted(glob.glob(os.path.join(man_dir, '*'))):
+        nodes_before, depth_before = dom_stats(before, page)
+        nodes_after, depth_after = dom_stats(after, page)
+        print(f'{os.path.basename(page):<12}{nodes_before:>14}'
+              f'{depth_before:>14}{nodes_after:>14}{depth_after:>14}')
+
+
+if __name__ == '__main__':
+    main()
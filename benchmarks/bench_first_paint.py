@@ -0,0 +1,96 @@
+import glob
+import os
+import sys
+from html.parser import HTMLParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.converters import to_html
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+void_elements = {'br', 'meta', 'link', 'img', 'hr', 'input', 'wbr'}
+
+
+class FirstPaintStats(HTMLParser):
+    """
+    Считает элементы, которые браузер раскладывает для первого экрана
+    страницы с навигацией (--toc): с content-visibility: auto (main.css)
+    содержимое разделов за пределами экрана не раскладывается; на первом
+    экране считается только первый раздел
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.nodes = 0
+        # элементы содержимого разделов (body > details > :not(summary))
+        # кроме первого раздела
+        self.skipped_nodes = 0
+        self.sections = 0
+        self._skipped_depth = None
+
+    def handle_starttag(self, tag, attrs):
+        self.nodes += 1
+        if self._skipped_depth is not None:
+            self.skipped_nodes += 1
+        elif self.stack == ['html', 'body'] and tag == 'details':
+            self.sections += 1
+        elif (self.stack == ['html', 'body', 'details'] and
+              tag != 'summary' and self.sections > 1):
+            self.skipped_nodes += 1
+            if tag not in void_elements:
+                self._skipped_depth = len(self.stack)
+        if tag not in void_elements:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        while self.stack.pop() != tag:
+            pass
+        if self._skipped_depth is not None and \
+                len(self.stack) <= self._skipped_depth:
+            self._skipped_depth = None
+
+
+def end_offset(html: bytes, tag: bytes) -> int:
+    """
+    :return: сколько байт html нужно получить до конца первого тега tag
+    """
+    return html.index(tag) + len(tag)
+
+
+def first_paint_stats(converter, page):
+    with open(page, encoding='utf-8', errors='replace') as man_page:
+        html = ''.join(converter.convert(man_page, 'main.css'))
+    stats = FirstPaintStats()
+    stats.feed(html)
+    stats.close()
+    html = html.encode('utf-8')
+
+    return (len(html), end_offset(html, b'</nav>'),
+            end_offset(html, b'</h1>'), stats.nodes,
+            stats.nodes - stats.skipped_nodes)
+
+
+def main():
+    """
+    Сравнивает для встроенных страниц с --toc, сколько байт нужно до
+    оглавления, когда оно выводится после разделов (было: вся страница) и
+    перед ними (стало), до заголовка первого раздела, и сколько элементов
+    раскладывается для первого экрана без content-visibility и с ним
+    """
+    converter = to_html.Converter(toc=True)
+
+    print(f'{"page":<12}{"size":>10}{"toc last":>10}{"toc first":>11}'
+          f'{"1st h1":>9}{"nodes":>8}{"with c-v":>10}')
+    for page in sorted(glob.glob(os.path.join(man_dir, '*'))):
+        size, nav_end, header_end, nodes, visible_nodes = \
+            first_paint_stats(converter, page)
+        print(f'{os.path.basename(page):<12}{size:>10}{size:>10}'
+              f'{nav_end:>11}{header_end:>9}{nodes:>8}{visible_nodes:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import glob
+import gzip
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.converters import to_html
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+
+def output_size(converter, page):
+    with open(page) as man_page:
+        content = ''.join(converter.convert(man_page, 'main.css'))
+    content = content.encode('utf-8')
+
+    return len(content), len(gzip.compress(content, mtime=0))
+
+
+def main():
+    """
+    Сравнивает размер (и размер после gzip) обычной и компактной разметки
+    встроенных страниц
+    """
+    usual = to_html.Converter()
+    compact = to_html.Converter(compact=True)
+
+    print(f'{"page":<12}{"usual, B":>12}{"compact, B":>12}{"saved":>8}'
+          f'{"gzip usual":>12}{"gzip compact":>14}{"saved":>8}')
+    for page in sorted(glob.glob(os.path.join(man_dir, '*'))):
+        usual_size, usual_gzip = output_size(usual, page)
+        compact_size, compact_gzip = output_size(compact, page)
+        print(f'{os.path.basename(page):<12}{usual_size:>12}'
+              f'{compact_size:>12}{1 - compact_size / usual_size:>8.0%}'
+              f'{usual_gzip:>12}{compact_gzip:>14}'
+              f'{1 - compact_gzip / usual_gzip:>8.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.utils import batch, file_manager, pipeline
+from src.utils.metrics import Metrics
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+# задержки чтения и записи страницы, в секундах (имитация сетевого диска)
+latencies = (0, 0.005)
+
+
+def make_corpus(directory, count=60):
+    """
+    Корпус из разных (не псевдонимов) копий python.1 и chmod.2
+    """
+    for number in range(count):
+        name = ('python.1', 'chmod.2')[number % 2]
+        page_name, section = name.split('.')
+        with open(os.path.join(man_dir, name)) as source, \
+                open(os.path.join(directory, f'{page_name}{number:02}.'
+                                  f'{section}'), 'w') as page:
+            page.write(source.read())
+            page.write(f'\n.\\" {number}\n')
+
+
+@contextlib.contextmanager
+def slow_storage(latency):
+    """
+    Добавляет задержку к открытию страницы и к завершению записи html
+    """
+    open_page = file_manager.open_page
+    close_writer = file_manager.OutputWriter.__exit__
+
+    @contextlib.contextmanager
+    def slow_open_page(file_name):
+        time.sleep(latency)
+        with open_page(file_name) as man_page:
+            yield man_page
+
+    def slow_close_writer(self, *args):
+        time.sleep(latency)
+        return close_writer(self, *args)
+
+    file_manager.open_page = slow_open_page
+    file_manager.OutputWriter.__exit__ = slow_close_writer
+    try:
+        yield
+    finally:
+        file_manager.open_page = open_page
+        file_manager.OutputWriter.__exit__ = close_writer
+
+
+def main():
+    """
+    Сравнивает время последовательной и конвейерной конвертаций директорий
+    без задержек и с задержками ввода-вывода, и выводит загрузку этапов
+    конвейера
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_dir = os.path.join(temp_dir, 'man')
+        os.mkdir(input_dir)
+        make_corpus(input_dir)
+
+        for latency in latencies:
+            for pipelined in (False, True):
+                metrics = Metrics()
+                output_dir = os.path.join(temp_dir,
+                                          f'{latency}-{pipelined}')
+                with slow_storage(latency):
+                    start = time.perf_counter()
+                    batch.convert_directory(input_dir, output_dir,
+                                            'main.css', metrics=metrics,
+                                            aliases=None,
+                                            pipelined=pipelined)
+                    seconds = time.perf_counter() - start
+                mode = 'pipeline' if pipelined else 'sequential'
+                print(f'latency {latency * 1e3:>3.0f} ms {mode:<12}'
+                      f'{seconds * 1e3:>8.1f} ms')
+                if not pipelined:
+                    continue
+                for stage in batch.pipeline_stages:
+                    busy = metrics.pipeline_seconds.get(stage=stage,
+                                                        state='busy')
+                    total = sum(metrics.pipeline_seconds.get(
+                        stage=stage, state=state)
+                        for state in pipeline.states)
+                    print(f'    {stage:<8} busy {busy / total:>5.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.utils import batch, scheduler
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+
+def make_corpus(directory):
+    """
+    Смешанный корпус: много маленьких страниц и две большие, самая большая
+    (gcc.1) - последняя в порядке обхода
+    """
+    for number in range(24):
+        for name in ('chmod.2', 'python.1'):
+            page_name, section = name.split('.')
+            # разное содержимое, чтобы страницы не стали псевдонимами
+            with open(os.path.join(man_dir, name)) as source, \
+                    open(os.path.join(directory, f'{page_name}{number:02}.'
+                                      f'{section}'), 'w') as page:
+                page.write(source.read())
+                page.write(f'\n.\\" {number}\n')
+    shutil.copy(os.path.join(man_dir, 'bash.1'),
+                os.path.join(directory, 'bash.1'))
+    shutil.copy(os.path.join(man_dir, 'gcc.1'),
+                os.path.join(directory, 'zz-gcc.1'))
+
+
+def main():
+    """
+    Сравнивает время пакетной конвертаций смешанного корпуса при запуске
+    от больших страниц к маленьким и в порядке обхода (FIFO), а также
+    модельное время (длительность задачи = размер страницы)
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_dir = os.path.join(temp_dir, 'man')
+        os.mkdir(input_dir)
+        make_corpus(input_dir)
+        pages = sorted(os.path.join(input_dir, p)
+                       for p in os.listdir(input_dir))
+
+        for jobs in (2, 4):
+            for policy in scheduler.policies:
+                output_dir = os.path.join(temp_dir, f'{policy}{jobs}')
+                start = time.perf_counter()
+                batch.convert_directory(input_dir, output_dir, 'main.css',
+                                        aliases=None, jobs=jobs,
+                                        policy=policy)
+                seconds = time.perf_counter() - start
+                model = scheduler.simulate(
+                    scheduler.make_tasks(pages, policy), jobs)
+                print(f'jobs={jobs} {policy:<10}{seconds * 1e3:>10.1f} ms '
+                      f'   model {model / 1024:>8.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
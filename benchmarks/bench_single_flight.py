@@ -0,0 +1,60 @@
+import concurrent.futures
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.utils.server import PageService
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+
+def burst(service, page, requests):
+    """
+    Одновременно запрашивает страницу из requests потоков
+    """
+    barrier = threading.Barrier(requests)
+
+    def request(_):
+        barrier.wait()
+        return service.get_page(page)
+
+    with concurrent.futures.ThreadPoolExecutor(requests) as executor:
+        list(executor.map(request, range(requests)))
+
+
+def main(bursts=5, requests=32):
+    """
+    Нагрузочный тест: всплески одновременных запросов популярной страницы
+    (bash.1) сразу после её изменения, то есть промаха кеша. Сравнивает
+    процессорное время сервера с объединением конвертаций и без него
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        page = os.path.join(temp_dir, 'bash.1')
+        shutil.copyfile(os.path.join(man_dir, 'bash.1'), page)
+
+        for coalesce in (False, True):
+            service = PageService(temp_dir, 'main.css', coalesce=coalesce)
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            for number in range(bursts):
+                # новая версия страницы - новый ключ кеша
+                os.utime(page, ns=(number, number))
+                burst(service, page, requests)
+            cpu = time.process_time() - cpu_start
+            seconds = time.perf_counter() - start
+
+            metrics = service.metrics
+            mode = 'coalesce' if coalesce else 'no coalesce'
+            print(f'{mode:<12} запросов {bursts * requests}, конвертаций '
+                  f'{metrics.pages_converted.get():>4.0f}, объединено '
+                  f'{metrics.coalesced_requests.get(role="follower"):>4.0f}'
+                  f', процессор {cpu:6.2f} с, время {seconds:6.2f} с')
+
+
+if __name__ == '__main__':
+    main()
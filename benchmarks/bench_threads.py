@@ -0,0 +1,60 @@
+import os
+import sys
+import sysconfig
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_pipeline import make_corpus
+from src.utils import batch
+
+
+def gil_enabled() -> bool:
+    """
+    :return: True, если интерпретатор выполняет потоки под GIL (сборка
+             без GIL включает его при PYTHON_GIL=1)
+    """
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    if is_gil_enabled is not None:
+        return is_gil_enabled()
+
+    return not sysconfig.get_config_var('Py_GIL_DISABLED')
+
+
+def main(max_jobs=None):
+    """
+    Сравнивает масштабирование конвертаций директорий по числу потоков
+    (threads) и процессов: от 1 до max_jobs (по умолчанию - количество
+    процессоров, но не больше 8)
+
+    Под GIL потоки почти не ускоряют конвертацию, без GIL - ускоряют
+    так же, как процессы, но без копирования страниц между процессами
+    """
+    if max_jobs is None:
+        max_jobs = min(os.cpu_count() or 1, 8)
+    print(f'Python {sys.version.split()[0]}, '
+          f'GIL {"on" if gil_enabled() else "off"}, '
+          f'процессоров: {os.cpu_count()}')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_dir = os.path.join(temp_dir, 'man')
+        os.mkdir(input_dir)
+        make_corpus(input_dir, 120)
+
+        for threads in (True, False):
+            mode = 'threads' if threads else 'processes'
+            base = None
+            for jobs in range(1, max_jobs + 1):
+                output_dir = os.path.join(temp_dir, f'{mode}-{jobs}')
+                start = time.perf_counter()
+                batch.convert_directory(input_dir, output_dir, 'main.css',
+                                        aliases=None, jobs=jobs,
+                                        threads=threads)
+                seconds = time.perf_counter() - start
+                base = base or seconds
+                print(f'{mode:<10} {jobs:>2} {seconds * 1e3:>8.1f} ms '
+                      f'x{base / seconds:.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,43 @@
+import glob
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.converters import to_html, to_whatis
+from src.utils import file_manager
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'man')
+
+
+def full_conversion(page):
+    with open(page) as man_page:
+        for _ in to_html.convert(man_page, 'main.css'):
+            pass
+
+
+def whatis_entry(page):
+    name, section = file_manager.split_page_name(page)
+    with open(page) as man_page:
+        to_whatis.get_entry(man_page, name, section)
+
+
+def main():
+    """
+    Сравнивает время полной конвертаций страниц со временем построения
+    записи whatis для каждой из встроенных man страниц
+    """
+    number = 5
+    print(f'{"page":<12}{"convert, ms":>14}{"whatis, ms":>14}{"speedup":>10}')
+    for page in sorted(glob.glob(os.path.join(man_dir, '*'))):
+        full = timeit.timeit(lambda: full_conversion(page),
+                             number=number) / number
+        whatis = timeit.timeit(lambda: whatis_entry(page),
+                               number=number) / number
+        print(f'{os.path.basename(page):<12}{full * 1000:>14.2f}'
+              f'{whatis * 1000:>14.3f}{full / whatis:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,282 @@
+import contextlib  # pragma: no cover
+import os  # pragma: no cover
 import sys  # pragma: no cover
+import zipfile  # pragma: no cover
+from os import path  # pragma: no cover
+from src.utils import archive  # pragma: no cover
 from src.utils import arg_parser  # pragma: no cover
-from src.converters import to_html  # pragma: no cover
+from src.utils import batch  # pragma: no cover
+from src.utils import cpu_profile  # pragma: no cover
+from src.utils import file_manager  # pragma: no cover
+from src.utils import isolation  # pragma: no cover
+from src.utils import pipeline  # pragma: no cover
+from src.utils import server  # pragma: no cover
+from src.utils import shards  # pragma: no cover
+from src.utils.fragment_cache import FragmentCache  # pragma: no cover
+from src.utils.metrics import Metrics  # pragma: no cover
+from src.utils.page_store import PageStore  # pragma: no cover
+from src.utils.render_cache import RenderCache  # pragma: no cover
+from src.converters import to_html, to_options, to_whatis  # pragma: no cover
 
 
 def main():  # pragma: no cover
     args = arg_parser.parse_arguments(sys.argv[1:])
 
-    with open(args.input_file) as in_file:
-        with open(args.output_file, 'w') as out_file:
-            for section in to_html.convert(in_file, args.style):
-                out_file.write(section)
+    if args.command == 'whatis':
+        build_whatis(args)
+        return
+
+    if args.command == 'options':
+        build_options(args)
+        return
+
+    if args.command == 'serve':
+        serve(args)
+        return
+
+    if args.command == 'merge':
+        merge(args)
+        return
+
+    if args.command == 'cache':
+        manage_cache(args)
+        return
+
+    metrics = Metrics()
+
+    run = store_pages if args.db else convert
+    if args.cpu_profile:
+        with cpu_profile.CpuProfiler(args.cpu_profile_mode) as profiler:
+            run(args, metrics, profiler)
+            folded_file = profiler.write(args.cpu_profile)
+            print(f'профиль: {args.cpu_profile}, стеки: {folded_file} '
+                  f'({profiler.samples} выборок)', file=sys.stderr)
+    else:
+        run(args, metrics)
+
+    if args.metrics_file:
+        metrics.write(args.metrics_file)
+
+    # страницы, превысившие ограничения (--page-*), пропущены
+    if metrics.page_failures.get():
+        sys.exit(1)
+
+
+def open_render_cache(args):  # pragma: no cover
+    if not args.render_cache:
+        return None
+
+    max_size = None
+    if args.render_cache_size is not None:
+        max_size = args.render_cache_size * 1024 * 1024
+    return RenderCache(args.render_cache, max_size)
+
+
+def page_limits(args):  # pragma: no cover
+    limits = isolation.Limits(args.page_timeout, args.page_cpu,
+                              args.page_memory)
+    if limits == isolation.no_limits:
+        return None
+
+    if limits.memory is not None:
+        limits = limits._replace(memory=limits.memory * 1024 * 1024)
+    return limits
+
+
+def convert(args, metrics, profiler=None):  # pragma: no cover
+    converter = to_html.Converter(compact=args.compact, toc=args.toc)
+    render_cache = open_render_cache(args)
+    limits = page_limits(args)
+
+    pages = None
+    if path.isdir(args.input_file) and args.shard:
+        index, count = args.shard
+        pages = shards.assign_shards(
+            file_manager.find_man_pages(args.input_file), count,
+            args.input_file)[index - 1]
+
+    if path.isdir(args.input_file) and args.output_file.endswith('.zip'):
+        archive.convert_directory(args.input_file, args.output_file,
+                                  args.style, args.stored, converter, metrics,
+                                  args.aliases != 'none', pages)
+        return
+
+    if path.isdir(args.input_file):
+        aliases = None if args.aliases == 'none' else args.aliases
+        memory_budget = None
+        if args.memory_budget is not None:
+            memory_budget = args.memory_budget * 1024 * 1024
+        fragments = None
+        if args.fragment_cache is not None:
+            fragments = FragmentCache(args.fragment_cache * 1024 * 1024)
+        batch.convert_directory(args.input_file, args.output_file,
+                                args.style, args.html, args.compress,
+                                args.manifest, converter, metrics,
+                                args.resume, aliases=aliases, pages=pages,
+                                jobs=args.jobs,
+                                memory_budget=memory_budget,
+                                policy=args.schedule,
+                                render_cache=render_cache,
+                                limits=limits, pipelined=args.pipeline,
+                                fragments=fragments, threads=args.threads,
+                                profiler=profiler)
+        print(f'сконвертировано страниц: {metrics.pages_converted.get()}, '
+              f'псевдонимов: {metrics.alias_pages.get()} '
+              f'({metrics.saved_input_bytes.get()} байт не разбиралось '
+              f'повторно)', file=sys.stderr)
+        if args.pipeline:
+            print_pipeline_report(metrics)
+        if fragments is not None:
+            print_fragment_report(metrics)
+        if metrics.page_failures.get():
+            print(f'пропущено страниц: {metrics.page_failures.get()} (см. '
+                  f'failures в манифесте)', file=sys.stderr)
+        return
+
+    options = dict(output_file=args.output_file, stylesheet=args.style,
+                   html=args.html, compress=args.compress,
+                   converter=converter, render_cache=render_cache,
+                   profiler=profiler)
+    if limits is not None:
+        try:
+            entry = isolation.run_limited(batch.convert_page,
+                                          args.input_file, limits, metrics,
+                                          **options)
+        except isolation.PageLimitError as error:
+            metrics.page_failures.inc()
+            print(error, file=sys.stderr)
+            return
+    else:
+        entry = batch.convert_page(args.input_file, metrics=metrics,
+                                   **options)
+    if args.manifest:
+        manifest_dir = path.dirname(path.abspath(args.manifest))
+        entry['files'] = [path.relpath(f, manifest_dir)
+                          for f in entry['files']]
+        output_name = path.relpath(args.output_file, manifest_dir)
+        file_manager.update_manifest(args.manifest, {output_name: entry})
+
+
+def print_pipeline_report(metrics):  # pragma: no cover
+    # этап, занятый дольше всех, - узкое место конвейера
+    for stage in batch.pipeline_stages:
+        seconds = [metrics.pipeline_seconds.get(stage=stage, state=state)
+                   for state in pipeline.states]
+        total = sum(seconds) or 1
+        busy, starved, blocked = (value / total for value in seconds)
+        print(f'{stage:<8} занят {busy:4.0%}, ждёт ввода {starved:4.0%}, '
+              f'ждёт места в очереди {blocked:4.0%}', file=sys.stderr)
+
+
+def print_fragment_report(metrics):  # pragma: no cover
+    hits = metrics.fragment_requests.get(result='hit')
+    total = hits + metrics.fragment_requests.get(result='miss')
+    # время ключей платят все разделы, поэтому экономия - за его вычетом
+    saved = metrics.fragment_seconds.get(kind='saved') - \
+        metrics.fragment_seconds.get(kind='key')
+    print(f'разделов из кеша: {hits} из {total} '
+          f'({metrics.fragment_saved_bytes.get()} байт html, '
+          f'сэкономлено {saved:.2f} с)', file=sys.stderr)
+
+
+def store_pages(args, metrics, profiler=None):  # pragma: no cover
+    profile = profiler.profile if profiler else contextlib.nullcontext
+    pages = file_manager.collect_man_pages([args.input_file])
+
+    converter = to_html.Converter(compact=args.compact)
+    with PageStore(args.db, converter=converter) as store:
+        for page in pages:
+            name, section = file_manager.split_page_name(page)
+            with open(page, 'rb') as in_file:
+                source = in_file.read()
+            metrics.input_bytes.inc(len(source))
+            # неизменившиеся страницы не конвертируются заново
+            with profile():
+                converted = store.add_man_page(name, section, source,
+                                               page)
+            if converted:
+                metrics.cache_requests.inc(result='miss')
+                metrics.pages_converted.inc()
+            else:
+                metrics.cache_requests.inc(result='hit')
+
+
+def merge(args):  # pragma: no cover
+    try:
+        if all(path.isfile(p) for p in args.inputs):
+            shards.merge_whatis(args.inputs, args.output_file)
+        else:
+            shards.merge_outputs(args.inputs, args.output_file)
+    except ValueError as error:
+        sys.exit(f'merge: {error}')
+
+
+def manage_cache(args):  # pragma: no cover
+    render_cache = RenderCache(args.directory)
+    if args.action == 'prune':
+        max_size = max_age = None
+        if args.max_size is not None:
+            max_size = args.max_size * 1024 * 1024
+        if args.max_age is not None:
+            max_age = args.max_age * 24 * 60 * 60
+        removed, removed_size = render_cache.prune(max_size, max_age)
+        print(f'удалено страниц: {removed} ({removed_size} байт)')
+
+    stats = render_cache.stats()
+    print(f'страниц: {stats.entries}, размер: {stats.size} байт')
+
+
+def serve(args):  # pragma: no cover
+    cache = server.PageCache(args.cache_size * 1024 * 1024)
+    if zipfile.is_zipfile(args.input_dir):
+        service = server.ArchivePageService(args.input_dir, args.style,
+                                            cache=cache)
+    else:
+        converter = to_html.Converter(compact=args.compact, toc=args.toc)
+        service = server.PageService(args.input_dir, args.style, converter,
+                                     cache=cache,
+                                     render_cache=open_render_cache(args),
+                                     limits=page_limits(args))
+    http_server = server.create_server(service, args.host, args.port)
+
+    print(f'http://{args.host}:{http_server.server_port}/ '
+          f'(метрики: /metrics)', file=sys.stderr)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        if args.metrics_file:
+            service.metrics.write(args.metrics_file)
+
+
+def build_whatis(args):  # pragma: no cover
+    pages = file_manager.collect_man_pages(args.input_files)
+    if args.shard:
+        index, count = args.shard
+        root = shards.common_root(args.input_files)
+        pages = shards.assign_shards(pages, count, root)[index - 1]
+
+    with open(args.output_file, 'w', encoding='utf-8') as index:
+        to_whatis.build_index(pages, index)
+
+
+def build_options(args):  # pragma: no cover
+    pages = file_manager.collect_man_pages(args.input_files)
+
+    if args.output_file == '-':
+        to_options.build_index(pages, sys.stdout)
+        return
+    with open(args.output_file, 'w', encoding='utf-8') as index:
+        to_options.build_index(pages, index)
 
 
 if __name__ == '__main__':  # pragma: no cover
-    main()
+    try:
+        main()
+    except BrokenPipeError:
+        # следующая программа конвейера закрыла стандартный вывод (например
+        # head); остаток вывода отбрасывается без трассировки
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
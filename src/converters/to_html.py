@@ -1,9 +1,43 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import types
 import typing
 from collections import namedtuple
 from os import path
 
+from src.utils.includes import IncludeResolver
+
 Section = namedtuple('Section', ['header', 'subsections'])
 Subsection = namedtuple('Subsection', ['header', 'paragraphs'])
+
+
+class Token(namedtuple('Token', ['kind', 'parts', 'text'])):
+    """
+    Строка-запрос man страницы, распознанная лексером (Converter.tokenize)
+
+    kind - вид запроса (request_kinds), parts - имя запроса (.SH, .TP, ...)
+    и его аргументы (у .SH и .SS - заголовок целиком), text - сама строка.
+    Строки текста между запросами лексер отдаёт списком
+    """
+
+    __slots__ = ()
+
+    @property
+    def request(self) -> str:
+        return self.parts[0]
+
+    @property
+    def arguments(self) -> typing.List[str]:
+        return self.parts[1:]
+
+
+# виды запросов: заголовок раздела, подраздела и начало параграфа
+request_kinds = ('section', 'subsection', 'paragraph')
+
 single_tags = {
     r'\(dq': '"',
     r'\(bv': r'|',
@@ -23,10 +57,6 @@ single_tags = {
     r"C'": r'"',
     r'\*(': r'',
     r'\|_': r'_',
-    r'\fB': r'<span class="strong">',
-    r'\fI': r'<span class="emphasis">',
-    r'\fR': r'<span class="romanic">',
-    r'\fP': r'</span>',
     r'\e': '\\',
     r'\(aq': "'",
     r'\(bu': '\u2022',
@@ -64,307 +94,980 @@ inline_tags = {
     r'.TH': r'<span class="title">{}</span>'
 }
 
-default_paragraph_indent = 4
-
-
-def convert(man_page: typing.TextIO, stylesheet: typing.AnyStr) -> \
-        typing.AnyStr:
-    """
-    Лениво конвертирует man страницу в html, секция за секцией
-    """
-    stylesheet = path.join(r'..', stylesheet)
-    yield ('<!DOCTYPE html>'
-           '<html>'
-           '<head>'
-           '<meta charset="utf-8">'
-           f'<link rel="stylesheet" href="{stylesheet}">'
-           '</head>'
-           '<body>')
-
-    for section in get_sections(man_page):
-        yield convert_section(section)
-
-    yield ('</body>'
-           '</html>')
-
-
-def convert_section(section: Section) -> typing.AnyStr:
-    """
-    Конвертирует раздел в html
-
-    :param section: раздел
-    :return: html код раздела
-    """
-
-    class_name = ((section.header if section.header else 'headless')
-                  .lower()
-                  .replace(' ', '-'))
+# шрифты (\fB, \f2, \f(CW, \f[BI] ...) и css классы их span'ов,
+# None - обычный шрифт, без span'а. Неизвестные шрифты считаются обычными,
+# \fP (и \f[]) возвращает предыдущий шрифт
+font_classes = {
+    'R': None,
+    '1': None,
+    'I': 'emphasis',
+    '2': 'emphasis',
+    'B': 'strong',
+    '3': 'strong',
+    'BI': 'strong emphasis',
+    '4': 'strong emphasis',
+    'C': 'monospace',
+    'CW': 'monospace',
+    'CR': 'monospace',
+    'CB': 'monospace strong',
+    'CI': 'monospace emphasis',
+}
 
-    container_open_tag = f'<div class="section-{class_name} section">'
+# символы, с которых начинаются строки запросов roff
+control_characters = ('.', "'")
 
-    header_tag = f'<h1 class="section-header">{section.header}</h1>'
+font_pattern = re.compile(r'\\f(?:\((..)|\[([^\]]*)\]|(.))')
 
-    subsections = '\n'.join(convert_subsection(s) for s in section.subsections)
+default_paragraph_indent = 4
 
-    container_close_tag = '</div>'
+# версия разметки; увеличивается при изменениях конвертера, меняющих html,
+# чтобы сохранённые результаты (render_cache) стали недействительными
+converter_version = 3
+
+# отступы, для которых в стилях есть классы iN (см. indent_stylesheet);
+# в компактном режиме вместо style="padding-left: Nem" ставится класс
+compact_indents = range(1, 25)
+
+# короткие имена css классов компактного режима (в стилях у каждого правила
+# есть оба имени)
+compact_class_names = {
+    'section-header': 'sh',
+    'subsection-header': 'ssh',
+    'simple-paragraph': 'p',
+    'hanging-paragraph': 'hp',
+    'indented-paragraph': 'ip',
+    'tagged-paragraph': 'tp',
+    'indented-paragraph-container': 'ipc',
+    'tagged-paragraph-container': 'tpc',
+    'hang': 'h',
+    'hang-tag': 'ht',
+    'strong': 'fb',
+    'emphasis': 'fi',
+    'monospace': 'fc',
+}
 
-    return '\n'.join([container_open_tag, header_tag,
-                      subsections, container_close_tag])
+simple_paragraph_tags = ('.LP', '.PP', '.P')
+paragraph_tags = simple_paragraph_tags + ('.HP', '.TP', '.IP')
 
 
-def convert_subsection(subsection: Subsection) -> typing.AnyStr:
+class FontState:
     """
-    Конвертирует подраздел в html
+    Текущий и предыдущий шрифт внутри параграфа
 
-    :param subsection: подраздел
-    :return: html код подраздела
+    Шрифт, заданный в одной строке, действует и в следующих строках
+    параграфа, пока его не сменят
     """
 
-    class_name = ((subsection.header if subsection.header else 'headless')
-                  .lower()
-                  .replace(' ', '-'))
-
-    container_open_tag = f'<div class="subsection-{class_name} subsection">'
+    __slots__ = ('current', 'previous')
 
-    header_tag = (f'<h2 class="subsection-header">'
-                  f'{subsection.header}</h2>')
+    def __init__(self, current: str = 'R', previous: str = 'R'):
+        self.current = current
+        self.previous = previous
 
-    paragraphs = '\n'.join(convert_paragraph(p) for p in subsection.paragraphs)
+    def select(self, font: str):
+        """
+        Переключает шрифт; 'P' и '' - возврат к предыдущему
+        """
+        if font in ('P', ''):
+            font = self.previous
+        self.previous, self.current = self.current, font
 
-    container_close_tag = '</div>'
 
-    return '\n'.join([container_open_tag, header_tag,
-                      paragraphs, container_close_tag])
+TocEntry = namedtuple('TocEntry', ['anchor', 'header', 'children'])
 
+anchor_pattern = re.compile(r'\W+')
 
-def convert_paragraph(paragraph) -> typing.AnyStr:
-    """
-    Конвертирует параграф в html
+# экранирования, которые не входят в id: размер и шрифт (\s-1, \fB, ...),
+# а у строк (\*(C+, \*x) остаётся имя
+anchor_escape_pattern = re.compile(
+    r'\\s[-+]?\d+|\\f(?:\(..|\[[^\]]*\]|.)|\\\*(?:\((..)|(.))')
 
-    :param paragraph: параграф
-    :return: html код параграфа
-    """
-    if isinstance(paragraph, SimpleParagraph):
-        return convert_simple_paragraph(paragraph)
-    elif isinstance(paragraph, HangingParagraph):
-        return convert_hanging_paragraph(paragraph)
-    elif isinstance(paragraph, IndentedParagraph):
-        return convert_indented_paragraph(paragraph)
-    elif isinstance(paragraph, TaggedParagraph):
-        return convert_tagged_paragraph(paragraph)
-    else:
-        return ''
+# строки, которые определяет преамбула pod2man
+anchor_strings = {'C+': 'C++'}
 
 
-def convert_simple_paragraph(simple_paragraph) -> typing.AnyStr:
+def make_anchor(header: str) -> str:
     """
-    Конвертирует обычный параграф в html
-
-    :param simple_paragraph: обычный параграф
-    :return: html код параграфа
+    :return: id для заголовка: слова заголовка в нижнем регистре через
+             дефис, например "SEE ALSO" -> "see-also", "C++" -> "cpp"
     """
-    open_tag = '<p class="simple-paragraph paragraph">'
-    converted = ' '.join(convert_line(l) for l in simple_paragraph.content)
-    close_tag = '</p>'
+    def replace_escape(match):
+        name = match.group(1) or match.group(2) or ''
+        return anchor_strings.get(name, name)
 
-    return ''.join([open_tag, converted, close_tag])
+    header = anchor_escape_pattern.sub(replace_escape, header)
+    header = header.replace('+', 'p').lower()
 
+    return anchor_pattern.sub('-', header).strip('-_') or 'section'
 
-def convert_hanging_paragraph(hanging_paragraph) -> typing.AnyStr:
-    """
-    Конвертирует висячий параграф в html
 
-    :param hanging_paragraph: висячий параграф
-    :return: html код параграфа
+class Anchors:
     """
-    indent = hanging_paragraph.indent
-    if not indent:
-        indent = default_paragraph_indent
-
-    hanging_line = hanging_paragraph.hang
-    if not hanging_line:
-        hanging_line = ''
-    hanging_line = convert_line(hanging_line)
-    hanging_line_tag = f'<span class="hang">{hanging_line}</span>'
-
-    open_tag = (f'<p class="hanging-paragraph paragraph" '
-                f'style="padding-left: {indent}em">')
-    converted = ' '.join(convert_line(l) for l in hanging_paragraph.content)
-    close_tag = '</p>'
+    Якоря разделов и подразделов одной страницы и оглавление по ним
 
-    return ''.join([hanging_line_tag, open_tag, converted, close_tag])
-
-
-def convert_indented_paragraph(indented_paragraph) -> typing.AnyStr:
+    id зависят только от заголовков и их порядка, поэтому не меняются от
+    конвертаций к конвертаций. id подраздела начинается с id раздела,
+    повторяющиеся id получают суффикс -2, -3, ...
     """
-    Конвертирует параграф с отступом в html
 
-    :param indented_paragraph: параграф с отступом
-    :return: html код параграфа
+    __slots__ = ('entries', '_used')
+
+    def __init__(self):
+        self.entries = []
+        self._used = set()
+
+    def add(self, header: str, parent: TocEntry = None) -> TocEntry:
+        """
+        Добавляет заголовок в оглавление
+
+        :param header: заголовок раздела или подраздела
+        :param parent: запись раздела, если это подраздел
+        :return: запись оглавления с уникальным id
+        """
+        anchor = make_anchor(header)
+        if parent is not None:
+            anchor = f'{parent.anchor}--{anchor}'
+
+        unique_anchor = anchor
+        number = 1
+        while unique_anchor in self._used:
+            number += 1
+            unique_anchor = f'{anchor}-{number}'
+        self._used.add(unique_anchor)
+
+        entry = TocEntry(unique_anchor, header, [])
+        (parent.children if parent is not None
+         else self.entries).append(entry)
+
+        return entry
+
+    def add_section(self, section: Section) -> typing.List[TocEntry]:
+        """
+        Добавляет записи раздела и его подразделов так же, как
+        Converter.convert_section
+
+        :return: добавленные записи по порядку
+        """
+        entries = []
+        section_entry = None
+        if section.header:
+            section_entry = self.add(section.header)
+            entries.append(section_entry)
+        for subsection in section.subsections:
+            if subsection.header:
+                entries.append(self.add(subsection.header, section_entry))
+
+        return entries
+
+
+class ReplayAnchors:
     """
-    hang_tag = indented_paragraph.hang_tag
-    if not hang_tag:
-        hang_tag = ''
-    hang_tag = convert_line(hang_tag)
-
-    indent = indented_paragraph.indent
-    if not indent:
-        indent = default_paragraph_indent
-
-    converted = ' '.join(convert_line(l) for l in indented_paragraph.content)
-
-    container_open_tag = '<div class="indented-paragraph-container">'
-
-    hang_tag_tag = f'<span class="hang-tag">{hang_tag}</span>'
-
-    paragraph = (f'<p class="indented-paragraph paragraph" '
-                 f'style="padding-left: {indent}em">'
-                 f'{converted}'
-                 f'</p>')
-
-    container_close_tag = '</div>'
-
-    return ''.join([container_open_tag,
-                    hang_tag_tag, paragraph, container_close_tag])
-
-
-def convert_tagged_paragraph(tagged_paragraph) -> typing.AnyStr:
+    Отдаёт convert_section уже добавленные в якоря страницы записи в том же
+    порядке, в котором она их добавляет
     """
-    Конвертирует параграф с биркой в html
-
-    :param tagged_paragraph: параграф с биркой
-    :return: html код параграфа
-    """
-    tag = tagged_paragraph.hang_tag
-    if not tag:
-        tag = ''
-    tag = convert_line(tag)
-
-    indent = tagged_paragraph.indent
-    if not indent:
-        indent = default_paragraph_indent
 
-    converted = ' '.join(convert_line(l) for l in tagged_paragraph.content)
+    __slots__ = ('_entries',)
 
-    container_open_tag = '<div class="tagged-paragraph-container">'
+    def __init__(self, entries: typing.Iterable[TocEntry]):
+        self._entries = iter(entries)
 
-    tag_tag = f'<span class="hang-tag">{tag}</span>'
+    def add(self, header: str, parent: TocEntry = None) -> TocEntry:
+        return next(self._entries)
 
-    paragraph = (f'<p class="tagged-paragraph paragraph" '
-                 f'style="padding-left: {indent}em">'
-                 f'{converted}'
-                 f'</p>')
+    def add_section(self, section: Section) -> typing.List[TocEntry]:
+        # записи отдаются по разделу, поэтому это все оставшиеся
+        return list(self._entries)
 
-    container_close_tag = '</div>'
 
-    return ''.join([container_open_tag, tag_tag,
-                    paragraph, container_close_tag])
-
-
-def convert_line(line: typing.AnyStr) -> typing.AnyStr:
+class Converter:
     """
-    Конвертирует одну строку
-
-    :param line: строка для конвертаций
-    :return: сконвертированная строка с требуемым отступом
+    Конвертер man страниц в html с заданными таблицами тегов
+
+    Таблицы тегов копируются и компилируются один раз при создании:
+    однострочные теги - в кортеж пар для последовательных замен, строчные
+    теги - в одно регулярное выражение, которое находит первый (в порядке
+    таблицы) тег, с которого начинается строка. Смена шрифтов (\\fB, \\fP,
+    ...) отслеживается в пределах параграфа и превращается в
+    сбалансированные span'ы. После создания конвертер не
+    меняется, поэтому один экземпляр можно использовать из нескольких
+    потоков одновременно и передавать в другие процессы (pickle)
     """
-    line = line.replace('<', '&lt;') \
-        .replace('>', '&gt;')
-
-    for tag, value in single_tags.items():
-        line = line.replace(tag, value)
-
-    for tag, value in inline_tags.items():
-        if line.startswith(tag):
-            line = value.format(line[len(tag):].strip())
-
-    return line
 
+    __slots__ = ('single_tags', 'inline_tags', 'font_classes',
+                 'simple_paragraph_tags', 'paragraph_tags', 'paragraph_indent',
+                 'compact', 'toc', '_single_tags', '_inline_pattern',
+                 '_separator',
+                 '_class_names', '_font_spans')
+
+    def __init__(self,
+                 single_tags: typing.Mapping[str, str] = single_tags,
+                 inline_tags: typing.Mapping[str, str] = inline_tags,
+                 font_classes: typing.Mapping[str, typing.Optional[str]] =
+                 font_classes,
+                 simple_paragraph_tags: typing.Iterable[str] =
+                 simple_paragraph_tags,
+                 paragraph_tags: typing.Iterable[str] = paragraph_tags,
+                 paragraph_indent: int = default_paragraph_indent,
+                 compact: bool = False,
+                 toc: bool = False):
+        """
+        :param single_tags: теги, заменяемые в любом месте строки
+        :param inline_tags: теги в начале строки и шаблоны их замены,
+                            {} в шаблоне заменяется остатком строки
+        :param font_classes: шрифты и css классы их span'ов; если таблица
+                             пуста, смена шрифтов не отслеживается
+        :param simple_paragraph_tags: теги обычных параграфов
+        :param paragraph_tags: теги, начинающие новый параграф
+        :param paragraph_indent: отступ параграфов (в em), если он не задан
+        :param compact: компактная разметка: короткие имена классов
+                        (compact_class_names), отступы - классами iN
+                        вместо атрибутов style, без общих классов section,
+                        subsection и paragraph, комментариев, пустых
+                        заголовков и бирок и переводов строк между
+                        элементами
+        :param toc: навигация: у разделов и подразделов с заголовками есть
+                    id, они сворачиваются (<details open>), а в конце
+                    страницы выводится оглавление
+        """
+        self.single_tags = types.MappingProxyType(dict(single_tags))
+        self.inline_tags = types.MappingProxyType(dict(inline_tags))
+        self.font_classes = types.MappingProxyType(dict(font_classes))
+        self.simple_paragraph_tags = frozenset(simple_paragraph_tags)
+        self.paragraph_tags = tuple(paragraph_tags)
+        self.paragraph_indent = paragraph_indent
+        self.compact = compact
+        self.toc = toc
+        self._separator = '' if compact else '\n'
+        self._class_names = compact_class_names if compact else {}
+        # css классы span'ов шрифтов, уже с учётом компактного режима
+        self._font_spans = {
+            font: ' '.join(self._class_name(c) for c in css_class.split())
+            for font, css_class in self.font_classes.items() if css_class}
+
+        self._single_tags = tuple(self.single_tags.items())
+        # альтернативы регулярного выражения проверяются слева направо,
+        # поэтому находится первый по порядку таблицы подходящий тег
+        self._inline_pattern = None
+        if self.inline_tags:
+            self._inline_pattern = re.compile('|'.join(
+                re.escape(tag) for tag in self.inline_tags))
+
+    def __reduce__(self):
+        return Converter, (dict(self.single_tags), dict(self.inline_tags),
+                           dict(self.font_classes),
+                           tuple(self.simple_paragraph_tags),
+                           self.paragraph_tags, self.paragraph_indent,
+                           self.compact, self.toc)
+
+    def fingerprint(self) -> str:
+        """
+        :return: хеш версии конвертера и его настроек: у конвертеров с
+                 одинаковым отпечатком одинаковый html
+        """
+        # порядок элементов frozenset зависит от PYTHONHASHSEED, а отпечаток
+        # должен совпадать во всех процессах
+        settings = (converter_version, dict(self.single_tags),
+                    dict(self.inline_tags), dict(self.font_classes),
+                    sorted(self.simple_paragraph_tags), self.paragraph_tags,
+                    self.paragraph_indent, self.compact, self.toc)
+        return hashlib.sha256(repr(settings).encode('utf-8')).hexdigest()
+
+    def convert(self, man_page: typing.TextIO, stylesheet: typing.AnyStr,
+                stage: typing.Callable[[str], typing.ContextManager] =
+                contextlib.nullcontext,
+                fragments=None) -> typing.AnyStr:
+        """
+        Лениво конвертирует man страницу в html, секция за секцией
+
+        :param man_page: man страница
+        :param stylesheet: css файл
+        :param stage: фабрика контекстных менеджеров, которой оборачивается
+                      каждый этап конвертаций: stage('get_sections') - разбор
+                      очередного раздела, stage('convert_section') - его
+                      конвертация. Используется для замеров времени и памяти
+        :param fragments: кеш html разделов, общий для страниц
+                          (fragment_cache.FragmentCache), None - без него
+        """
+        stylesheet = path.join(r'..', stylesheet)
+        yield ('<!DOCTYPE html>'
+               '<html>'
+               '<head>'
+               '<meta charset="utf-8">'
+               f'<link rel="stylesheet" href="{stylesheet}">'
+               '</head>'
+               '<body>')
+
+        sections = self.get_sections(man_page)
+        anchors = None
+        if self.toc:
+            # оглавление выводится перед разделами, чтобы показываться
+            # первым и без поддержки :has() в браузере, поэтому страница
+            # разбирается на разделы целиком до конвертаций. Якоря
+            # раздаются по порядку и при конвертаций воспроизводятся
+            with stage('get_sections'):
+                sections = list(sections)
+            toc_anchors = Anchors()
+            anchors = iter([ReplayAnchors(toc_anchors.add_section(s))
+                            for s in sections])
+            sections = iter(sections)
+            yield self.convert_toc(toc_anchors)
+
+        while True:
+            with stage('get_sections'):
+                section = next(sections, None)
+            if section is None:
+                break
+            section_anchors = next(anchors) if anchors is not None else None
+
+            with stage('convert_section'):
+                if fragments is not None:
+                    converted = fragments.convert_section(
+                        self, section, section_anchors)
+                else:
+                    converted = self.convert_section(section,
+                                                     section_anchors)
+            yield converted
+
+        yield ('</body>'
+               '</html>')
+
+    def convert_section(self, section: Section,
+                        anchors: Anchors = None) -> typing.AnyStr:
+        """
+        Конвертирует раздел в html
+
+        :param section: раздел
+        :param anchors: якоря страницы; если заданы, раздел с заголовком
+                        получает id и сворачивается
+        :return: html код раздела
+        """
+
+        class_name = ((section.header if section.header else 'headless')
+                      .lower()
+                      .replace(' ', '-'))
+
+        entry = None
+        if anchors is not None and section.header:
+            entry = anchors.add(section.header)
+
+        container_open_tag = self._container_open_tag(
+            f'section-{class_name}', 'section', entry)
+
+        header_tag = (f'<h1 class="{self._class_name("section-header")}">'
+                      f'{section.header}</h1>')
+        if self.compact and not section.header:
+            header_tag = ''
+        if entry is not None:
+            header_tag = f'<summary>{header_tag}</summary>'
+
+        subsections = self._separator.join(
+            self.convert_subsection(s, anchors, entry)
+            for s in section.subsections)
+
+        container_close_tag = '</details>' if entry is not None else '</div>'
+
+        return self._separator.join(
+            part for part in [container_open_tag, header_tag,
+                              subsections, container_close_tag]
+            if part or not self.compact)
+
+    def convert_subsection(self, subsection: Subsection,
+                           anchors: Anchors = None,
+                           section_entry: TocEntry = None) -> typing.AnyStr:
+        """
+        Конвертирует подраздел в html
+
+        :param subsection: подраздел
+        :param anchors: якоря страницы; если заданы, подраздел с заголовком
+                        получает id и сворачивается
+        :param section_entry: запись оглавления раздела подраздела
+        :return: html код подраздела
+        """
+
+        class_name = ((subsection.header if subsection.header else 'headless')
+                      .lower()
+                      .replace(' ', '-'))
+
+        entry = None
+        if anchors is not None and subsection.header:
+            entry = anchors.add(subsection.header, section_entry)
+
+        container_open_tag = self._container_open_tag(
+            f'subsection-{class_name}', 'subsection', entry)
+
+        header_tag = (f'<h2 class="{self._class_name("subsection-header")}">'
+                      f'{subsection.header}</h2>')
+        if self.compact and not subsection.header:
+            header_tag = ''
+        if entry is not None:
+            header_tag = f'<summary>{header_tag}</summary>'
+
+        paragraphs = self._separator.join(self.convert_paragraph(p)
+                                          for p in subsection.paragraphs)
+
+        container_close_tag = '</details>' if entry is not None else '</div>'
+
+        return self._separator.join(
+            part for part in [container_open_tag, header_tag,
+                              paragraphs, container_close_tag]
+            if part or not self.compact)
+
+    def convert_paragraph(self, paragraph) -> typing.AnyStr:
+        """
+        Конвертирует параграф в html
+
+        :param paragraph: параграф
+        :return: html код параграфа
+        """
+        if isinstance(paragraph, SimpleParagraph):
+            return self.convert_simple_paragraph(paragraph)
+        elif isinstance(paragraph, HangingParagraph):
+            return self.convert_hanging_paragraph(paragraph)
+        elif isinstance(paragraph, IndentedParagraph):
+            return self.convert_indented_paragraph(paragraph)
+        elif isinstance(paragraph, TaggedParagraph):
+            return self.convert_tagged_paragraph(paragraph)
+        else:
+            return ''
+
+    def convert_simple_paragraph(self, simple_paragraph) -> typing.AnyStr:
+        """
+        Конвертирует обычный параграф в html
+
+        :param simple_paragraph: обычный параграф
+        :return: html код параграфа
+        """
+        open_tag = self._paragraph_open_tag('simple-paragraph')
+        converted = self.convert_lines(simple_paragraph.content)
+        close_tag = '</p>'
+
+        return ''.join([open_tag, converted, close_tag])
+
+    def convert_hanging_paragraph(self, hanging_paragraph) -> typing.AnyStr:
+        """
+        Конвертирует висячий параграф в html
+
+        :param hanging_paragraph: висячий параграф
+        :return: html код параграфа
+        """
+        indent = hanging_paragraph.indent
+        if not indent:
+            indent = self.paragraph_indent
+
+        font = FontState()
+
+        hanging_line = hanging_paragraph.hang
+        if not hanging_line:
+            hanging_line = ''
+        hanging_line = self.convert_line(hanging_line, font)
+        hanging_line_tag = (f'<span class="{self._class_name("hang")}">'
+                            f'{hanging_line}</span>')
+        if self.compact and not hanging_line:
+            hanging_line_tag = ''
+
+        open_tag = self._paragraph_open_tag('hanging-paragraph', indent)
+        converted = self.convert_lines(hanging_paragraph.content, font)
+        close_tag = '</p>'
+
+        return ''.join([hanging_line_tag, open_tag, converted, close_tag])
+
+    def convert_indented_paragraph(self, indented_paragraph) -> \
+            typing.AnyStr:
+        """
+        Конвертирует параграф с отступом в html
+
+        :param indented_paragraph: параграф с отступом
+        :return: html код параграфа
+        """
+        font = FontState()
+
+        hang_tag = indented_paragraph.hang_tag
+        if not hang_tag:
+            hang_tag = ''
+        hang_tag = self.convert_line(hang_tag, font)
+
+        indent = indented_paragraph.indent
+        if not indent:
+            indent = self.paragraph_indent
+
+        converted = self.convert_lines(indented_paragraph.content, font)
+
+        container_open_tag = self._container_open_tag(
+            'indented-paragraph-container')
+
+        hang_tag_tag = (f'<span class="{self._class_name("hang-tag")}">'
+                        f'{hang_tag}</span>')
+        if self.compact and not hang_tag:
+            hang_tag_tag = ''
+
+        paragraph = (self._paragraph_open_tag('indented-paragraph', indent) +
+                     f'{converted}'
+                     f'</p>')
+
+        container_close_tag = '</div>'
+
+        return ''.join([container_open_tag,
+                        hang_tag_tag, paragraph, container_close_tag])
+
+    def convert_tagged_paragraph(self, tagged_paragraph) -> typing.AnyStr:
+        """
+        Конвертирует параграф с биркой в html
+
+        :param tagged_paragraph: параграф с биркой
+        :return: html код параграфа
+        """
+        font = FontState()
+
+        tag = tagged_paragraph.hang_tag
+        if not tag:
+            tag = ''
+        tag = self.convert_line(tag, font)
+
+        indent = tagged_paragraph.indent
+        if not indent:
+            indent = self.paragraph_indent
+
+        converted = self.convert_lines(tagged_paragraph.content, font)
+
+        container_open_tag = self._container_open_tag(
+            'tagged-paragraph-container')
+
+        tag_tag = (f'<span class="{self._class_name("hang-tag")}">'
+                   f'{tag}</span>')
+        if self.compact and not tag:
+            tag_tag = ''
+
+        paragraph = (self._paragraph_open_tag('tagged-paragraph', indent) +
+                     f'{converted}'
+                     f'</p>')
+
+        container_close_tag = '</div>'
+
+        return ''.join([container_open_tag, tag_tag,
+                        paragraph, container_close_tag])
+
+    def _class_name(self, class_name: str) -> str:
+        return self._class_names.get(class_name, class_name)
+
+    def convert_toc(self, anchors: Anchors) -> typing.AnyStr:
+        """
+        Конвертирует оглавление в html
+
+        :param anchors: якоря страницы
+        :return: html код оглавления
+        """
+        return (f'<nav class="toc">'
+                f'{self._toc_list(anchors.entries)}'
+                f'</nav>')
+
+    def _toc_list(self, entries: typing.List[TocEntry]) -> str:
+        items = ''.join(
+            f'<li><a href="#{e.anchor}">{e.header}</a>'
+            f'{self._toc_list(e.children) if e.children else ""}</li>'
+            for e in entries)
+
+        return f'<ul>{items}</ul>'
+
+    def _container_open_tag(self, class_name: str,
+                            common_class: str = None,
+                            entry: TocEntry = None) -> str:
+        class_name = self._class_name(class_name)
+        if not self.compact and common_class:
+            class_name = f'{class_name} {common_class}'
+        if entry is not None:
+            return f'<details open class="{class_name}" id="{entry.anchor}">'
+
+        return f'<div class="{class_name}">'
+
+    def _paragraph_open_tag(self, class_name: str, indent: int = None) -> \
+            str:
+        if not self.compact:
+            if indent is None:
+                return f'<p class="{class_name} paragraph">'
+            return (f'<p class="{class_name} paragraph" '
+                    f'style="padding-left: {indent}em">')
+
+        class_name = self._class_name(class_name)
+        if indent is None:
+            return f'<p class="{class_name}">'
+        if indent in compact_indents:
+            return f'<p class="{class_name} i{indent}">'
+        return f'<p class="{class_name}" style="padding-left:{indent}em">'
+
+    def convert_lines(self, lines: typing.Iterable[str],
+                      font: FontState = None) -> typing.AnyStr:
+        """
+        Конвертирует строки параграфа и соединяет их через пробел
+
+        :param lines: строки параграфа
+        :param font: шрифт, действующий в начале первой строки; по
+                     умолчанию обычный
+        :return: сконвертированные строки
+        """
+        if font is None:
+            font = FontState()
+
+        converted = (self.convert_line(l, font) for l in lines)
+        if self.compact:
+            return ' '.join(l for l in converted if l)
+
+        return ' '.join(converted)
+
+    def convert_line(self, line: typing.AnyStr,
+                     font: FontState = None) -> typing.AnyStr:
+        """
+        Конвертирует одну строку
+
+        :param line: строка для конвертаций
+        :param font: шрифт, действующий в начале строки; меняется, если в
+                     строке есть смены шрифта. По умолчанию обычный
+        :return: сконвертированная строка с требуемым отступом
+        """
+        line = line.replace('<', '&lt;') \
+            .replace('>', '&gt;')
+        if font is None:
+            font = FontState()
+
+        # запрос в начале строки ищется до span'ов шрифта: шрифт,
+        # перешедший с предыдущей строки, действует только на текст
+        # аргумента запроса
+        match = None
+        if self._inline_pattern is not None:
+            match = self._inline_pattern.match(line)
+        if match:
+            tag = match.group()
+            template = self.inline_tags[tag]
+            comment = template.startswith('<!--')
+            if self.compact and comment:
+                # комментарии в компактной разметке не нужны
+                return ''
+            argument = line[len(tag):].strip()
+            if self.font_classes and not comment and '{}' in template:
+                argument = self.convert_fonts(argument, font)
+
+            return template.format(self._replace_single_tags(argument))
+
+        # остальные запросы (.sp ...) в span шрифта не оборачиваются
+        if self.font_classes and (not line.startswith(control_characters)
+                                  or '\\f' in line):
+            line = self.convert_fonts(line, font)
+
+        return self._replace_single_tags(line)
+
+    def _replace_single_tags(self, line: str) -> str:
+        for tag, value in self._single_tags:
+            line = line.replace(tag, value)
+
+        return line
+
+    def convert_fonts(self, line: typing.AnyStr, font: FontState) -> \
+            typing.AnyStr:
+        """
+        Заменяет смены шрифта в строке span'ами
+
+        Span'ы строки всегда сбалансированы: шрифт, действующий в начале
+        строки, открывается заново, открытый span закрывается в конце
+        строки. Span открывается только перед непустым текстом, поэтому
+        пустых и вложенных span'ов не бывает
+
+        :param line: строка
+        :param font: шрифт, действующий в начале строки, меняется по ходу
+        :return: строка со span'ами
+        """
+        if '\\f' not in line:
+            css_class = self._font_spans.get(font.current)
+            if css_class and line:
+                return f'<span class="{css_class}">{line}</span>'
+            return line
+
+        parts = []
+        opened = None
+        position = 0
+        for match in font_pattern.finditer(line):
+            text = line[position:match.start()]
+            if text:
+                opened = self._switch_span(parts, opened, font)
+                parts.append(text)
+
+            name = match.group(1) or match.group(2) or match.group(3) or ''
+            font.select(name)
+            position = match.end()
+
+        text = line[position:]
+        if text:
+            opened = self._switch_span(parts, opened, font)
+            parts.append(text)
+        if opened:
+            parts.append('</span>')
+
+        return ''.join(parts)
+
+    def _switch_span(self, parts: typing.List[str],
+                     opened: typing.Optional[str],
+                     font: FontState) -> typing.Optional[str]:
+        css_class = self._font_spans.get(font.current)
+        if css_class != opened:
+            if opened:
+                parts.append('</span>')
+            if css_class:
+                parts.append(f'<span class="{css_class}">')
+
+        return css_class
+
+    def tokenize(self, lines: typing.Iterable[str],
+                 kinds: typing.Container[str] = request_kinds) -> \
+            typing.Iterator[typing.Union[Token, typing.List[str]]]:
+        """
+        Лексер: за один проход классифицирует каждую строку man страницы,
+        дальше разделы, подразделы и параграфы собираются по токенам без
+        повторных проверок строк
+
+        Виды проверяются в порядке разделения страницы: строка, которая
+        начинается с .SH, - заголовок раздела, с .SS - подраздела, с
+        одного из paragraph_tags - начало параграфа. Аргументы запроса
+        параграфа разбираются здесь же. Строки текста между запросами
+        отдаются одним списком
+
+        :param lines: строки man страницы
+        :param kinds: виды запросов, которые нужно распознавать; строки
+                      остальных запросов считаются текстом
+        :return: Token для запросов и списки строк текста (без переводов
+                 строк)
+        """
+        paragraph_tags = self.paragraph_tags
+        sections = 'section' in kinds
+        subsections = 'subsection' in kinds
+        paragraphs = 'paragraph' in kinds
+        # одна проверка отсеивает почти все строки текста
+        request_tags = ((('.SH',) if sections else ()) +
+                        (('.SS',) if subsections else ()) +
+                        (paragraph_tags if paragraphs else ()))
+        text = []
+        append = text.append
+        for line in lines:
+            line = line.strip('\r\n')
+
+            if not line.startswith(request_tags):
+                append(line)
+                continue
+
+            if sections and line.startswith('.SH'):
+                token = Token('section', ['.SH', line[len('.SH '):]], line)
+            elif subsections and line.startswith('.SS'):
+                token = Token('subsection', ['.SS', line[len('.SS '):]], line)
+            elif paragraphs and line.startswith(paragraph_tags):
+                token = Token('paragraph', line.split(), line)
+            else:
+                append(line)
+                continue
+
+            if text:
+                yield text
+                text = []
+                append = text.append
+            yield token
+
+        if text:
+            yield text
+
+    def parse(self, tokens: typing.Iterable[
+            typing.Union[Token, typing.List[str]]]) -> \
+            typing.Iterator[Section]:
+        """
+        Собирает разделы из токенов лексера за один проход и лениво их
+        возвращает (раздел - после заголовка следующего раздела)
+
+        Группы строк выделяются так же, как в divide_by_tag: раздел или
+        подраздел без заголовка и строк пропускается, параграф без строк
+        тоже
+
+        :param tokens: токены (tokenize)
+        :return: раздел
+        """
+        section_header = ''
+        section_lines = False
+        subsections = []
+        subsection_header = ''
+        subsection_lines = False
+        paragraphs = []
+        parts = []
+        content = []
+
+        for token in tokens:
+            if token.__class__ is list:
+                section_lines = subsection_lines = True
+                # списки текста лексер отдаёт только между запросами, и
+                # после запроса content пуст
+                if content:
+                    content.extend(token)
+                else:
+                    content = token
+                continue
 
-def get_sections(man_page: typing.TextIO) -> Section:
-    """
-    Конструирует секций и лениво их возвращает
-
-    :param man_page: man страница
-    :return: сконструированная секция
-    """
-    for header, content in divide_into_sections(man_page):
-        header = header.strip(' "')
-        subsections = [sub for sub in get_subsections(content)]
-
-        yield Section(header, subsections)
-
-
-def get_subsections(section_content: typing.List[str]) -> Subsection:
-    """
-    Создаёт подразделы из содержимого раздела и лениво их возвращает
-
-    :param section_content: содержимое раздела
-    :return: подраздел
-    """
-    for header, content in divide_into_subsection(section_content):
-        header = header.strip(' "')
-        paragraphs = [p for p in get_paragraphs(content)]
-
-        yield Subsection(header, paragraphs)
-
-
-simple_paragraph_tags = ('.LP', '.PP', '.P')
-paragraph_tags = simple_paragraph_tags + ('.HP', '.TP', '.IP')
-
-
-def get_paragraphs(subsection_content: typing.List[str]):
-    """
-    Создаёт параграфы, определяемые .LP, .PP, .P, .HP, .IP, .TP из содержимого
-    подраздела и лениво их возвращает
-
-    :param subsection_content: содержимое подраздела
-    :return: параграф подраздела
-    """
-    header = ''
-    content = []
-    for line in subsection_content:
-        if line.startswith(paragraph_tags):
             if content:
-                yield get_paragraph(header, content)
-
-            header = line
+                paragraphs.append(self._make_paragraph(parts, content))
+            parts = []
             content = []
-            continue
-
-        content.append(line)
-
-    if content:
-        yield get_paragraph(header, content)
-
-
-SimpleParagraph = namedtuple('SimpleParagraph', ['content'])
-
 
-def get_paragraph(header: str, content: typing.List[str]):
+            if token.kind == 'paragraph':
+                section_lines = subsection_lines = True
+                parts = token.parts
+                continue
+
+            if subsection_header or subsection_lines:
+                subsections.append(Subsection(
+                    subsection_header.strip(' "'), paragraphs))
+            subsection_header = ''
+            subsection_lines = False
+            paragraphs = []
+
+            if token.kind == 'subsection':
+                section_lines = True
+                subsection_header = token.parts[1]
+                continue
+
+            if section_header or section_lines:
+                yield Section(section_header.strip(' "'), subsections)
+            section_header = token.parts[1]
+            section_lines = False
+            subsections = []
+
+        if content:
+            paragraphs.append(self._make_paragraph(parts, content))
+        if subsection_header or subsection_lines:
+            subsections.append(Subsection(subsection_header.strip(' "'),
+                                          paragraphs))
+        if section_header or section_lines:
+            yield Section(section_header.strip(' "'), subsections)
+
+    def get_sections(self, man_page: typing.TextIO) -> Section:
+        """
+        Конструирует секций и лениво их возвращает
+
+        :param man_page: man страница
+        :return: сконструированная секция
+        """
+        yield from self.parse(self.tokenize(man_page))
+
+    def extract_sections(self, man_page: typing.Iterable[str],
+                         headers: typing.Iterable[str] =
+                         ('NAME', 'SYNOPSIS')) -> typing.Dict[str, Section]:
+        """
+        Собирает только нужные разделы man страницы и прекращает чтение, как
+        только все они найдены
+
+        Остальные разделы не конвертируются: их строки пропускаются так же,
+        как их отдаёт divide_into_sections
+
+        :param man_page: man страница
+        :param headers: заголовки нужных разделов
+        :return: словарь заголовок раздела - раздел; отсутствующих в
+                 странице разделов в нём нет
+        """
+        wanted = set(headers)
+        found = {}
+        if not wanted:
+            return found
+
+        # разделы собираются целиком, но только до последнего нужного
+        for section in self.parse(self.tokenize(man_page)):
+            if section.header not in wanted or section.header in found:
+                continue
+
+            found[section.header] = section
+            if len(found) == len(wanted):
+                break
+
+        return found
+
+    def get_subsections(self, section_content: typing.List[str]) -> \
+            Subsection:
+        """
+        Создаёт подразделы из содержимого раздела и лениво их возвращает
+
+        :param section_content: содержимое раздела
+        :return: подраздел
+        """
+        tokens = self.tokenize(section_content, ('subsection', 'paragraph'))
+        for section in self.parse(tokens):
+            yield from section.subsections
+
+    def get_paragraphs(self, subsection_content: typing.List[str]):
+        """
+        Создаёт параграфы, определяемые .LP, .PP, .P, .HP, .IP, .TP из
+        содержимого подраздела и лениво их возвращает
+
+        :param subsection_content: содержимое подраздела
+        :return: параграф подраздела
+        """
+        tokens = self.tokenize(subsection_content, ('paragraph',))
+        for section in self.parse(tokens):
+            for subsection in section.subsections:
+                yield from subsection.paragraphs
+
+    def get_paragraph(self, header: str, content: typing.List[str]):
+        """
+        Определяет, создаёт и возвращает нужный тип параграфа
+
+        :param header: строка содержащяя тег определяющий параграф
+                       (.PP, .TP, .IP и.т.п) и доп. информацию
+        :param content: содержание параграфа
+        :return: параграф соответствующего типа
+        """
+        # header.split() будет пуст, когда мы возвращаем все строки
+        # до первого объявления какого-либо параграфа
+        return self._make_paragraph(header.split(), content)
+
+    def _make_paragraph(self, parts: typing.Sequence[str],
+                        content: typing.List[str]):
+        tag = parts[0] if parts else ''
+
+        if not tag or tag in self.simple_paragraph_tags:
+            return SimpleParagraph(content)
+        elif tag == '.HP':
+            return get_hanging_paragraph(parts, content)
+        elif tag == '.IP':
+            return get_indented_paragraph(parts, content)
+        elif tag == '.TP':
+            return get_tagged_paragraph(parts, content)
+
+
+def indent_stylesheet(indents: typing.Iterable[int] = compact_indents) -> \
+        str:
     """
-    Определяет, создаёт и возвращает нужный тип параграфа
+    Создаёт css правила классов отступов iN компактного режима
 
-    :param header: строка содержащяя тег определяющий параграф
-                   (.PP, .TP, .IP и.т.п) и доп. информацию
-    :param content: содержание параграфа
-    :return: параграф соответствующего типа
+    :param indents: отступы (в em)
+    :return: css код
     """
-    parts = header.split()
-    # header.split() будет пуст, когда мы возвращаем все строки
-    # до первого объявления какого-либо параграфа
-    tag = ''
-    if len(parts):
-        tag = parts[0]
+    return '\n'.join(f'.i{indent} {{ padding-left: {indent}em; }}'
+                     for indent in indents)
+
+
+# конвертер с таблицами тегов по умолчанию. Функций модуля - его методы;
+# изменение таблиц модуля после импорта на него не влияет, для других
+# таблиц нужно создать свой Converter
+default_converter = Converter()
+
+convert = default_converter.convert
+convert_section = default_converter.convert_section
+convert_subsection = default_converter.convert_subsection
+convert_paragraph = default_converter.convert_paragraph
+convert_simple_paragraph = default_converter.convert_simple_paragraph
+convert_hanging_paragraph = default_converter.convert_hanging_paragraph
+convert_indented_paragraph = default_converter.convert_indented_paragraph
+convert_tagged_paragraph = default_converter.convert_tagged_paragraph
+convert_line = default_converter.convert_line
+tokenize = default_converter.tokenize
+parse = default_converter.parse
+get_sections = default_converter.get_sections
+extract_sections = default_converter.extract_sections
+get_subsections = default_converter.get_subsections
+get_paragraphs = default_converter.get_paragraphs
+get_paragraph = default_converter.get_paragraph
 
-    if not tag or tag in simple_paragraph_tags:
-        return SimpleParagraph(content)
-    elif tag == '.HP':
-        return get_hanging_paragraph(parts, content)
-    elif tag == '.IP':
-        return get_indented_paragraph(parts, content)
-    elif tag == '.TP':
-        return get_tagged_paragraph(parts, content)
+
+SimpleParagraph = namedtuple('SimpleParagraph', ['content'])
 
 
 HangingParagraph = namedtuple('HangingParagraph',
@@ -542,3 +1245,155 @@ def divide_by_tag(tag: str, it: typing.Iterable[str]) -> \
 
     if divider or content:
         yield divider, content
+
+
+section_index_version = 2
+
+
+def build_section_index(man_page: typing.BinaryIO) -> typing.Dict:
+    """
+    Строит индекс смещений (в байтах) всех разделов .SH и подразделов .SS
+
+    Индекс - словарь вида:
+
+    {'sections': [{'header': 'NAME', 'start': 120, 'end': 180,
+                   'subsections': [{'header': 'Arrays', 'start': 150,
+                                    'end': 180}]}]}
+
+    end - смещение первого байта после раздела; строки до первого .SH
+    (комментарии, определения макросов и т.п.) в индекс не входят
+
+    :param man_page: man страница, открытая в двоичном режиме
+    :return: индекс смещений
+    """
+    sections = []
+    offset = 0
+    for line in man_page:
+        if line.startswith(b'.SH'):
+            _close_index_entry(sections, offset)
+            sections.append({'header': _index_header(line, '.SH'),
+                             'start': offset, 'subsections': []})
+        elif line.startswith(b'.SS') and sections:
+            subsections = sections[-1]['subsections']
+            _close_index_entry(subsections, offset)
+            subsections.append({'header': _index_header(line, '.SS'),
+                                'start': offset})
+
+        offset += len(line)
+
+    _close_index_entry(sections, offset)
+
+    return {'sections': sections}
+
+
+def _index_header(line: bytes, tag: str) -> str:
+    # заголовок нормализуется так же, как в divide_by_tag и get_sections
+    line = line.decode('utf-8', errors='replace').strip('\r\n')
+
+    return line[len(tag) + len(' '):].strip(' "')
+
+
+def _close_index_entry(entries: typing.List[typing.Dict], offset: int):
+    if entries:
+        entries[-1]['end'] = offset
+        for subsection in entries[-1].get('subsections', []):
+            subsection.setdefault('end', offset)
+
+
+def load_section_index(file_name: str) -> typing.Dict:
+    """
+    Загружает индекс смещений из файла рядом с man страницей (<имя>.idx)
+
+    Если индекса нет или он устарел (у страницы изменился размер или время
+    изменения), то он строится заново и сохраняется. Если сохранить его
+    нельзя (например, директория только для чтения), то индекс просто
+    возвращается
+
+    :param file_name: путь к man странице
+    :return: индекс смещений, как у build_section_index
+    """
+    stat = os.stat(file_name)
+    index_file_name = f'{file_name}.idx'
+    try:
+        with open(index_file_name, encoding='utf-8') as index_file:
+            index = json.load(index_file)
+        if (index.get('version') == section_index_version and
+                index.get('size') == stat.st_size and
+                index.get('mtime_ns') == stat.st_mtime_ns):
+            return index
+    except (OSError, ValueError):
+        pass
+
+    with open(file_name, 'rb') as man_page:
+        index = build_section_index(man_page)
+    index.update(version=section_index_version,
+                 size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    try:
+        with open(index_file_name, 'w', encoding='utf-8') as index_file:
+            json.dump(index, index_file)
+    except OSError:
+        pass
+
+    return index
+
+
+def render_section(file_name: str, header: str,
+                   converter: Converter = default_converter,
+                   include_resolver: IncludeResolver = None) -> \
+        typing.Optional[str]:
+    """
+    Конвертирует в html только один раздел или подраздел man страницы
+
+    Раздел ищется по индексу смещений (load_section_index), читаются и
+    разбираются только его байты. Сначала ищется раздел .SH с таким
+    заголовком, затем подраздел .SS.
+
+    Конвертация раздела не зависит ни от предыдущих разделов, ни от
+    преамбулы страницы (определения макросов в ней отбрасываются и при
+    полной конвертаций), поэтому результат совпадает с html кодом этого же
+    раздела из convert. Как и при полной конвертаций, страница-
+    перенаправление (.so) заменяется страницей, на которую она указывает,
+    а .so внутри раздела разворачиваются
+
+    :param file_name: путь к man странице
+    :param header: заголовок раздела или подраздела
+    :param converter: конвертер, по умолчанию default_converter
+    :param include_resolver: кеш подключаемых .so файлов
+    :return: html код раздела или None, если такого раздела нет
+    """
+    if include_resolver is None:
+        include_resolver = IncludeResolver()
+    file_name = include_resolver.get_source(file_name)
+    index = load_section_index(file_name)
+
+    subsection_entry = None
+    for section_entry in index['sections']:
+        if section_entry['header'] == header:
+            lines = include_resolver.expand(
+                _read_index_entry(file_name, section_entry), file_name)
+            return converter.convert_section(
+                next(converter.get_sections(lines)))
+
+        if subsection_entry is None:
+            subsection_entry = next(
+                (s for s in section_entry['subsections']
+                 if s['header'] == header), None)
+
+    if subsection_entry is None:
+        return None
+
+    lines = include_resolver.expand(
+        _read_index_entry(file_name, subsection_entry), file_name)
+    return converter.convert_subsection(
+        next(converter.get_subsections(lines)))
+
+
+def _read_index_entry(file_name: str, entry: typing.Dict) -> \
+        typing.List[str]:
+    with open(file_name, 'rb') as man_page:
+        man_page.seek(entry['start'])
+        content = man_page.read(entry['end'] - entry['start'])
+
+    # так же, как при построении индекса и чтении страницы
+    return io.StringIO(content.decode('utf-8', errors='replace')).readlines()
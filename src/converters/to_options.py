@@ -0,0 +1,219 @@
+import json
+import re
+import typing
+from collections import namedtuple
+
+from src.converters import to_html, to_text
+from src.utils import file_manager
+
+OptionEntry = namedtuple('OptionEntry', ['page', 'section', 'flags',
+                                         'argument', 'description'])
+
+# разделы с описаниями опций: OPTIONS, GLOBAL OPTIONS, COMMAND-LINE
+# OPTIONS ...; если их нет, опции ищутся в DESCRIPTION (так описаны
+# опции в страницах GNU coreutils)
+options_header_pattern = re.compile(r'\bOPTIONS?\b', re.IGNORECASE)
+fallback_headers = ('DESCRIPTION',)
+
+# escape последовательности нулевой ширины (\, \/ и т.п.), которые
+# to_html.convert_line оставляет в тексте
+zero_width_pattern = re.compile(r'\\[,/&:^|]')
+
+# начало курсива: в бирках им обычно выделен аргумент, в том числе слитый
+# с флагом (\fB\-l\fR\fIfile\fR)
+italic_pattern = re.compile(r'\\f(?:I|\(I|\[I\])')
+
+# флаг (-a, --all, +x) и то, что идёт после него в той же альтернативе
+flag_pattern = re.compile(r'([-+]{1,2}[^\s=\[,|]+)\s*(.*)')
+
+# аргумент запроса roff: в кавычках (с "" внутри) или до пробела
+argument_pattern = re.compile(r'"((?:[^"]|"")*)"?|(\S+)')
+
+
+def is_options_section(header: str) -> bool:
+    """
+    :param header: заголовок раздела
+    :return: True, если раздел описывает опции
+    """
+    return options_header_pattern.search(header) is not None
+
+
+def split_arguments(line: str) -> typing.List[str]:
+    """
+    Делит строку запроса на запрос и аргументы с учётом кавычек
+
+    :param line: строка запроса (.IP "-a, --all" 4)
+    :return: запрос и аргументы без кавычек
+    """
+    return [word or quoted.replace('""', '"')
+            for quoted, word in argument_pattern.findall(line)]
+
+
+def parse_tag(tag: str) -> typing.Tuple[typing.List[str], str]:
+    """
+    Разбирает бирку пункта списка опций вида "-a, --all",
+    "--block-size=SIZE", "-o file", "-c --stdout" или "--color[=WHEN]"
+
+    :param tag: текст бирки без разметки
+    :return: флаги и обозначение аргумента ('' - без аргумента); флагов
+             нет, если бирка не описывает опцию
+    """
+    flags = []
+    argument = ''
+    for alternative in re.split(r',\s*|\s+\|\s+', tag.strip()):
+        rest = alternative.strip()
+        # флаги могут идти и через пробел
+        while True:
+            match = flag_pattern.fullmatch(rest)
+            if not match:
+                break
+            flag, rest = match.groups()
+            flags.append(flag)
+            if not rest.startswith(('-', '+')):
+                break
+        # у короткой и длинной формы один аргумент - берётся первый
+        if flags and rest and not argument:
+            argument = re.sub(r'([\[=])\s+', r'\1', rest)
+            if argument.startswith('[='):
+                argument = '[' + argument[2:]
+            argument = argument.lstrip('=')
+
+    return flags, argument
+
+
+def convert_text(lines: typing.Iterable[str]) -> str:
+    """
+    :return: текст строк man страницы без разметки
+    """
+    return to_text.convert_lines(zero_width_pattern.sub('', line)
+                                 for line in lines)
+
+
+def convert_tag(tag: str) -> str:
+    """
+    :return: текст бирки без разметки, с пробелом перед курсивом
+    """
+    return convert_text([italic_pattern.sub(lambda m: ' ' + m.group(), tag)])
+
+
+def tokenize(man_page: typing.Iterable[str]) -> \
+        typing.Iterator[typing.Union[to_html.Token, typing.List[str]]]:
+    """
+    to_html.tokenize для извлечения опций: аргументы .IP разделены с учётом
+    кавычек (бирка "\\fB\\-a\\fR, \\fB\\-\\-all\\fR" остаётся
+    целой), а запросы, лишь начинающиеся с тега параграфа (.PD между
+    пунктами с общим описанием), считаются строками текста и не обрывают
+    описание
+    """
+    for token in to_html.tokenize(man_page):
+        if token.__class__ is list or token.kind != 'paragraph':
+            yield token
+        elif token.request == '.IP':
+            yield token._replace(parts=split_arguments(token.text))
+        elif token.request in to_html.paragraph_tags:
+            yield token
+        else:
+            yield [token.text]
+
+
+def get_items(section: to_html.Section) -> \
+        typing.Iterator[typing.Tuple[str, typing.List[str]]]:
+    """
+    Отдаёт пункты списков .TP и .IP раздела: бирку и строки описания
+
+    Параграфы .IP без бирки, идущие сразу за пунктом, продолжают его
+    описание
+
+    :param section: раздел
+    :return: бирка (строка man страницы) и строки описания
+    """
+    tag = None
+    content = []
+    for subsection in section.subsections:
+        for paragraph in subsection.paragraphs:
+            if isinstance(paragraph, (to_html.TaggedParagraph,
+                                      to_html.IndentedParagraph)) and \
+                    paragraph.hang_tag:
+                if tag is not None:
+                    yield tag, content
+                tag = paragraph.hang_tag
+                content = list(paragraph.content)
+            elif isinstance(paragraph, to_html.IndentedParagraph) and \
+                    tag is not None:
+                content.extend(paragraph.content)
+            else:
+                if tag is not None:
+                    yield tag, content
+                tag = None
+                content = []
+        if tag is not None:
+            yield tag, content
+        tag = None
+        content = []
+
+
+def get_options(man_page: typing.Iterable[str], name: str,
+                section: str) -> typing.Iterator[OptionEntry]:
+    """
+    Извлекает опции из пунктов списков разделов опций man страницы
+
+    Страница только разбирается на разделы (to_html.parse), html не
+    создаётся; в текст конвертируются лишь бирки и описания опций. Пункты
+    без описания, идущие подряд (.PD 0 между ними), описывают одну опцию
+    вместе со следующим пунктом
+
+    :param man_page: man страница
+    :param name: имя страницы
+    :param section: раздел руководства
+    :return: опции в порядке страницы
+    """
+    sections = list(to_html.parse(tokenize(man_page)))
+    options_sections = [s for s in sections if is_options_section(s.header)]
+    if not options_sections:
+        options_sections = [s for s in sections
+                            if s.header in fallback_headers]
+
+    for options_section in options_sections:
+        flags = []
+        argument = ''
+        for tag, content in get_items(options_section):
+            tag_flags, tag_argument = parse_tag(convert_tag(tag))
+            if not tag_flags:
+                continue
+            flags.extend(tag_flags)
+            argument = argument or tag_argument
+            description = convert_text(content)
+            if description:
+                yield OptionEntry(name, section, flags, argument,
+                                  description)
+                flags = []
+                argument = ''
+        if flags:
+            yield OptionEntry(name, section, flags, argument, '')
+
+
+def convert_entry(entry: OptionEntry) -> str:
+    """
+    :return: опция в виде строки JSON
+    """
+    return json.dumps(entry._asdict(), ensure_ascii=False)
+
+
+def build_index(pages: typing.Iterable[str], index: typing.TextIO) -> int:
+    """
+    Строит индекс опций по man страницам: по одной строке JSON на опцию
+
+    :param pages: пути к man страницам
+    :param index: файл, в который пишется индекс
+    :return: количество опций в индексе
+    """
+    count = 0
+    for page in pages:
+        name, section = file_manager.split_page_name(page)
+        with open(page, encoding='utf-8', errors='replace') as man_page:
+            for entry in get_options(man_page, name, section):
+                index.write(convert_entry(entry))
+                index.write('\n')
+                count += 1
+
+    return count
@@ -0,0 +1,81 @@
+import html
+import re
+import typing
+
+from src.converters import to_html
+
+html_tag_pattern = re.compile(r'<!--.*?-->|<[^>]*>')
+whitespace_pattern = re.compile(r'\s+')
+
+
+def convert_line(line: str) -> str:
+    """
+    Конвертирует одну строку man страницы в простой текст
+
+    Для строк-запросов учитывается только имя запроса целиком: известные
+    шрифтовые макросы (.B, .BR, .IR ...) заменяются своими аргументами, а
+    комментарии и неизвестные запросы (например .IX или .ad) отбрасываются
+
+    :param line: строка для конвертаций
+    :return: текст строки без разметки
+    """
+    if line.startswith('.'):
+        request, _, arguments = line.partition(' ')
+        template = to_html.inline_tags.get(request)
+        if not template or '{}' not in template or request == r'.\"':
+            return ''
+        # аргументы макросов могут быть взяты в кавычки
+        line = arguments.replace('"', '')
+
+    text = html_tag_pattern.sub('', to_html.convert_line(line))
+
+    return html.unescape(text)
+
+
+def convert_lines(lines: typing.Iterable[str]) -> str:
+    """
+    Конвертирует строки в одну строку текста с нормализованными пробелами
+
+    :param lines: строки man страницы
+    :return: текст
+    """
+    text = ' '.join(convert_line(l) for l in lines)
+
+    return whitespace_pattern.sub(' ', text).strip()
+
+
+def convert_paragraph(paragraph) -> str:
+    """
+    Конвертирует параграф любого типа в текст
+
+    :param paragraph: параграф
+    :return: текст параграфа
+    """
+    if paragraph is None:
+        # так же, как и to_html.convert_paragraph, пропускаем параграфы с
+        # нераспознанным тегом (например .PD)
+        return ''
+
+    lines = []
+    if isinstance(paragraph, to_html.HangingParagraph):
+        lines.append(paragraph.hang or '')
+    elif isinstance(paragraph, (to_html.IndentedParagraph,
+                                to_html.TaggedParagraph)):
+        lines.append(paragraph.hang_tag or '')
+    lines.extend(paragraph.content)
+
+    return convert_lines(lines)
+
+
+def convert_section(section: to_html.Section) -> str:
+    """
+    Конвертирует содержимое раздела в текст без заголовков
+
+    :param section: раздел
+    :return: текст раздела
+    """
+    paragraphs = (convert_paragraph(p)
+                  for subsection in section.subsections
+                  for p in subsection.paragraphs)
+
+    return ' '.join(p for p in paragraphs if p)
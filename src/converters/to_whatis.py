@@ -0,0 +1,69 @@
+import json
+import typing
+from collections import namedtuple
+
+from src.converters import to_html, to_text
+from src.utils import file_manager
+
+WhatisEntry = namedtuple('WhatisEntry',
+                         ['names', 'section', 'description', 'synopsis'])
+
+
+def get_entry(man_page: typing.Iterable[str], name: str, section: str) -> \
+        WhatisEntry:
+    """
+    Создаёт запись whatis по разделам NAME и SYNOPSIS man страницы
+
+    Страница читается только до конца этих разделов, остальное не
+    разбирается и не конвертируется
+
+    :param man_page: man страница
+    :param name: имя страницы, если в ней нет раздела NAME
+    :param section: раздел руководства
+    :return: запись whatis
+    """
+    sections = to_html.extract_sections(man_page, ('NAME', 'SYNOPSIS'))
+
+    names = [name]
+    description = ''
+    if 'NAME' in sections:
+        # строка NAME имеет вид "имя[, имя...] \- описание"
+        text = to_text.convert_section(sections['NAME'])
+        names_part, separator, description = text.partition(' - ')
+        if separator:
+            names = [n.strip() for n in names_part.split(',') if n.strip()]
+        else:
+            description = text
+
+    synopsis = ''
+    if 'SYNOPSIS' in sections:
+        synopsis = to_text.convert_section(sections['SYNOPSIS'])
+
+    return WhatisEntry(names, section, description.strip(), synopsis)
+
+
+def convert_entry(entry: WhatisEntry) -> str:
+    """
+    :return: запись whatis в виде строки JSON
+    """
+    return json.dumps(entry._asdict(), ensure_ascii=False)
+
+
+def build_index(pages: typing.Iterable[str], index: typing.TextIO) -> int:
+    """
+    Строит индекс whatis по man страницам: по одной строке JSON на страницу
+
+    :param pages: пути к man страницам
+    :param index: файл, в который пишется индекс
+    :return: количество проиндексированных страниц
+    """
+    count = 0
+    for page in pages:
+        name, section = file_manager.split_page_name(page)
+        with open(page, encoding='utf-8', errors='replace') as man_page:
+            entry = get_entry(man_page, name, section)
+        index.write(convert_entry(entry))
+        index.write('\n')
+        count += 1
+
+    return count
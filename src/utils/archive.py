@@ -0,0 +1,198 @@
+import contextlib
+import hashlib
+import json
+import os
+import posixpath
+import time
+import typing
+import zipfile
+from os import path
+
+from src.converters import to_html
+from src.utils import batch, file_manager
+from src.utils.includes import IncludeResolver
+from src.utils.metrics import Metrics
+
+# манифест внутри архива, последний его файл
+manifest_name = 'manifest.json'
+
+# дата всех файлов архива, чтобы одинаковые страницы давали одинаковый
+# архив
+member_date_time = (1980, 1, 1, 0, 0, 0)
+
+
+def _member_info(name: str, compression: int) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, member_date_time)
+    info.compress_type = compression
+    info.external_attr = 0o644 << 16
+
+    return info
+
+
+def write_member(archive: zipfile.ZipFile, name: str,
+                 chunks: typing.Iterable[str],
+                 stage: typing.Callable[[str], typing.ContextManager] =
+                 contextlib.nullcontext) -> typing.Dict:
+    """
+    Записывает html в архив по мере конвертаций, не собирая его в памяти
+
+    :param archive: архив, открытый на запись
+    :param name: имя файла в архиве
+    :param chunks: части html
+    :param stage: фабрика контекстных менеджеров для этапа output
+    :return: размер и ETag записанного html
+    """
+    digest = hashlib.sha256()
+    size = 0
+    info = _member_info(name, archive.compression)
+    # force_zip64 - размер заранее неизвестен и может превысить 2 ГиБ
+    with archive.open(info, 'w', force_zip64=True) as member:
+        for chunk in chunks:
+            with stage('output'):
+                data = chunk.encode('utf-8')
+                digest.update(data)
+                size += len(data)
+                member.write(data)
+
+    return {'size': size, 'etag': f'"{digest.hexdigest()}"'}
+
+
+def convert_directory(input_dir: str, archive_file: str, stylesheet: str,
+                      stored: bool = False,
+                      converter: to_html.Converter =
+                      to_html.default_converter,
+                      metrics: Metrics = None,
+                      aliases: bool = True,
+                      pages: typing.Iterable[str] = None) -> typing.Dict:
+    """
+    Конвертирует все man страницы директорий в один zip архив
+
+    Имена html файлов в архиве - как у batch.convert_directory, через /.
+    Последним в архив пишется манифест (manifest.json), по которому
+    сервер находит ETag страниц. Архив пишется во временный файл и
+    переименовывается после успешной записи
+
+    :param input_dir: директория с man страницами
+    :param archive_file: путь к архиву
+    :param stylesheet: css файл
+    :param stored: не сжимать файлы архива, чтобы их можно было отдавать
+                   как есть
+    :param converter: конвертер
+    :param metrics: метрики конвертаций
+    :param aliases: записывать псевдонимы (см. batch.find_aliases)
+                    перенаправлениями на основную страницу вместо
+                    отдельной конвертаций
+    :param pages: конвертировать только эти страницы директорий, по
+                  умолчанию все
+    :return: записи манифеста по имени html файла
+    """
+    compression = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+    stage = metrics.stage if metrics else contextlib.nullcontext
+    include_resolver = IncludeResolver()
+
+    if pages is None:
+        pages = file_manager.find_man_pages(input_dir)
+    pages = list(pages)
+    alias_of = batch.find_aliases(pages, include_resolver) if aliases else {}
+    pages.sort(key=lambda p: p in alias_of)
+
+    temp_name = archive_file + file_manager.partial_suffix
+    entries = {}
+    try:
+        with zipfile.ZipFile(temp_name, 'w', compression) as archive:
+            for page in pages:
+                name = batch.get_output_name(page, input_dir).replace(
+                    os.sep, '/')
+                primary = alias_of.get(page)
+
+                if primary is not None:
+                    primary_name = batch.get_output_name(
+                        primary, input_dir).replace(os.sep, '/')
+                    target = posixpath.relpath(primary_name,
+                                               posixpath.dirname(name))
+                    entry = write_member(archive, name,
+                                         [batch.redirect_html(target)])
+                    entry['alias_of'] = primary_name
+                    if metrics:
+                        metrics.alias_pages.inc()
+                        metrics.saved_input_bytes.inc(path.getsize(
+                            include_resolver.get_source(page)))
+                else:
+                    entry = _convert_member(archive, name, page, stylesheet,
+                                            converter, metrics, stage,
+                                            include_resolver)
+                entries[name] = dict(entry, source=page)
+
+            archive.writestr(_member_info(manifest_name, compression),
+                             json.dumps({'pages': entries}, indent=1,
+                                        sort_keys=True))
+        os.replace(temp_name, archive_file)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_name)
+        raise
+
+    return entries
+
+
+def _convert_member(archive, name, page, stylesheet, converter, metrics,
+                    stage, include_resolver):
+    start = time.perf_counter()
+    try:
+        with open(page, encoding='utf-8', errors='replace') as man_page:
+            lines = include_resolver.expand(man_page, page)
+            entry = write_member(archive, name,
+                                 converter.convert(lines, stylesheet, stage),
+                                 stage)
+    except Exception:
+        if metrics:
+            metrics.page_failures.inc()
+        raise
+
+    if metrics:
+        metrics.page_seconds.observe(time.perf_counter() - start)
+        metrics.pages_converted.inc()
+        metrics.input_bytes.inc(path.getsize(page))
+        metrics.output_bytes.inc(entry['size'])
+
+    return entry
+
+
+class ArchiveReader:
+    """
+    Чтение html страниц из архива convert_directory без распаковки
+
+    Центральный каталог zip - индекс архива: по имени страницы сразу
+    находится её положение в файле. Читать можно из нескольких потоков
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._archive = zipfile.ZipFile(file_name)
+        self.names = frozenset(
+            n for n in self._archive.namelist() if n != manifest_name)
+        self.manifest = {'pages': {}}
+        if manifest_name in self._archive.namelist():
+            self.manifest = json.loads(self._archive.read(manifest_name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def read(self, name: str) -> bytes:
+        """
+        :param name: имя html файла в архиве
+        :return: содержимое html файла
+        """
+        return self._archive.read(name)
+
+    def get_etag(self, name: str) -> typing.Optional[str]:
+        """
+        :return: ETag страницы из манифеста, None если его там нет
+        """
+        return self.manifest['pages'].get(name, {}).get('etag')
+
+    def close(self):
+        self._archive.close()
@@ -1,11 +1,18 @@
 import argparse
+import os
 import sys
 from os import path
 
+from src.utils import batch, cpu_profile, file_manager, scheduler, shards
+
 
 def parse_arguments(argv):
     """
     Парсит аргументы комадной строки
+
+    Если первый аргумент - имя команды (например whatis), то остальные
+    аргументы разбираются парсером этой команды. Имя команды сохраняется в
+    args.command, для обычной конвертаций оно равно 'convert'
     """
 
     parser = create_parser()
@@ -14,14 +21,66 @@ def parse_arguments(argv):
         parser.print_help(sys.stderr)
         sys.exit(1)
 
+    if argv[0] in command_parsers:
+        args = command_parsers[argv[0]]().parse_args(argv[1:])
+        args.command = argv[0]
+        return args
+
     args = parser.parse_args(argv)
+    args.command = 'convert'
+
+    if not args.html and not args.compress:
+        parser.error('--no-html требует хотя бы одного --compress')
 
     if not args.output_file:
-        args.output_file = f'{args.input_file}.html'
+        args.output_file = ('-' if args.input_file == '-'
+                            else f'{args.input_file}.html')
+
+    if args.jobs < 1:
+        parser.error('--jobs должно быть не меньше 1')
+
+    if args.output_file == '-' and (args.compress or args.manifest):
+        parser.error('--compress и --manifest не поддерживаются при '
+                     'выводе в стандартный вывод')
+
+    if args.output_file.endswith('.zip') and (args.compress or args.resume or
+                                              args.fragment_cache or
+                                              args.cpu_profile):
+        parser.error('--compress, --resume, --fragment-cache и '
+                     '--cpu-profile не поддерживаются при конвертаций в zip '
+                     'архив')
+
+    if args.db and args.toc:
+        parser.error('--toc не поддерживается с --db: в базе хранятся '
+                     'отдельные разделы, без оглавления страницы')
+
+    limited = (args.page_timeout, args.page_cpu, args.page_memory) != \
+        (None, None, None)
+    if args.pipeline and (limited or args.output_file.endswith('.zip')):
+        parser.error('--pipeline не поддерживается с --page-* и при '
+                     'конвертаций в zip архив')
+    if limited and args.threads:
+        parser.error('--threads не поддерживается с --page-*: ограничения '
+                     'требуют отдельных процессов')
+    if limited and (args.input_file == '-' or
+                    args.output_file.endswith('.zip')):
+        parser.error('--page-timeout, --page-cpu и --page-memory не '
+                     'поддерживаются при чтении из стандартного ввода и '
+                     'конвертаций в zip архив')
 
     return args
 
 
+def shard_argument(value):
+    """
+    Тип аргумента --shard: i/N -> (i, N)
+    """
+    try:
+        return shards.parse_shard(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
 def create_parser():
     """
     Создаёт и инициализирует парсер
@@ -30,12 +89,15 @@ def create_parser():
 
     parser.add_argument(
         'input_file', type=str,
-        help='исходный файл, который нужно сконвертировать')
+        help='исходный файл, который нужно сконвертировать, '
+             'директория с man страницами или - (стандартный ввод)')
 
     parser.add_argument(
         '-o', '--output_file', type=str, default=None,
-        help='название для сконвертированного файла. '
-             'по умолчанию как у исходного с расширением .html')
+        help='название для сконвертированного файла (или директорий), '
+             '- - стандартный вывод. по умолчанию как у исходного с '
+             'расширением .html, для стандартного ввода - стандартный '
+             'вывод')
 
     parser.add_argument(
         '--style', type=str, default=path.join(r'css\main.css'),
@@ -43,4 +105,305 @@ def create_parser():
              '(default: %(default)s)'
     )
 
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='компактная разметка: отступы классами css вместо атрибутов '
+             'style, без комментариев и лишних пробелов и атрибутов')
+
+    parser.add_argument(
+        '--toc', action='store_true',
+        help='навигация: id и сворачиваемые блоки у разделов и подразделов '
+             'и оглавление страницы')
+
+    parser.add_argument(
+        '--compress', action='append', default=[],
+        choices=file_manager.compression_formats,
+        help='дополнительно записать сжатую копию html (<файл>.gz, '
+             '<файл>.zst), сжимая по мере конвертаций. можно указать '
+             'несколько раз')
+
+    parser.add_argument(
+        '--no-html', dest='html', action='store_false',
+        help='не записывать несжатый html, только сжатые копий')
+
+    parser.add_argument(
+        '--manifest', type=str, default=None,
+        help='манифест (JSON) с ETag и списком записанных файлов. '
+             'при конвертаций директорий по умолчанию '
+             '<выходная директория>/manifest.json')
+
+    parser.add_argument(
+        '--db', type=str, default=None,
+        help='база SQLite, в которую сохраняются разделы сконвертированных '
+             'страниц вместо html файлов. исходным файлом может быть '
+             'директория с man страницами')
+
+    parser.add_argument(
+        '--metrics-file', type=str, default=None,
+        help='файл, в который после конвертаций записываются метрики в '
+             'текстовом формате Prometheus')
+
+    parser.add_argument(
+        '--aliases', choices=batch.alias_modes + ('none',), default='link',
+        help='как записывать страницы-псевдонимы (символические ссылки, .so '
+             'перенаправления, копий) при конвертаций директорий: '
+             'жёсткими ссылками, html перенаправлениями или конвертировать '
+             'каждую отдельно (default: %(default)s)')
+
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='количество процессов, конвертирующих страницы директорий '
+             '(default: %(default)s)')
+
+    parser.add_argument(
+        '--memory-budget', type=int, default=None, metavar='MiB',
+        help='бюджет памяти одновременных конвертаций: большие страницы не '
+             'конвертируются одновременно, если их оценка памяти '
+             'превышает бюджет')
+
+    parser.add_argument(
+        '--schedule', choices=scheduler.policies, default='largest',
+        help='порядок конвертаций при --jobs больше 1: largest - от больших '
+             'страниц к маленьким, fifo - в порядке обхода директорий '
+             '(default: %(default)s)')
+
+    parser.add_argument(
+        '--shard', type=shard_argument, default=None, metavar='i/N',
+        help='конвертировать только i-й из N шардов директорий. страницы '
+             'распределяются по шардам одинаково на всех машинах; выходные '
+             'директорий шардов собирает команда merge')
+
+    parser.add_argument(
+        '--stored', action='store_true',
+        help='при конвертаций директорий в zip архив (выходной файл '
+             '*.zip) не сжимать страницы в нём')
+
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='продолжить прерванную конвертацию директорий, не конвертируя '
+             'заново страницы из её журнала')
+
+    parser.add_argument(
+        '--threads', action='store_true',
+        help='при --jobs больше 1 конвертировать страницы в потоках вместо '
+             'процессов: без копирования страниц и html между процессами. '
+             'параллельно потоки работают на сборках CPython без GIL')
+
+    parser.add_argument(
+        '--pipeline', action='store_true',
+        help='конвертировать директорию конвейером: чтение, конвертация '
+             '(--jobs потоков) и запись страниц идут одновременно; в конце '
+             'выводится загрузка этапов')
+
+    parser.add_argument(
+        '--fragment-cache', type=int, default=None, metavar='MiB',
+        help='кеш html одинаковых разделов (лицензии, REPORTING BUGS, общие '
+             'описания опций) заданного размера: при конвертаций '
+             'директорий такой раздел конвертируется один раз, в конце '
+             'выводится сэкономленное время и размер')
+
+    parser.add_argument(
+        '--cpu-profile', type=str, default=None, metavar='FILE',
+        help='профилировать конвертаций (всех страниц, потоков и процессов '
+             'вместе) и записать профиль pstats в FILE, а свёрнутые стеки '
+             'для flamegraph - в FILE' + cpu_profile.folded_suffix)
+
+    parser.add_argument(
+        '--cpu-profile-mode', choices=cpu_profile.modes,
+        default='deterministic',
+        help='deterministic - cProfile (точные вызовы, замедляет '
+             'конвертацию), sampling - только выборки стеков '
+             '(default: %(default)s)')
+
+    add_render_cache_arguments(parser)
+    add_limit_arguments(parser)
+
+    return parser
+
+
+def add_render_cache_arguments(parser):
+    """
+    Добавляет параметры кеша html на диске
+    """
+    parser.add_argument(
+        '--render-cache', type=str,
+        default=os.environ.get('PONCHO_RENDER_CACHE'), metavar='DIR',
+        help='директория кеша html, общего для конвертаций и сервера: '
+             'страница с тем же содержимым, стилями и настройками не '
+             'конвертируется заново (default: $PONCHO_RENDER_CACHE)')
+
+    parser.add_argument(
+        '--render-cache-size', type=int, default=None, metavar='MiB',
+        help='наибольший размер кеша html, давно не читавшиеся страницы '
+             'удаляются')
+
+
+def add_limit_arguments(parser):
+    """
+    Добавляет параметры ограничений конвертаций одной страницы
+    """
+    parser.add_argument(
+        '--page-timeout', type=float, default=None, metavar='SECONDS',
+        help='наибольшее время конвертаций страницы; с любым из --page-* '
+             'страницы конвертируются в отдельных процессах, а страница, '
+             'превысившая ограничение, останавливается и пропускается')
+
+    parser.add_argument(
+        '--page-cpu', type=float, default=None, metavar='SECONDS',
+        help='наибольшее процессорное время конвертаций страницы')
+
+    parser.add_argument(
+        '--page-memory', type=int, default=None, metavar='MiB',
+        help='наибольшее адресное пространство процесса конвертаций '
+             'страницы')
+
+
+def create_whatis_parser():
+    """
+    Создаёт и инициализирует парсер команды whatis
+    """
+    parser = argparse.ArgumentParser(
+        prog='cponcho.py whatis',
+        description='строит индекс whatis (имена, описание и синопсис '
+                    'страниц) по директориям с man страницами')
+
+    parser.add_argument(
+        'input_files', type=str, nargs='+',
+        help='man страницы или директорий с ними')
+
+    parser.add_argument(
+        '-o', '--output_file', type=str, default='whatis.jsonl',
+        help='файл индекса, по одной строке JSON на страницу '
+             '(default: %(default)s)')
+
+    parser.add_argument(
+        '--shard', type=shard_argument, default=None, metavar='i/N',
+        help='индексировать только i-й из N шардов страниц')
+
+    return parser
+
+
+def create_options_parser():
+    """
+    Создаёт и инициализирует парсер команды options
+    """
+    parser = argparse.ArgumentParser(
+        prog='cponcho.py options',
+        description='извлекает опции (флаги, аргумент и описание) из '
+                    'разделов OPTIONS man страниц без конвертаций в html, '
+                    'например для генерации дополнений командной строки')
+
+    parser.add_argument(
+        'input_files', type=str, nargs='+',
+        help='man страницы или директорий с ними')
+
+    parser.add_argument(
+        '-o', '--output_file', type=str, default='-',
+        help='файл индекса, по одной строке JSON на опцию; - - стандартный '
+             'вывод (default: %(default)s)')
+
     return parser
+
+
+def create_serve_parser():
+    """
+    Создаёт и инициализирует парсер команды serve
+    """
+    parser = argparse.ArgumentParser(
+        prog='cponcho.py serve',
+        description='локальный http сервер, конвертирующий man страницы '
+                    'директорий по запросу. метрики отдаются по /metrics')
+
+    parser.add_argument(
+        'input_dir', type=str,
+        help='директория с man страницами или zip архив сконвертированных '
+             'страниц')
+
+    parser.add_argument(
+        '--host', type=str, default='127.0.0.1',
+        help='адрес сервера (default: %(default)s)')
+
+    parser.add_argument(
+        '--port', type=int, default=8000,
+        help='порт сервера (default: %(default)s)')
+
+    parser.add_argument(
+        '--style', type=str, default=path.join(r'css\main.css'),
+        help='файл css стилизиющий html (default: %(default)s)')
+
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='компактная разметка (см. cponcho.py -h)')
+
+    parser.add_argument(
+        '--toc', action='store_true',
+        help='навигация и оглавление (см. cponcho.py -h)')
+
+    parser.add_argument(
+        '--cache-size', type=int, default=64,
+        help='размер кеша сконвертированных страниц в МиБ '
+             '(default: %(default)s)')
+
+    parser.add_argument(
+        '--metrics-file', type=str, default=None,
+        help='файл, в который при остановке сервера записываются метрики')
+
+    add_render_cache_arguments(parser)
+    add_limit_arguments(parser)
+
+    return parser
+
+
+def create_merge_parser():
+    """
+    Создаёт и инициализирует парсер команды merge
+    """
+    parser = argparse.ArgumentParser(
+        prog='cponcho.py merge',
+        description='собирает результаты шардов (--shard): выходные '
+                    'директорий с манифестами или индексы whatis')
+
+    parser.add_argument(
+        'inputs', type=str, nargs='+',
+        help='выходные директорий шардов или их индексы whatis (*.jsonl)')
+
+    parser.add_argument(
+        '-o', '--output_file', type=str, required=True,
+        help='общая выходная директория или общий индекс whatis')
+
+    return parser
+
+
+def create_cache_parser():
+    """
+    Создаёт и инициализирует парсер команды cache
+    """
+    parser = argparse.ArgumentParser(
+        prog='cponcho.py cache',
+        description='обслуживание кеша html на диске (--render-cache)')
+    actions = parser.add_subparsers(dest='action', required=True)
+
+    stats = actions.add_parser(
+        'stats', help='количество и размер страниц в кеше')
+    stats.add_argument('directory', type=str, help='директория кеша')
+
+    prune = actions.add_parser(
+        'prune', help='удалить давно не читавшиеся страницы')
+    prune.add_argument('directory', type=str, help='директория кеша')
+    prune.add_argument(
+        '--max-size', type=int, default=None, metavar='MiB',
+        help='удалять страницы, пока кеш больше этого размера')
+    prune.add_argument(
+        '--max-age', type=float, default=None, metavar='DAYS',
+        help='удалить страницы, которые не читались дольше этого срока')
+
+    return parser
+
+
+command_parsers = {
+    'whatis': create_whatis_parser,
+    'options': create_options_parser,
+    'serve': create_serve_parser,
+    'merge': create_merge_parser,
+    'cache': create_cache_parser,
+}
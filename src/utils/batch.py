@@ -0,0 +1,681 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import json
+import os
+import shutil
+import time
+import typing
+from os import path
+
+from src.converters import to_html
+from src.utils import file_manager, includes, isolation, scheduler
+from src.utils.cpu_profile import CpuProfiler
+from src.utils.fragment_cache import FragmentCache
+from src.utils.includes import IncludeResolver
+from src.utils.metrics import Metrics
+from src.utils.pipeline import Pipeline, Stage
+from src.utils.render_cache import RenderCache
+
+# как записываются страницы-псевдонимы (символические ссылки, .so
+# перенаправления и копий одной страницы): link - жёсткие ссылки на файлы
+# основной страницы, redirect - маленький html, перенаправляющий на неё
+alias_modes = ('link', 'redirect')
+
+# длина очередей между этапами конвейера (convert_directory с pipelined):
+# столько страниц каждый этап может обработать раньше следующего
+pipeline_queue_size = 8
+
+# этапы конвейера convert_directory
+pipeline_stages = ('read', 'render', 'write')
+
+
+class Journal:
+    """
+    Журнал пакетной конвертаций - по строке JSON на каждую завершённую
+    страницу. Каждая строка сразу сбрасывается на диск (fsync), поэтому
+    после падения или остановки процесса по журналу можно продолжить
+    конвертацию с того же места
+
+    Строка журнала: {"name": <имя html файла>, "mtime_ns": ..., "size": ...,
+    "entry": <запись манифеста>}, где mtime_ns и size - исходного файла
+    """
+
+    def __init__(self, file_name: str, resume: bool = False):
+        """
+        :param file_name: путь к журналу
+        :param resume: продолжить существующий журнал (иначе он начинается
+                       заново)
+        """
+        self.file_name = file_name
+        self.records = {}
+        if resume and path.exists(file_name):
+            self._load()
+            self._file = open(file_name, 'a', encoding='utf-8')
+        else:
+            self._file = open(file_name, 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _load(self):
+        with open(self.file_name, 'rb+') as journal:
+            data = journal.read()
+            # последняя строка могла остаться недописанной - она
+            # отбрасывается, чтобы следующие записи начинались с новой строки
+            complete = data.rfind(b'\n') + 1
+            journal.truncate(complete)
+
+        for line in data[:complete].decode('utf-8').splitlines():
+            record = json.loads(line)
+            self.records[record['name']] = record
+
+    def get_entry(self, name: str, page: str) -> typing.Optional[typing.Dict]:
+        """
+        :param name: имя html файла
+        :param page: путь к man странице
+        :return: запись манифеста, если страница уже сконвертирована и
+                 с тех пор не изменилась, иначе None
+        """
+        record = self.records.get(name)
+        if record is None:
+            return None
+
+        stat = os.stat(page)
+        if (record['mtime_ns'], record['size']) != (stat.st_mtime_ns,
+                                                    stat.st_size):
+            return None
+
+        return record['entry']
+
+    def add(self, name: str, page: str, entry: typing.Dict):
+        """
+        Записывает в журнал сконвертированную страницу
+
+        :param name: имя html файла
+        :param page: путь к man странице
+        :param entry: запись манифеста о странице
+        """
+        stat = os.stat(page)
+        record = {'name': name, 'mtime_ns': stat.st_mtime_ns,
+                  'size': stat.st_size, 'entry': entry}
+        self._file.write(json.dumps(record, sort_keys=True) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.records[name] = record
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        """
+        Закрывает и удаляет журнал завершённой конвертаций
+        """
+        self.close()
+        os.remove(self.file_name)
+
+
+def get_output_name(page: str, input_dir: str) -> str:
+    """
+    :param page: путь к man странице внутри input_dir
+    :param input_dir: директория с man страницами
+    :return: имя html файла страницы относительно выходной директорий
+    """
+    return f'{path.relpath(page, input_dir)}.html'
+
+
+def convert_page(page: str, output_file: str, stylesheet: str,
+                 html: bool = True,
+                 compress: typing.Iterable[str] = (),
+                 converter: to_html.Converter = to_html.default_converter,
+                 metrics: Metrics = None,
+                 include_resolver: IncludeResolver = None,
+                 render_cache: RenderCache = None,
+                 fragments: FragmentCache = None,
+                 profiler: CpuProfiler = None) -> typing.Dict:
+    """
+    Конвертирует одну man страницу в html и его сжатые копий, разворачивая
+    подключения .so
+
+    :param page: путь к man странице, '-' - стандартный ввод
+    :param output_file: путь к html файлу, '-' - стандартный вывод
+    :param stylesheet: css файл
+    :param html: писать ли сам html файл
+    :param compress: форматы сжатых копий
+    :param converter: конвертер
+    :param metrics: метрики, в которые записываются длительности этапов,
+                    объёмы и неудачные конвертаций
+    :param include_resolver: кеш подключаемых .so файлов (у стандартного
+                             ввода .so ищутся от текущей директорий)
+    :param render_cache: кеш html на диске, None - без него
+    :param fragments: кеш html разделов, общий для страниц, None - без
+                      него
+    :param profiler: профилировщик конвертаций, None - без него
+    :return: запись манифеста о странице (пути записанных файлов в ней -
+             как у output_file)
+    """
+    if include_resolver is None:
+        include_resolver = IncludeResolver()
+    stage = metrics.stage if metrics else contextlib.nullcontext
+    profile = profiler.profile if profiler else contextlib.nullcontext
+    start = time.perf_counter()
+    try:
+        with profile(), file_manager.open_page(page) as man_page, \
+                file_manager.open_output(output_file, html,
+                                         compress) as writer:
+            lines = include_resolver.expand(man_page, page)
+            if render_cache is not None:
+                for data in render_cache.render(lines, stylesheet, converter,
+                                                stage, metrics, fragments):
+                    with stage('output'):
+                        writer.write_bytes(data)
+            else:
+                for chunk in converter.convert(lines, stylesheet, stage,
+                                               fragments):
+                    with stage('output'):
+                        writer.write(chunk)
+    except Exception:
+        if metrics:
+            metrics.page_failures.inc()
+        raise
+
+    if metrics:
+        metrics.page_seconds.observe(time.perf_counter() - start)
+        metrics.pages_converted.inc()
+        if page != '-':
+            metrics.input_bytes.inc(path.getsize(page))
+        metrics.output_bytes.inc(writer.size)
+
+    return {
+        'source': page,
+        'size': writer.size,
+        'etag': writer.etag,
+        'files': writer.files,
+    }
+
+
+def find_aliases(pages: typing.Iterable[str],
+                 include_resolver: IncludeResolver) -> typing.Dict[str, str]:
+    """
+    Находит страницы с одинаковым содержимым: символические ссылки, .so
+    перенаправления и побайтовые копий
+
+    Из каждой группы основной становится страница, на файл которой
+    указывает больше всего ссылок и перенаправлений, а если такой нет
+    (все страницы - ссылки) - первая по порядку
+
+    :param pages: пути к man страницам
+    :param include_resolver: кеш подключаемых .so файлов
+    :return: словарь страница-псевдоним - основная страница
+    """
+    groups = {}
+    for page in pages:
+        source = include_resolver.get_source(page)
+        key = includes.content_key(source)
+        groups.setdefault(key, []).append((page, source))
+
+    aliases = {}
+    for group in groups.values():
+        sources = collections.Counter(source for _, source in group)
+        primary = max(
+            (page for page, _ in group if not path.islink(page)),
+            key=lambda p: sources[path.realpath(p)], default=group[0][0])
+        for page, _ in group:
+            if page != primary:
+                aliases[page] = primary
+
+    return aliases
+
+
+def redirect_html(target: str) -> str:
+    """
+    :param target: относительная ссылка на html основной страницы
+    :return: html страницы-псевдонима, перенаправляющей на target
+    """
+    return ('<!DOCTYPE html>'
+            '<html>'
+            '<head>'
+            '<meta charset="utf-8">'
+            f'<link rel="canonical" href="{target}">'
+            f'<meta http-equiv="refresh" content="0; url={target}">'
+            '</head>'
+            '<body>'
+            f'<a href="{target}">{target}</a>'
+            '</body>'
+            '</html>')
+
+
+def write_alias(page: str, output_file: str, primary_file: str,
+                primary_entry: typing.Dict, output_dir: str,
+                mode: str = 'link', html: bool = True,
+                compress: typing.Iterable[str] = ()) -> typing.Dict:
+    """
+    Записывает страницу-псевдоним, не конвертируя её
+
+    :param page: путь к man странице-псевдониму
+    :param output_file: путь к её html файлу
+    :param primary_file: путь к html файлу основной страницы
+    :param primary_entry: запись манифеста основной страницы (пути
+                          относительно output_dir)
+    :param output_dir: директория для html файлов
+    :param mode: способ записи из alias_modes
+    :param html: писать ли сам html файл (для redirect)
+    :param compress: форматы сжатых копий (для redirect)
+    :return: запись манифеста о странице, как у convert_page, с именем
+             html файла основной страницы в alias_of
+    """
+    if mode == 'link':
+        files = []
+        for primary_name in primary_entry['files']:
+            suffix = primary_name[len(path.relpath(primary_file,
+                                                   output_dir)):]
+            file_name = output_file + suffix
+            temp_name = file_name + file_manager.partial_suffix
+            source = path.join(output_dir, primary_name)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_name)
+            try:
+                os.link(source, temp_name)
+            except OSError:
+                # файловая система без жёстких ссылок
+                shutil.copyfile(source, temp_name)
+            os.replace(temp_name, file_name)
+            files.append(file_name)
+        entry = dict(primary_entry, source=page, files=files)
+    else:
+        target = path.relpath(primary_file,
+                              path.dirname(output_file)).replace('\\', '/')
+        with file_manager.OutputWriter(output_file, html, compress) as writer:
+            writer.write(redirect_html(target))
+        entry = {'source': page, 'size': writer.size, 'etag': writer.etag,
+                 'files': writer.files}
+
+    entry['files'] = [path.relpath(f, output_dir) for f in entry['files']]
+    entry['alias_of'] = path.relpath(primary_file, output_dir)
+
+    return entry
+
+
+def convert_directory(input_dir: str, output_dir: str, stylesheet: str,
+                      html: bool = True,
+                      compress: typing.Iterable[str] = (),
+                      manifest_file: str = None,
+                      converter: to_html.Converter =
+                      to_html.default_converter,
+                      metrics: Metrics = None,
+                      resume: bool = False,
+                      journal_file: str = None,
+                      aliases: typing.Optional[str] = 'link',
+                      pages: typing.Iterable[str] = None,
+                      jobs: int = 1,
+                      memory_budget: int = None,
+                      policy: str = 'largest',
+                      render_cache: RenderCache = None,
+                      limits: isolation.Limits = None,
+                      pipelined: bool = False,
+                      fragments: FragmentCache = None,
+                      threads: bool = False,
+                      profiler: CpuProfiler = None) -> typing.Dict:
+    """
+    Конвертирует все man страницы директорий, сохраняя её структуру, и
+    записывает манифест. Имена файлов в манифесте - относительно output_dir
+
+    Каждое уникальное содержимое конвертируется один раз: символические
+    ссылки, .so перенаправления и копий страниц записываются как псевдонимы
+    основной страницы (см. alias_modes)
+
+    Сконвертированные страницы записываются в журнал, который удаляется
+    после записи манифеста. Если конвертация прервалась, то с resume=True
+    страницы из журнала (если они не изменились и их файлы на месте) не
+    конвертируются заново
+
+    С limits страницы конвертируются в процессах с ограничениями (см.
+    isolation.IsolatedPool). Страница, превысившая ограничение, пропускается
+    вместе со своими псевдонимами и записывается в манифест в failures:
+    {<имя html файла>: {"source", "reason", "stage", "size"}}
+
+    С pipelined чтение, конвертация и запись страниц идут одновременно в
+    разных потоках (см. pipeline.Pipeline): поток чтения заранее читает
+    страницы, jobs потоков конвертируют их (при jobs > 1 - в пуле
+    процессов), поток записи пишет html и журнал. Время этапов
+    записывается в metrics.pipeline_seconds
+
+    С threads при jobs > 1 страницы конвертируются в пуле потоков вместо
+    пула процессов: строки страниц и html не копируются между процессами,
+    а конвертер, кеши и метрики общие (они потокобезопасны). На сборках
+    CPython без GIL потоки конвертируют страницы параллельно
+
+    :param input_dir: директория с man страницами
+    :param output_dir: директория для html файлов
+    :param stylesheet: css файл
+    :param html: писать ли сами html файлы
+    :param compress: форматы сжатых копий
+    :param manifest_file: путь к манифесту,
+                          по умолчанию output_dir/manifest.json
+    :param converter: конвертер
+    :param metrics: метрики конвертаций (продолженные по журналу
+                    страницы считаются попаданиями в кеш)
+    :param resume: продолжить прерванную конвертацию по журналу
+    :param journal_file: путь к журналу,
+                         по умолчанию output_dir/.poncho-journal.jsonl
+    :param aliases: способ записи псевдонимов из alias_modes, None -
+                    конвертировать каждую страницу отдельно
+    :param pages: конвертировать только эти страницы директорий (например
+                  страницы шарда), по умолчанию все
+    :param jobs: количество процессов (или потоков, см. threads),
+                 конвертирующих страницы
+    :param memory_budget: бюджет памяти одновременных конвертаций в байтах
+                          (см. scheduler.Scheduler)
+    :param policy: порядок запуска конвертаций при jobs > 1 из
+                   scheduler.policies
+    :param render_cache: кеш html на диске, общий для процессов
+    :param limits: ограничения конвертаций одной страницы, None - без
+                   ограничений и без отдельных процессов при jobs == 1
+    :param pipelined: конвертировать конвейером (без limits; вместо
+                      memory_budget память ограничивают очереди конвейера)
+    :param fragments: кеш html разделов, общий для страниц (у процессов
+                      исполнителей - свой кеш в каждом процессе), None -
+                      без него
+    :param threads: конвертировать в jobs потоках вместо процессов (без
+                    limits: ограничения требуют отдельных процессов)
+    :param profiler: профилировщик, в который собираются конвертаций
+                     страниц из всех потоков и процессов, None - без него
+    :return: записи манифеста по имени html файла (без пропущенных
+             страниц)
+    """
+    if manifest_file is None:
+        manifest_file = path.join(output_dir, 'manifest.json')
+    if journal_file is None:
+        journal_file = path.join(output_dir, '.poncho-journal.jsonl')
+    os.makedirs(output_dir, exist_ok=True)
+
+    include_resolver = IncludeResolver()
+    if pages is None:
+        pages = file_manager.find_man_pages(input_dir)
+    pages = list(pages)
+    alias_of = find_aliases(pages, include_resolver) if aliases else {}
+    # основные страницы конвертируются раньше своих псевдонимов
+    pages.sort(key=lambda p: p in alias_of)
+
+    entries = {}
+    failures = {}
+    converted = set()
+
+    def reuse(page):
+        # запись журнала, если страницу не нужно конвертировать заново
+        output_name = get_output_name(page, input_dir)
+        entry = journal.get_entry(output_name, page)
+        if entry is None or alias_of.get(page) in converted or not all(
+                path.exists(path.join(output_dir, f))
+                for f in entry['files']):
+            if metrics:
+                metrics.cache_requests.inc(result='miss')
+            return False
+
+        if metrics:
+            metrics.cache_requests.inc(result='hit')
+        entries[output_name] = entry
+        return True
+
+    def finish(page, entry):
+        output_name = get_output_name(page, input_dir)
+        journal.add(output_name, page, entry)
+        entries[output_name] = entry
+
+    def fail(page, error):
+        failures[get_output_name(page, input_dir)] = error.to_dict()
+
+    with Journal(journal_file, resume) as journal:
+        primaries = [p for p in pages
+                     if p not in alias_of and not reuse(p)]
+
+        options = dict(input_dir=input_dir, output_dir=output_dir,
+                       stylesheet=stylesheet, html=html,
+                       compress=tuple(compress), converter=converter,
+                       render_cache=render_cache, fragments=fragments,
+                       profiler=profiler)
+        if pipelined:
+            for page in _convert_pipelined(
+                    [t.page for t in scheduler.make_tasks(primaries, policy)],
+                    finish, include_resolver, metrics, jobs, threads,
+                    **options):
+                converted.add(page)
+        elif jobs == 1 and limits is None:
+            for page in primaries:
+                finish(page, _convert_directory_page(
+                    page, metrics=metrics, include_resolver=include_resolver,
+                    **options))
+                converted.add(page)
+        else:
+            tasks = scheduler.make_tasks(primaries, policy)
+            pool = contextlib.nullcontext()
+            if limits is None:
+                convert_task = functools.partial(
+                    _convert_directory_page_task, **options)
+                executor = (concurrent.futures.ThreadPoolExecutor(jobs)
+                            if threads else
+                            concurrent.futures.ProcessPoolExecutor(jobs))
+            else:
+                # поток только ждёт процесс своей страницы
+                pool = isolation.IsolatedPool(limits, jobs)
+                convert_task = functools.partial(
+                    _convert_limited_page_task, pool=pool, **options)
+                executor = concurrent.futures.ThreadPoolExecutor(jobs)
+            with executor, pool:
+                for task, (entry, snapshot) in scheduler.Scheduler(
+                        jobs, memory_budget).run(tasks, convert_task,
+                                                 executor):
+                    if metrics:
+                        metrics.merge(snapshot)
+                    if isinstance(entry, isolation.PageLimitError):
+                        fail(task.page, entry)
+                        continue
+                    finish(task.page, entry)
+                    converted.add(task.page)
+
+        for page in pages:
+            primary = alias_of.get(page)
+            if primary is None or reuse(page):
+                continue
+
+            output_name = get_output_name(page, input_dir)
+            primary_name = get_output_name(primary, input_dir)
+            if primary_name in failures:
+                failures[output_name] = dict(failures[primary_name],
+                                             source=page,
+                                             alias_of=primary_name)
+                continue
+            output_file = path.join(output_dir, output_name)
+            os.makedirs(path.dirname(output_file), exist_ok=True)
+            finish(page, write_alias(page, output_file,
+                                     path.join(output_dir, primary_name),
+                                     entries[primary_name], output_dir,
+                                     aliases, html, compress))
+            if metrics:
+                metrics.alias_pages.inc()
+                metrics.saved_input_bytes.inc(path.getsize(
+                    include_resolver.get_source(page)))
+
+        file_manager.update_manifest(manifest_file, entries, failures)
+        journal.remove()
+
+    if metrics:
+        metrics.include_requests.inc(include_resolver.hits, result='hit')
+        metrics.include_requests.inc(include_resolver.misses, result='miss')
+        if fragments is not None:
+            fragments.record(metrics)
+
+    return entries
+
+
+def _read_page(page, include_resolver):
+    start = time.perf_counter()
+    with file_manager.open_page(page) as man_page:
+        lines = list(include_resolver.expand(man_page, page))
+
+    return page, lines, start
+
+
+def _render_lines(lines, stylesheet, converter, render_cache, metrics=None,
+                  fragments=None, profiler=None):
+    stage = metrics.stage if metrics else contextlib.nullcontext
+    profile = profiler.profile if profiler else contextlib.nullcontext
+    with profile():
+        if render_cache is not None:
+            return b''.join(render_cache.render(lines, stylesheet, converter,
+                                                stage, metrics, fragments))
+
+        return ''.join(converter.convert(lines, stylesheet, stage,
+                                         fragments)).encode('utf-8')
+
+
+def _render_lines_task(lines, **kwargs):
+    """
+    _render_lines в процессе исполнителя
+
+    :return: пара html - снимок метрик конвертаций
+    """
+    metrics = Metrics()
+    body = _render_lines(lines, metrics=metrics, **kwargs)
+    if kwargs.get('fragments') is not None:
+        kwargs['fragments'].record(metrics)
+
+    return body, metrics.snapshot()
+
+
+def _convert_pipelined(pages, finish, include_resolver, metrics, jobs,
+                       threads, input_dir, output_dir, stylesheet, html,
+                       compress, converter, render_cache, fragments,
+                       profiler):
+    """
+    Конвертирует страницы конвейером чтение - конвертация - запись для
+    convert_directory; finish(page, entry) вызывается из потока записи
+
+    :return: сконвертированные страницы в порядке записи
+    """
+    render_options = dict(stylesheet=stylesheet, converter=converter,
+                          render_cache=render_cache, fragments=fragments,
+                          profiler=profiler)
+    # с threads страницы конвертируют сами потоки этапа
+    in_process = jobs == 1 or threads
+    executor = (contextlib.nullcontext() if in_process
+                else concurrent.futures.ProcessPoolExecutor(jobs))
+
+    def render(item):
+        page, lines, start = item
+        if in_process:
+            return page, _render_lines(lines, metrics=metrics,
+                                       **render_options), start
+
+        body, snapshot = executor.submit(_render_lines_task, lines,
+                                         **render_options).result()
+        if metrics:
+            metrics.merge(snapshot)
+        return page, body, start
+
+    def write(item):
+        page, body, start = item
+        output_file = path.join(output_dir, get_output_name(page, input_dir))
+        os.makedirs(path.dirname(output_file), exist_ok=True)
+        stage = metrics.stage if metrics else contextlib.nullcontext
+        with file_manager.open_output(output_file, html,
+                                      compress) as writer, stage('output'):
+            writer.write_bytes(body)
+        if metrics:
+            metrics.page_seconds.observe(time.perf_counter() - start)
+            metrics.pages_converted.inc()
+            metrics.input_bytes.inc(path.getsize(page))
+            metrics.output_bytes.inc(writer.size)
+
+        finish(page, {'source': page, 'size': writer.size,
+                      'etag': writer.etag,
+                      'files': [path.relpath(f, output_dir)
+                                for f in writer.files]})
+        return page
+
+    read = functools.partial(_read_page, include_resolver=include_resolver)
+    stages = [Stage(name, function, workers) for name, function, workers
+              in zip(pipeline_stages, (read, render, write), (1, jobs, 1))]
+    with executor:
+        try:
+            yield from Pipeline(stages, pipeline_queue_size,
+                                metrics).run(pages)
+        except Exception:
+            if metrics:
+                metrics.page_failures.inc()
+            raise
+
+
+def _convert_directory_page(page, input_dir, output_dir, stylesheet, html,
+                            compress, converter, metrics=None,
+                            include_resolver=None, render_cache=None,
+                            fragments=None, profiler=None):
+    """
+    Конвертирует страницу директорий для convert_directory
+
+    :return: запись манифеста, пути файлов в ней - относительно output_dir
+    """
+    output_file = path.join(output_dir, get_output_name(page, input_dir))
+    os.makedirs(path.dirname(output_file), exist_ok=True)
+    entry = convert_page(page, output_file, stylesheet, html, compress,
+                         converter, metrics, include_resolver, render_cache,
+                         fragments, profiler)
+    entry['files'] = [path.relpath(f, output_dir) for f in entry['files']]
+
+    return entry
+
+
+def _convert_page_with_includes(page, metrics, fragments=None, **kwargs):
+    """
+    _convert_directory_page со своим кешем .so файлов, обращения к
+    которому (и к кешу разделов процесса) добавляются к metrics
+
+    :return: запись манифеста
+    """
+    include_resolver = IncludeResolver()
+    entry = _convert_directory_page(page, metrics=metrics,
+                                    include_resolver=include_resolver,
+                                    fragments=fragments, **kwargs)
+    metrics.include_requests.inc(include_resolver.hits, result='hit')
+    metrics.include_requests.inc(include_resolver.misses, result='miss')
+    if fragments is not None:
+        fragments.record(metrics)
+
+    return entry
+
+
+def _convert_directory_page_task(page, **kwargs):
+    """
+    _convert_directory_page в исполнителе (процессе или потоке)
+
+    :return: пара запись манифеста - снимок метрик конвертаций
+             (Metrics.snapshot), которые добавляются к метрикам
+             convert_directory
+    """
+    metrics = Metrics()
+    entry = _convert_page_with_includes(page, metrics, **kwargs)
+
+    return entry, metrics.snapshot()
+
+
+def _convert_limited_page_task(page, pool, **kwargs):
+    """
+    _convert_directory_page в процессе пула с ограничениями
+
+    :param pool: isolation.IsolatedPool
+    :return: пара запись манифеста (или isolation.PageLimitError, если
+             страница превысила ограничение) - снимок метрик конвертаций
+    """
+    metrics = Metrics()
+    try:
+        entry = pool.run(_convert_page_with_includes, page, metrics,
+                         **kwargs)
+    except isolation.PageLimitError as error:
+        metrics.page_failures.inc()
+        entry = error
+
+    return entry, metrics.snapshot()
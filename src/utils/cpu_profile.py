@@ -0,0 +1,316 @@
+import cProfile
+import collections
+import contextlib
+import glob
+import os
+import pickle
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import typing
+from os import path
+
+# deterministic - pstats по cProfile (каждый вызов, с накладными расходами
+# на вызов функций), sampling - только выборки стеков, pstats строится по
+# ним; свёрнутые стеки пишутся по выборкам в обоих режимах
+modes = ('deterministic', 'sampling')
+
+# интервал выборок стеков, в секундах
+sample_interval = 0.005
+
+# суффикс файла свёрнутых стеков (формат flamegraph.pl, speedscope,
+# inferno) рядом с файлом pstats
+folded_suffix = '.folded'
+
+# профилировщики процессов исполнителей по директории, см.
+# CpuProfiler.__reduce__
+_process_profilers = {}
+_process_profilers_lock = threading.Lock()
+
+# функция в pstats: файл, строка, имя
+Function = typing.Tuple[str, int, str]
+
+
+class _StatsData:
+    """
+    Готовые данные pstats для pstats.Stats (он принимает объект с
+    create_stats и stats)
+    """
+
+    __slots__ = ('stats',)
+
+    def __init__(self, stats: typing.Dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def function_key(code) -> Function:
+    """
+    :return: функция кода так же, как её записывает cProfile
+    """
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def folded_name(function: Function) -> str:
+    """
+    :return: имя функции в свёрнутом стеке
+    """
+    file_name, line, name = function
+
+    return f'{name} ({path.basename(file_name)}:{line})'
+
+
+def sampled_stats(stacks: typing.Mapping[typing.Tuple[Function, ...], int],
+                  interval: float) -> typing.Dict:
+    """
+    Строит данные pstats по выборкам стеков: время функции - интервал,
+    умноженный на число выборок, в которых она на вершине стека (tt) или
+    в стеке (ct); вместо количества вызовов - количество выборок
+
+    :param stacks: количество выборок каждого стека (от корня к вершине)
+    :param interval: интервал выборок, в секундах
+    :return: словарь функция - (cc, nc, tt, ct, callers), как у cProfile
+    """
+    stats = {}
+    for stack, count in stacks.items():
+        seconds = count * interval
+        seen = set()
+        for index, function in enumerate(stack):
+            cc, nc, tt, ct, callers = stats.get(function, (0, 0, 0.0, 0.0,
+                                                           {}))
+            leaf = index == len(stack) - 1
+            if leaf:
+                tt += seconds
+            # рекурсивная функция считается в стеке один раз
+            if function not in seen:
+                seen.add(function)
+                cc += count
+                nc += count
+                ct += seconds
+            if index:
+                caller = stack[index - 1]
+                c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (c_cc + count, c_nc + count,
+                                   c_tt + (seconds if leaf else 0.0),
+                                   c_ct + seconds)
+            stats[function] = (cc, nc, tt, ct, callers)
+
+    return stats
+
+
+class CpuProfiler:
+    """
+    Профилирует конвертаций страниц: блоки profile() (конвертация одной
+    страницы) в любых потоках и процессах исполнителей собираются в один
+    профиль, который write записывает в файл pstats и в свёрнутые стеки
+    для flamegraph
+
+    Стеки снимает поток выборок каждые interval секунд, только у потоков
+    внутри profile() и только от функции, начавшей блок; пока он работает,
+    интервал переключения потоков уменьшен (sys.setswitchinterval). В
+    режиме deterministic каждый блок ещё и выполняется под своим cProfile
+
+    Передаётся в процессы исполнителей (pickle) как ссылка на директорию:
+    там общий профилировщик процесса после каждого блока дописывает свои
+    данные в файл процесса, а write собирает их. Поэтому данные страниц,
+    обработанных до остановки процесса (например по ограничениям
+    isolation), не теряются
+    """
+
+    def __init__(self, mode: str = 'deterministic',
+                 interval: float = sample_interval,
+                 directory: str = None):
+        """
+        :param mode: режим из modes
+        :param interval: интервал выборок стеков, в секундах
+        :param directory: директория данных процессов исполнителей; по
+                          умолчанию временная, удаляется в close
+        """
+        if mode not in modes:
+            raise ValueError(f'unknown profile mode: {mode}')
+        self.mode = mode
+        self.interval = interval
+        self.stats = pstats.Stats()
+        # количество выборок стеков (кортежи функций от корня к вершине)
+        self.stacks = collections.Counter()
+        self._temporary = directory is None
+        self.directory = (tempfile.mkdtemp(prefix='poncho-profile-')
+                          if directory is None else directory)
+        # файл, в который дописываются данные блоков (в исполнителе)
+        self._dump_file = None
+        # поток - кадр функции, начавшей его блок profile()
+        self._roots = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._switch_interval = None
+
+    def __reduce__(self):
+        return worker_profiler, (self.directory, self.mode, self.interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextlib.contextmanager
+    def profile(self):
+        """
+        Профилирует блок with текущего потока; вложенные блоки
+        профилируются как часть внешнего
+        """
+        ident = threading.get_ident()
+        if ident in self._roots:
+            yield
+            return
+
+        profile = None
+        if self.mode == 'deterministic':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # с Python 3.12 в процессе может работать только один
+                # cProfile: блок другого потока есть только в выборках
+                profile = None
+        with self._lock:
+            # 0 - этот генератор, 1 - __enter__, 2 - функция с блоком with
+            self._roots[ident] = sys._getframe(2)
+        self._start_sampler()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                del self._roots[ident]
+            self._add(profile)
+
+    def _add(self, profile: typing.Optional[cProfile.Profile]):
+        stats = pstats.Stats(profile) if profile is not None else None
+        with self._lock:
+            if self._dump_file is None:
+                if stats is not None:
+                    self.stats.add(stats)
+                return
+            record = (stats.stats if stats is not None else {},
+                      dict(self.stacks))
+            self.stacks.clear()
+            with open(self._dump_file, 'ab') as dump:
+                pickle.dump(record, dump)
+
+    def _start_sampler(self):
+        with self._lock:
+            if self._sampler is not None:
+                return
+            self._sampler = threading.Thread(target=self._sample,
+                                             name='cpu-profile-sampler',
+                                             daemon=True)
+            # под GIL поток выборок получает его не раньше, чем через
+            # интервал переключения потоков, и выборки реже и смещены к
+            # вводу-выводу, где GIL отпускается сразу
+            self._switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(self._switch_interval,
+                                      self.interval / 10))
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            if not self._roots:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, root in self._roots.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        stack.append(function_key(frame.f_code))
+                        if frame is root:
+                            break
+                        frame = frame.f_back
+                    if stack:
+                        self.stacks[tuple(reversed(stack))] += 1
+            del frames
+
+    def _collect(self):
+        """
+        Добавляет данные процессов исполнителей и удаляет их файлы
+        """
+        for file_name in glob.glob(path.join(self.directory, '*.prof')):
+            with open(file_name, 'rb') as dump:
+                while True:
+                    try:
+                        stats, stacks = pickle.load(dump)
+                    except (EOFError, pickle.UnpicklingError):
+                        # последняя запись остановленного процесса может
+                        # быть неполной
+                        break
+                    if stats:
+                        self.stats.add(_StatsData(stats))
+                    self.stacks.update(stacks)
+            os.remove(file_name)
+
+    @property
+    def samples(self) -> int:
+        """
+        :return: количество выборок стеков
+        """
+        return sum(self.stacks.values())
+
+    def write(self, file_name: str) -> str:
+        """
+        Записывает профиль в file_name (pstats: python -m pstats, snakeviz)
+        и свёрнутые стеки в file_name + folded_suffix
+
+        :param file_name: файл pstats
+        :return: файл свёрнутых стеков
+        """
+        with self._lock:
+            self._collect()
+            stats = self.stats
+            if self.mode == 'sampling':
+                stats = pstats.Stats(_StatsData(sampled_stats(
+                    self.stacks, self.interval)))
+            stacks = sorted(self.stacks.items())
+
+        stats.dump_stats(file_name)
+        folded_file = file_name + folded_suffix
+        with open(folded_file, 'w', encoding='utf-8') as folded:
+            for stack, count in stacks:
+                folded.write(';'.join(folded_name(f) for f in stack))
+                folded.write(f' {count}\n')
+
+        return folded_file
+
+    def close(self):
+        """
+        Останавливает поток выборок и удаляет временную директорию
+        """
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            sys.setswitchinterval(self._switch_interval)
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def worker_profiler(directory: str, mode: str,
+                    interval: float) -> CpuProfiler:
+    """
+    :param directory: директория данных профиля
+    :return: общий профилировщик этого процесса, дописывающий данные в
+             файл процесса в directory
+    """
+    with _process_profilers_lock:
+        profiler = _process_profilers.get(directory)
+        if profiler is None:
+            profiler = CpuProfiler(mode, interval, directory)
+            profiler._dump_file = path.join(directory, f'{os.getpid()}.prof')
+            _process_profilers[directory] = profiler
+
+    return profiler
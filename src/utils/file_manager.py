@@ -1,3 +1,316 @@
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import typing
+from os import path
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# имя man страницы: <имя>.<раздел>[суффикс], например bash.1, chmod.2
+# или open.3p (раздел - цифра и необязательный суффикс)
+man_page_name_pattern = re.compile(r'^(?P<name>.+)\.(?P<section>\d\w*)$')
+
+
 def save_content_to_file(content, file_name):  # pragma: no cover
     with open(file_name, "w") as f:
         f.writelines(content)
+
+
+def split_page_name(file_name: str) -> typing.Tuple[str, str]:
+    """
+    Делит имя файла man страницы на имя страницы и раздел руководства
+
+    Пример: 'man/bash.1' -> ('bash', '1')
+
+    Если раздел определить нельзя, то он равен пустой строке
+
+    :param file_name: путь к файлу man страницы
+    :return: пара имя страницы, раздел
+    """
+    base_name = path.basename(file_name)
+    match = man_page_name_pattern.match(base_name)
+    if not match:
+        return base_name, ''
+
+    return match.group('name'), match.group('section')
+
+
+def find_man_pages(directory: str) -> typing.List[str]:
+    """
+    Рекурсивно находит все man страницы в директорий
+
+    :param directory: директория с man страницами
+    :return: отсортированный список путей к man страницам
+    """
+    pages = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file_name in sorted(files):
+            if man_page_name_pattern.match(file_name):
+                pages.append(path.join(root, file_name))
+
+    return pages
+
+
+def collect_man_pages(paths: typing.Iterable[str]) -> typing.List[str]:
+    """
+    Собирает man страницы из списка файлов и директорий
+
+    Файлы берутся как есть, директорий обходятся рекурсивно
+
+    :param paths: пути к man страницам или директориям с ними
+    :return: список путей к man страницам
+    """
+    pages = []
+    for p in paths:
+        if path.isdir(p):
+            pages.extend(find_man_pages(p))
+        else:
+            pages.append(p)
+
+    return pages
+
+
+compression_suffixes = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# суффикс временных файлов, которые переименовываются в готовые после
+# успешной записи
+partial_suffix = '.part'
+
+# zstd доступен, только если установлен пакет zstandard
+compression_formats = tuple(
+    f for f in compression_suffixes if f != 'zstd' or zstandard)
+
+
+class OutputWriter:
+    """
+    Пишет поток html одновременно в обычный файл и в его сжатые копий
+    (<файл>.gz, <файл>.zst), сжимая данные по мере поступления
+
+    Попутно считается sha256 несжатого содержимого - сильный ETag, по
+    которому сервер может отвечать на условные запросы
+
+    Данные пишутся во временные файлы (<файл>.part), которые при close
+    сбрасываются на диск и атомарно переименовываются, поэтому по
+    настоящему имени никогда не лежит недописанный файл. Если блок with
+    завершился исключением, временные файлы удаляются (discard)
+    """
+
+    def __init__(self, file_name: str, html: bool = True,
+                 compress: typing.Iterable[str] = ()):
+        """
+        :param file_name: имя html файла
+        :param html: писать ли сам html файл
+        :param compress: форматы сжатых копий из compression_formats
+        """
+        self.file_name = file_name
+        self.files = []
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._streams = []
+
+        if html:
+            self._open(file_name, lambda raw: raw)
+        for compression in compress:
+            self._open(file_name + compression_suffixes[compression],
+                       compressors[compression])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def etag(self) -> str:
+        """
+        :return: сильный ETag записанного содержимого
+        """
+        return f'"{self._hash.hexdigest()}"'
+
+    def write(self, chunk: str):
+        self.write_bytes(chunk.encode('utf-8'))
+
+    def write_bytes(self, data: bytes):
+        """
+        Пишет уже закодированный в utf-8 html
+        """
+        self._hash.update(data)
+        self.size += len(data)
+        for stream, _ in self._streams:
+            stream.write(data)
+
+    def close(self):
+        """
+        Дописывает файлы и переименовывает временные файлы в готовые
+        """
+        for stream, raw in self._streams:
+            if stream is not raw:
+                stream.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+            raw.close()
+        for file_name in self.files:
+            os.replace(file_name + partial_suffix, file_name)
+        self._streams = []
+
+    def discard(self):
+        """
+        Закрывает и удаляет временные файлы, не трогая готовые
+        """
+        for stream, raw in self._streams:
+            raw.close()
+        for file_name in self.files:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_name + partial_suffix)
+        self._streams = []
+
+    def _open(self, file_name, compressor):
+        raw = open(file_name + partial_suffix, 'wb')
+        self._streams.append((compressor(raw), raw))
+        self.files.append(file_name)
+
+
+class StreamWriter:
+    """
+    Пишет поток html в открытый двоичный поток (например stdout) с тем же
+    интерфейсом, что у OutputWriter. После каждой части поток сбрасывается,
+    чтобы следующая программа конвейера получала разделы по мере
+    конвертаций
+    """
+
+    def __init__(self, stream: typing.BinaryIO):
+        self.stream = stream
+        self.files = []
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._hash.hexdigest()}"'
+
+    def write(self, chunk: str):
+        self.write_bytes(chunk.encode('utf-8'))
+
+    def write_bytes(self, data: bytes):
+        self._hash.update(data)
+        self.size += len(data)
+        self.stream.write(data)
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+
+@contextlib.contextmanager
+def open_page(file_name: str) -> typing.Iterator[typing.TextIO]:
+    """
+    Открывает man страницу на чтение; '-' - стандартный ввод
+
+    Стандартный ввод читается как байты и декодируется из utf-8 так же,
+    как файлы, независимо от кодировки терминала. Байты не в utf-8
+    заменяются символом U+FFFD, как при извлечении whatis и опций
+
+    :param file_name: путь к man странице или '-'
+    """
+    if file_name != '-':
+        with open(file_name, encoding='utf-8', errors='replace') as man_page:
+            yield man_page
+        return
+
+    man_page = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8',
+                                errors='replace')
+    try:
+        yield man_page
+    finally:
+        # стандартный ввод закрывать нельзя
+        man_page.detach()
+
+
+def open_output(file_name: str, html: bool = True,
+                compress: typing.Iterable[str] = ()) -> \
+        typing.Union[OutputWriter, StreamWriter]:
+    """
+    :param file_name: имя html файла или '-' - стандартный вывод
+    :param html: писать ли сам html файл
+    :param compress: форматы сжатых копий (не для стандартного вывода)
+    :return: OutputWriter файла или StreamWriter стандартного вывода
+    """
+    if file_name == '-':
+        return StreamWriter(sys.stdout.buffer)
+
+    return OutputWriter(file_name, html, compress)
+
+
+def _gzip_compressor(raw: typing.BinaryIO) -> typing.BinaryIO:
+    # mtime=0, чтобы одинаковый html давал одинаковый .gz
+    return gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                         compresslevel=9, mtime=0)
+
+
+def _zstd_compressor(raw: typing.BinaryIO) -> typing.BinaryIO:
+    return zstandard.ZstdCompressor(level=19).stream_writer(raw,
+                                                            closefd=False)
+
+
+compressors = {
+    'gzip': _gzip_compressor,
+    'zstd': _zstd_compressor,
+}
+
+
+def update_manifest(file_name: str, entries: typing.Dict[str, typing.Dict],
+                    failures: typing.Dict[str, typing.Dict] = None):
+    """
+    Добавляет записи о сконвертированных страницах в манифест (JSON)
+
+    Манифест - словарь {"pages": {<имя html файла>: запись}}, запись
+    содержит исходный файл, размер, ETag и список записанных файлов.
+    Страницы, которые не удалось сконвертировать, записываются в
+    необязательный словарь "failures" и удаляются из него, когда
+    сконвертированы
+
+    :param file_name: путь к манифесту, создаётся если его нет
+    :param entries: записи, по имени html файла относительно манифеста
+    :param failures: записи о несконвертированных страницах, по имени
+                     html файла
+    """
+    manifest = {'pages': {}}
+    if path.exists(file_name):
+        with open(file_name, encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+
+    manifest['pages'].update(entries)
+    old_failures = manifest.pop('failures', {})
+    for name in entries:
+        old_failures.pop(name, None)
+    old_failures.update(failures or {})
+    if old_failures:
+        manifest['failures'] = old_failures
+
+    temp_name = file_name + partial_suffix
+    with open(temp_name, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(temp_name, file_name)
@@ -0,0 +1,166 @@
+import collections
+import hashlib
+import threading
+import time
+import typing
+from collections import namedtuple
+
+from src.converters import to_html
+from src.utils.metrics import Metrics
+
+# hits, misses - обращения к кешу по результату, saved_bytes - размер html
+# разделов, взятых из кеша, saved_seconds - время их конвертаций,
+# key_seconds - время вычисления ключей всех разделов (цена кеша)
+FragmentStats = namedtuple('FragmentStats', ['hits', 'misses', 'saved_bytes',
+                                             'saved_seconds', 'key_seconds'])
+
+# кеши процесса по размеру, см. FragmentCache.__reduce__
+_process_caches = {}
+_process_caches_lock = threading.Lock()
+
+
+class FragmentCache:
+    """
+    Кеш html разделов (to_html.Section), общий для страниц
+
+    Многие страницы содержат одинаковые разделы: текст лицензий в
+    COPYRIGHT, типовые REPORTING BUGS и SEE ALSO, общие описания опций у
+    семейства программ. Одинаковый раздел конвертируется один раз, дальше
+    html берётся из кеша. Ключ - хеш разобранного раздела (заголовки и
+    параграфы после Converter.get_sections), отпечатка конвертера и, с
+    оглавлением, id якорей раздела на странице, поэтому html страниц
+    получается тем же, что и без кеша. Кеш ограничен суммарным размером
+    html, давно не использовавшиеся разделы вытесняются (LRU)
+
+    Передаётся в Converter.convert (fragments); можно использовать из
+    нескольких потоков
+    """
+
+    def __init__(self, max_size: int = 32 * 1024 * 1024):
+        """
+        :param max_size: наибольший суммарный размер html в кеше, в байтах
+        """
+        self.max_size = max_size
+        self.size = 0
+        self._fragments = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._converter = (None, None)
+        self._stats = FragmentStats(0, 0, 0, 0.0, 0.0)
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def __reduce__(self):
+        # в процесс исполнителя передаётся не содержимое кеша, а его размер:
+        # там задачи используют общий кеш этого процесса
+        return process_cache, (self.max_size,)
+
+    def _fingerprint(self, converter: to_html.Converter) -> str:
+        # отпечаток последнего конвертера; пара меняется целиком, поэтому
+        # её можно читать из других потоков без блокировки
+        last_converter, fingerprint = self._converter
+        if last_converter is not converter:
+            fingerprint = converter.fingerprint()
+            self._converter = (converter, fingerprint)
+
+        return fingerprint
+
+    def key(self, converter: to_html.Converter, section: to_html.Section,
+            anchors: typing.Sequence[str] = ()) -> bytes:
+        """
+        :param converter: конвертер
+        :param section: раздел
+        :param anchors: id якорей раздела и его подразделов
+        :return: ключ html раздела в кеше
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self._fingerprint(converter).encode('ascii'))
+        digest.update(repr((section, tuple(anchors))).encode(
+            'utf-8', 'surrogatepass'))
+
+        return digest.digest()
+
+    def convert_section(self, converter: to_html.Converter,
+                        section: to_html.Section,
+                        anchors: to_html.Anchors = None) -> str:
+        """
+        :param converter: конвертер
+        :param section: раздел
+        :param anchors: якоря страницы, как у Converter.convert_section
+        :return: html раздела из кеша или сконвертированный
+        """
+        start = time.perf_counter()
+        entries = None
+        if anchors is not None:
+            entries = anchors.add_section(section)
+        key = self.key(converter, section,
+                       [e.anchor for e in entries or ()])
+        key_seconds = time.perf_counter() - start
+
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                html, size, seconds = fragment
+                self._add_stats(1, 0, size, seconds, key_seconds)
+                return html
+
+        start = time.perf_counter()
+        html = converter.convert_section(
+            section,
+            to_html.ReplayAnchors(entries) if entries is not None else None)
+        seconds = time.perf_counter() - start
+        size = len(html.encode('utf-8', 'surrogatepass'))
+
+        with self._lock:
+            self._add_stats(0, 1, 0, 0.0, key_seconds)
+            if size > self.max_size:
+                return html
+            old_fragment = self._fragments.pop(key, None)
+            if old_fragment is not None:
+                self.size -= old_fragment[1]
+            self._fragments[key] = (html, size, seconds)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size, _) = self._fragments.popitem(last=False)
+                self.size -= evicted_size
+
+        return html
+
+    def _add_stats(self, *values):
+        self._stats = FragmentStats(*(a + b for a, b in zip(self._stats,
+                                                            values)))
+
+    def pop_stats(self) -> FragmentStats:
+        """
+        :return: статистика обращений с прошлого вызова pop_stats
+        """
+        with self._lock:
+            stats = self._stats
+            self._stats = FragmentStats(0, 0, 0, 0.0, 0.0)
+
+        return stats
+
+    def record(self, metrics: Metrics):
+        """
+        Добавляет к метрикам статистику обращений с прошлого вызова
+        """
+        stats = self.pop_stats()
+        metrics.fragment_requests.inc(stats.hits, result='hit')
+        metrics.fragment_requests.inc(stats.misses, result='miss')
+        metrics.fragment_saved_bytes.inc(stats.saved_bytes)
+        metrics.fragment_seconds.inc(stats.saved_seconds, kind='saved')
+        metrics.fragment_seconds.inc(stats.key_seconds, kind='key')
+
+
+def process_cache(max_size: int) -> FragmentCache:
+    """
+    :param max_size: размер кеша
+    :return: общий кеш разделов этого процесса с таким размером
+    """
+    with _process_caches_lock:
+        cache = _process_caches.get(max_size)
+        if cache is None:
+            cache = _process_caches[max_size] = FragmentCache(max_size)
+
+    return cache
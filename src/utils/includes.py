@@ -0,0 +1,150 @@
+import hashlib
+import os
+import re
+import threading
+import typing
+from os import path
+
+# .so <файл> - подключение другой man страницы, путь обычно задан
+# относительно корня руководства (например .so man1/other.1)
+so_pattern = re.compile(r'^\.so\s+(\S+)')
+
+# строки, которые не мешают странице быть перенаправлением: пустые и
+# комментарии
+ignored_line_pattern = re.compile(r'^(\.?\\"|\.?\s*$)')
+
+
+class IncludeResolver:
+    """
+    Разворачивает .so в man страницах, кешируя прочитанные файлы
+
+    Кеш проверяет mtime и размер файла, поэтому изменившийся файл читается
+    заново. Подключения глубже max_depth (в том числе циклические) не
+    разворачиваются. Один экземпляр можно использовать из нескольких
+    потоков
+    """
+
+    def __init__(self, root: str = None, max_depth: int = 8):
+        """
+        :param root: корень руководства, относительно которого ищутся
+                     файлы .so. по умолчанию - родитель директорий страницы
+                     (для man/man1/bash.1 это man)
+        :param max_depth: наибольшая глубина вложенности .so
+        """
+        self.root = root
+        self.max_depth = max_depth
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def find_include(self, name: str, page: str) -> typing.Optional[str]:
+        """
+        :param name: путь из .so
+        :param page: страница, в которой встретился .so
+        :return: путь к подключаемому файлу или None, если его нет
+        """
+        page_dir = path.dirname(page)
+        root = self.root if self.root is not None else path.dirname(page_dir)
+        candidates = [path.join(root, name), path.join(page_dir, name),
+                      path.join(page_dir, path.basename(name))]
+
+        for candidate in candidates:
+            if path.isfile(candidate):
+                return path.normpath(candidate)
+
+        return None
+
+    def read_lines(self, file_name: str) -> typing.Tuple[str, ...]:
+        """
+        :return: строки файла (из кеша, если файл не изменился)
+        """
+        stat = os.stat(file_name)
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            cached = self._cache.get(file_name)
+            if cached is not None and cached[0] == key:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        # файл читается без блокировки: два потока могут прочитать его
+        # одновременно, но результат у них одинаковый
+        with open(file_name, encoding='utf-8', errors='replace') as include:
+            lines = tuple(include)
+        with self._lock:
+            self._cache[file_name] = (key, lines)
+
+        return lines
+
+    def expand(self, lines: typing.Iterable[str], page: str,
+               depth: int = 0) -> typing.Iterator[str]:
+        """
+        Лениво заменяет строки .so содержимым подключаемых файлов
+
+        Строки .so, файл которых не найден, пропускаются
+
+        :param lines: строки man страницы
+        :param page: путь к странице
+        :param depth: глубина вложенности
+        :return: строки с развёрнутыми .so
+        """
+        for line in lines:
+            match = so_pattern.match(line)
+            if match is None:
+                yield line
+                continue
+
+            include = self.find_include(match.group(1), page)
+            if include is not None and depth < self.max_depth:
+                yield from self.expand(self.read_lines(include), include,
+                                       depth + 1)
+
+    def get_redirect(self, page: str) -> typing.Optional[str]:
+        """
+        :param page: путь к man странице
+        :return: путь к файлу, если страница - только перенаправление на
+                 него (.so и, возможно, комментарии), иначе None
+        """
+        target = None
+        with open(page, encoding='utf-8', errors='replace') as man_page:
+            for line in man_page:
+                match = so_pattern.match(line)
+                if match and target is None:
+                    target = self.find_include(match.group(1), page)
+                    if target is None:
+                        return None
+                elif not ignored_line_pattern.match(line):
+                    return None
+
+        return target
+
+    def get_source(self, page: str) -> str:
+        """
+        Находит настоящий файл страницы: раскрывает символические ссылки и
+        цепочки перенаправлений .so
+
+        :param page: путь к man странице
+        :return: путь к файлу с содержимым страницы
+        """
+        source = path.realpath(page)
+        for _ in range(self.max_depth):
+            target = self.get_redirect(source)
+            if target is None:
+                break
+            source = path.realpath(target)
+
+        return source
+
+
+def content_key(file_name: str) -> str:
+    """
+    :return: sha256 содержимого файла
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 16), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
@@ -0,0 +1,314 @@
+import contextlib
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import typing
+from collections import namedtuple
+from os import path
+
+from src.utils.metrics import Metrics
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+# ограничения конвертаций одной страницы: wall_time и cpu_time - в
+# секундах, memory - адресное пространство процесса в байтах; None - без
+# ограничения
+Limits = namedtuple('Limits', ['wall_time', 'cpu_time', 'memory'])
+
+no_limits = Limits(None, None, None)
+
+# причины остановки страницы: killed - процесс завершился сигналом по
+# другой причине (например, его остановил OOM killer)
+reasons = ('wall_time', 'cpu_time', 'memory', 'killed')
+
+# этап до первого этапа конвертаций (чтение страницы и подключений .so)
+initial_stage = 'read'
+
+# модули, которые загружает процесс forkserver, чтобы процессам
+# конвертаций не приходилось импортировать их для каждой страницы
+preload_modules = ['src.utils.batch', 'src.utils.server']
+
+_stage_size = 64
+
+
+class PageLimitError(Exception):
+    """
+    Конвертация страницы остановлена, потому что превысила ограничение
+    """
+
+    def __init__(self, page: str, reason: str, stage: str, size: int):
+        """
+        :param page: путь к man странице
+        :param reason: превышенное ограничение из reasons
+        :param stage: этап конвертаций, на котором она была остановлена
+        :param size: размер man страницы в байтах
+        """
+        super().__init__(page, reason, stage, size)
+        self.page = page
+        self.reason = reason
+        self.stage = stage
+        self.size = size
+
+    def __str__(self):
+        return (f'{self.page}: превышено ограничение {self.reason} на этапе '
+                f'{self.stage} (размер {self.size} байт)')
+
+    def to_dict(self) -> typing.Dict:
+        """
+        :return: запись о неудачной странице для манифеста
+        """
+        return {'source': self.page, 'reason': self.reason,
+                'stage': self.stage, 'size': self.size}
+
+
+class _StageMetrics(Metrics):
+    """
+    Метрики процесса конвертаций, которые сообщают родительскому процессу
+    текущий этап через общую память, чтобы он был известен и после
+    остановки процесса
+    """
+
+    def __init__(self, current_stage):
+        super().__init__()
+        self._current_stage = current_stage
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        self._current_stage.value = name.encode('utf-8')[:_stage_size - 1]
+        with super().stage(name):
+            yield
+
+
+def get_context():
+    """
+    :return: контекст multiprocessing для процессов конвертаций: forkserver
+             (процессы создаются быстро и не наследуют потоки и блокировки
+             родителя), а где его нет - spawn
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(preload_modules)
+        return context
+
+    return multiprocessing.get_context('spawn')  # pragma: no cover
+
+
+def _set_memory_limit(limits: Limits):
+    if resource is not None and limits.memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (limits.memory, limits.memory))
+
+
+def _set_cpu_limit(limits: Limits):
+    if resource is None or limits.cpu_time is None:  # pragma: no cover
+        return
+
+    # процессорное время процесса накапливается за все страницы, поэтому
+    # предел отсчитывается от уже потраченного (с точностью до секунды
+    # в большую сторону); после него процесс получает SIGXCPU
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    seconds = math.ceil(usage.ru_utime + usage.ru_stime + limits.cpu_time)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        seconds = min(seconds, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (seconds, hard))
+
+
+def _worker_main(connection, current_stage, limits):
+    _set_memory_limit(limits)
+    while True:
+        try:
+            function, page, kwargs = connection.recv()
+        except EOFError:
+            return
+
+        current_stage.value = initial_stage.encode('utf-8')
+        _set_cpu_limit(limits)
+        metrics = _StageMetrics(current_stage)
+        try:
+            result = function(page, metrics=metrics, **kwargs)
+        except MemoryError:
+            message = ('memory', None, None)
+        except Exception as error:
+            message = ('error', error, metrics.snapshot())
+        else:
+            message = ('ok', result, metrics.snapshot())
+
+        try:
+            connection.send(message)
+        except Exception as error:
+            # исключение или результат не сериализуется
+            connection.send(('error', RuntimeError(repr(error)), None))
+        if message[0] == 'memory':
+            # после нехватки памяти состояние процесса ненадёжно
+            return
+
+
+def _exit_reason(exitcode: int, limits: Limits) -> str:
+    # _set_cpu_limit меняет только мягкий предел, поэтому превышение
+    # процессорного времени - всегда SIGXCPU; SIGKILL посылает кто-то другой
+    # (например, OOM killer)
+    if exitcode == -signal.SIGXCPU and limits.cpu_time is not None:
+        return 'cpu_time'
+
+    return 'killed'
+
+
+class _Worker:
+    """
+    Процесс, конвертирующий страницы по одной
+    """
+
+    def __init__(self, context, limits: Limits):
+        self.current_stage = context.Array('c', _stage_size, lock=False)
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, self.current_stage, limits),
+            daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    @property
+    def stage(self) -> str:
+        return self.current_stage.value.decode('utf-8')
+
+    def stop(self):
+        self.connection.close()
+        self.process.kill()
+        self.process.join()
+
+
+class IsolatedPool:
+    """
+    Процессы, в которых страницы конвертируются с ограничениями Limits
+
+    Процесс, превысивший ограничение, завершается, и страница
+    останавливается, не задерживая конвертаций в других процессах.
+    Остальные процессы переиспользуются для следующих страниц, поэтому
+    процесс не создаётся заново для каждой страницы. Пул можно
+    использовать из нескольких потоков: каждой одновременной конвертаций
+    достаётся свой процесс, а когда все max_workers процессов заняты,
+    конвертация ждёт, пока один из них освободится
+
+    Без модуля resource (Windows) действует только ограничение wall_time
+    """
+
+    def __init__(self, limits: Limits, max_idle: int = None,
+                 max_workers: int = None):
+        """
+        :param limits: ограничения конвертаций одной страницы
+        :param max_idle: сколько свободных процессов держать для следующих
+                         страниц, по умолчанию по числу процессоров
+        :param max_workers: сколько процессов может конвертировать
+                            одновременно, по умолчанию по числу процессоров
+        """
+        self.limits = limits
+        self.max_idle = max_idle or os.cpu_count() or 1
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._context = get_context()
+        self._idle = []
+        self._lock = threading.Lock()
+        # свободные места для процессов: без него каждый одновременный
+        # запрос сервера запускал бы свой процесс
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+        return _Worker(self._context, self.limits)
+
+    def _release(self, worker: _Worker):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(worker)
+                return
+
+        worker.stop()
+
+    def run(self, function: typing.Callable, page: str,
+            metrics: Metrics = None, **kwargs) -> typing.Any:
+        """
+        Выполняет function(page, metrics=..., **kwargs) в процессе пула
+
+        :param function: функция уровня модуля (передаётся в процесс по
+                         имени)
+        :param page: путь к man странице, первый аргумент function
+        :param metrics: метрики, к которым добавляются метрики процесса и
+                        остановленные страницы (page_limit_violations)
+        :param kwargs: остальные аргументы function, должны сериализоваться
+                       pickle
+        :return: результат function
+        :raise PageLimitError: если страница превысила ограничение
+        """
+        with self._slots:
+            return self._run(function, page, metrics, kwargs)
+
+    def _run(self, function: typing.Callable, page: str,
+             metrics: typing.Optional[Metrics], kwargs: typing.Dict) -> \
+            typing.Any:
+        worker = self._acquire()
+        reason = None
+        try:
+            worker.connection.send((function, page, kwargs))
+            if not worker.connection.poll(self.limits.wall_time):
+                reason = 'wall_time'
+            else:
+                status, result, snapshot = worker.connection.recv()
+                if status == 'memory':
+                    reason = 'memory'
+        except (EOFError, OSError):
+            # процесс завершился, не ответив
+            worker.process.join()
+            reason = _exit_reason(worker.process.exitcode, self.limits)
+        except BaseException:
+            worker.stop()
+            raise
+
+        if reason is not None:
+            worker.stop()
+            error = PageLimitError(page, reason, worker.stage,
+                                   path.getsize(page))
+            if metrics:
+                metrics.page_limit_violations.inc(reason=reason,
+                                                  stage=error.stage)
+            raise error
+
+        self._release(worker)
+        if metrics and snapshot:
+            metrics.merge(snapshot)
+        if status == 'error':
+            raise result
+
+        return result
+
+    def close(self):
+        """
+        Завершает свободные процессы
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+
+def run_limited(function: typing.Callable, page: str, limits: Limits,
+                metrics: Metrics = None, **kwargs) -> typing.Any:
+    """
+    Выполняет function(page, metrics=..., **kwargs) в отдельном процессе
+    с ограничениями limits (см. IsolatedPool.run)
+    """
+    with IsolatedPool(limits) as pool:
+        return pool.run(function, page, metrics, **kwargs)
@@ -0,0 +1,141 @@
+import contextlib
+import json
+import tempfile
+import tracemalloc
+import typing
+from collections import namedtuple
+
+from src.converters import to_html
+
+StageMemory = namedtuple('StageMemory', ['peak', 'retained'])
+
+stages = ('get_sections', 'convert_section', 'output')
+
+
+class MemoryProfiler:
+    """
+    Замеряет память этапов конвертаций с помощью tracemalloc
+
+    Для каждого этапа запоминается:
+
+    peak - наибольший объём памяти (в байтах), выделенной с начала замера,
+           который был достигнут во время этапа
+    retained - сколько памяти этап оставил выделенной, в сумме по всем его
+               вызовам (может быть отрицательным, если этап освобождает
+               память, выделенную раньше)
+    """
+
+    def __init__(self):
+        self.peaks = {}
+        self.retained = {}
+        self._baseline = 0
+
+    def start(self):
+        tracemalloc.start()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Замеряет память, выделенную внутри блока with, как этап name
+        """
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peaks[name] = max(self.peaks.get(name, 0),
+                                   peak - self._baseline)
+            self.retained[name] = (self.retained.get(name, 0) +
+                                   current - before)
+
+    def results(self) -> typing.Dict[str, StageMemory]:
+        """
+        :return: словарь этап - замеры памяти этапа
+        """
+        return {name: StageMemory(self.peaks[name], self.retained[name])
+                for name in self.peaks}
+
+
+def profile_conversion(file_name: str, stylesheet: str = 'main.css') -> \
+        typing.Dict[str, StageMemory]:
+    """
+    Конвертирует man страницу во временный файл и замеряет память этапов
+    get_sections, convert_section и output (запись в файл)
+
+    :param file_name: путь к man странице
+    :param stylesheet: css файл
+    :return: словарь этап - замеры памяти этапа
+    """
+    profiler = MemoryProfiler()
+    with open(file_name) as man_page, \
+            tempfile.TemporaryFile('w') as out_file:
+        profiler.start()
+        try:
+            for chunk in to_html.convert(man_page, stylesheet,
+                                         stage=profiler.stage):
+                with profiler.stage('output'):
+                    out_file.write(chunk)
+                del chunk
+        finally:
+            profiler.stop()
+
+    return profiler.results()
+
+
+def load_budgets(file_name: str) -> typing.Dict:
+    """
+    Загружает бюджеты памяти из JSON файла вида:
+
+    {"default": {"peak": 1048576, "retained": 262144},
+     "pages": {"gcc.1": {"peak": 16777216}}}
+
+    Бюджет страницы - бюджет по умолчанию, дополненный её собственными
+    значениями. peak и retained задаются в байтах и ограничивают каждый этап;
+    вместо числа можно указать словарь этап - бюджет
+
+    :param file_name: путь к файлу бюджетов
+    :return: бюджеты
+    """
+    with open(file_name, encoding='utf-8') as budgets_file:
+        return json.load(budgets_file)
+
+
+def get_page_budget(budgets: typing.Dict, page_name: str) -> typing.Dict:
+    """
+    :return: бюджет памяти для страницы page_name
+    """
+    budget = dict(budgets.get('default', {}))
+    budget.update(budgets.get('pages', {}).get(page_name, {}))
+
+    return budget
+
+
+def check_budget(results: typing.Dict[str, StageMemory],
+                 budget: typing.Dict) -> typing.List[str]:
+    """
+    Сравнивает замеры памяти с бюджетом
+
+    :param results: замеры profile_conversion
+    :param budget: бюджет страницы
+    :return: описания превышений бюджета, пустой список если их нет
+    """
+    violations = []
+    for stage_name, memory in sorted(results.items()):
+        for field in StageMemory._fields:
+            limit = budget.get(field)
+            if isinstance(limit, dict):
+                limit = limit.get(stage_name)
+            if limit is None:
+                continue
+
+            value = getattr(memory, field)
+            if value > limit:
+                violations.append(f'{stage_name}: {field} {value} B '
+                                  f'exceeds budget {limit} B')
+
+    return violations
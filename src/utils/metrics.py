@@ -0,0 +1,284 @@
+import bisect
+import contextlib
+import os
+import tempfile
+import threading
+import time
+import typing
+from os import path
+
+# границы корзин гистограмм длительности, в секундах
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: typing.Tuple[typing.Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+
+    escaped = (f'{name}="{_escape(str(value))}"' for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value: str) -> str:
+    return (value.replace('\\', r'\\')
+            .replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Счётчик, который только растёт, с необязательными метками
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str,
+                 lock: threading.Lock):
+        self.name = name
+        self.description = description
+        self._lock = lock
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def snapshot(self) -> typing.Dict:
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, values: typing.Dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self) -> typing.Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_format_labels(labels)} {_format_value(value)}'
+
+
+class Histogram:
+    """
+    Гистограмма наблюдений (например, длительностей) с метками
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str,
+                 lock: threading.Lock,
+                 buckets: typing.Sequence[float] = default_buckets):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._lock = lock
+        # метки -> [счётчики корзин, сумма, количество]
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0))
+            if index < len(counts):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def snapshot(self) -> typing.Dict:
+        with self._lock:
+            return {key: (list(counts), total, count)
+                    for key, (counts, total, count) in self._values.items()}
+
+    def merge(self, values: typing.Dict):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                old_counts, old_total, old_count = self._values.get(
+                    key, ([0] * len(self.buckets), 0.0, 0))
+                self._values[key] = (
+                    [a + b for a, b in zip(old_counts, counts)],
+                    old_total + total, old_count + count)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            values = self._values.get(tuple(sorted(labels.items())))
+        return values[2] if values else 0
+
+    def samples(self) -> typing.Iterator[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count)
+                            in self._values.items())
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (('le', _format_value(bound)),)
+                yield (f'{self.name}_bucket{_format_labels(bucket_labels)} '
+                       f'{cumulative}')
+            bucket_labels = labels + (('le', '+Inf'),)
+            yield f'{self.name}_bucket{_format_labels(bucket_labels)} {count}'
+            yield (f'{self.name}_sum{_format_labels(labels)} '
+                   f'{_format_value(total)}')
+            yield f'{self.name}_count{_format_labels(labels)} {count}'
+
+
+class Metrics:
+    """
+    Метрики конвертаций в пакетном режиме и в режиме сервера
+
+    Метрики можно изменять из нескольких потоков, выгружаются они в
+    текстовом формате Prometheus (render, write)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+        self.pages_converted = self._add(Counter(
+            'poncho_pages_converted_total',
+            'Сконвертировано страниц', self._lock))
+        self.page_failures = self._add(Counter(
+            'poncho_page_failures_total',
+            'Страниц, которые не удалось сконвертировать', self._lock))
+        self.input_bytes = self._add(Counter(
+            'poncho_input_bytes_total',
+            'Прочитано байт man страниц', self._lock))
+        self.output_bytes = self._add(Counter(
+            'poncho_output_bytes_total',
+            'Записано (или отправлено) байт html', self._lock))
+        self.cache_requests = self._add(Counter(
+            'poncho_cache_requests_total',
+            'Обращения к кешу сконвертированных страниц по результату '
+            '(hit, miss)', self._lock))
+        self.alias_pages = self._add(Counter(
+            'poncho_alias_pages_total',
+            'Страниц-псевдонимов (ссылки, .so перенаправления, копий), '
+            'записанных без конвертаций', self._lock))
+        self.saved_input_bytes = self._add(Counter(
+            'poncho_saved_input_bytes_total',
+            'Байт man страниц, которые не пришлось разбирать благодаря '
+            'псевдонимам', self._lock))
+        self.include_requests = self._add(Counter(
+            'poncho_include_requests_total',
+            'Обращения к кешу подключаемых .so файлов по результату '
+            '(hit, miss)', self._lock))
+        self.render_cache_requests = self._add(Counter(
+            'poncho_render_cache_requests_total',
+            'Обращения к кешу html на диске по результату (hit, miss)',
+            self._lock))
+        self.page_limit_violations = self._add(Counter(
+            'poncho_page_limit_violations_total',
+            'Страниц, остановленных из-за превышения ограничений, по '
+            'ограничению и этапу конвертаций', self._lock))
+        self.fragment_requests = self._add(Counter(
+            'poncho_fragment_requests_total',
+            'Обращения к кешу html разделов по результату (hit, miss)',
+            self._lock))
+        self.fragment_saved_bytes = self._add(Counter(
+            'poncho_fragment_saved_bytes_total',
+            'Байт html разделов, взятых из кеша вместо конвертаций',
+            self._lock))
+        self.fragment_seconds = self._add(Counter(
+            'poncho_fragment_seconds_total',
+            'Время конвертаций разделов, взятых из кеша (saved), и '
+            'вычисления ключей кеша (key)', self._lock))
+        self.coalesced_requests = self._add(Counter(
+            'poncho_coalesced_requests_total',
+            'Запросы конвертаций по роли: leader - сконвертировал страницу, '
+            'follower - дождался конвертаций того же ключа другим запросом',
+            self._lock))
+        self.pipeline_seconds = self._add(Counter(
+            'poncho_pipeline_seconds_total',
+            'Время потоков этапа конвейера (pipeline) по состоянию: busy - '
+            'работа, starved - ожидание входной очереди, blocked - '
+            'ожидание места в выходной', self._lock))
+        self.stage_seconds = self._add(Histogram(
+            'poncho_stage_duration_seconds',
+            'Длительность этапов конвертаций', self._lock))
+        self.page_seconds = self._add(Histogram(
+            'poncho_page_duration_seconds',
+            'Длительность конвертаций страницы целиком', self._lock))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Замеряет длительность этапа name; подходит как stage для
+        to_html.convert
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start,
+                                       stage=name)
+
+    def snapshot(self) -> typing.Dict[str, typing.Dict]:
+        """
+        :return: значения всех метрик; их можно передать из процесса
+                 исполнителя (pickle) и добавить к другим метрикам (merge)
+        """
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def merge(self, snapshot: typing.Dict[str, typing.Dict]):
+        """
+        Добавляет к метрикам значения snapshot других метрик
+        """
+        for metric in self._metrics:
+            metric.merge(snapshot.get(metric.name, {}))
+
+    def cache_hit_rate(self) -> float:
+        """
+        :return: доля попаданий в кеш, 0 если обращений не было
+        """
+        hits = self.cache_requests.get(result='hit')
+        total = hits + self.cache_requests.get(result='miss')
+
+        return hits / total if total else 0.0
+
+    def render(self) -> str:
+        """
+        :return: метрики в текстовом формате Prometheus
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_name: str):
+        """
+        Атомарно записывает метрики в файл (например, для textfile
+        collector'а node_exporter)
+        """
+        directory = path.dirname(path.abspath(file_name))
+        fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as metrics_file:
+                metrics_file.write(self.render())
+            os.replace(temp_name, file_name)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
@@ -0,0 +1,267 @@
+import hashlib
+import io
+import sqlite3
+import time
+import typing
+
+from src.converters import to_html
+from src.utils.includes import IncludeResolver
+
+schema = '''
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    section TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    fingerprint TEXT NOT NULL DEFAULT '',
+    rendered_at REAL NOT NULL,
+    UNIQUE (name, section)
+);
+CREATE TABLE IF NOT EXISTS sections (
+    page_id INTEGER NOT NULL REFERENCES pages (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    header TEXT NOT NULL,
+    html TEXT NOT NULL,
+    PRIMARY KEY (page_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sections_by_header ON sections (page_id, header);
+'''
+
+
+def source_hash(source: bytes) -> str:
+    """
+    Считает хеш исходного текста man страницы
+
+    :param source: содержимое man страницы
+    :return: hex-строка sha256
+    """
+    return hashlib.sha256(source).hexdigest()
+
+
+class PageStore:
+    """
+    Хранилище сконвертированных man страниц в одной базе SQLite
+
+    Каждая страница хранится по ключу (имя, раздел руководства) вместе с
+    хешем исходника, отпечатком конвертера и временем конвертаций, а её
+    разделы - отдельными строками, чтобы можно было достать как всю
+    страницу, так и один раздел.
+
+    Запись идёт пачками: транзакция фиксируется раз в batch_size страниц
+    (и при закрытий хранилища без ошибки), база открывается в режиме WAL.
+    """
+
+    def __init__(self, file_name: str, batch_size: int = 100,
+                 converter: to_html.Converter = None,
+                 include_resolver: IncludeResolver = None):
+        """
+        :param file_name: файл базы
+        :param batch_size: количество страниц в одной транзакции
+        :param converter: конвертер страниц add_man_page, по умолчанию
+                          to_html.default_converter
+        :param include_resolver: кеш подключаемых .so файлов
+        """
+        self.batch_size = batch_size
+        self.converter = converter or to_html.default_converter
+        self.include_resolver = include_resolver or IncludeResolver()
+        self._fingerprint = self.converter.fingerprint()
+        self._pending = 0
+        self._connection = sqlite3.connect(file_name, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('PRAGMA foreign_keys=ON')
+        self._connection.executescript(schema)
+        # в базах, созданных до отпечатков конвертера, добавляется столбец;
+        # их страницы конвертируются заново
+        columns = {row[1] for row in self._connection.execute(
+            'PRAGMA table_info(pages)')}
+        if 'fingerprint' not in columns:
+            self._connection.execute(
+                "ALTER TABLE pages ADD COLUMN fingerprint TEXT NOT NULL "
+                "DEFAULT ''")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # после ошибки незафиксированная пачка не сохраняется
+        if exc_type is not None:
+            self.rollback()
+        self.close()
+
+    def add_page(self, name: str, section: str, source_hash: str,
+                 sections: typing.Iterable[typing.Tuple[str, str]],
+                 rendered_at: float = None, fingerprint: str = ''):
+        """
+        Добавляет (или заменяет) страницу в хранилище
+
+        Страница добавляется целиком: если sections бросает исключение,
+        прежняя версия страницы остаётся
+
+        :param name: имя страницы
+        :param section: раздел руководства
+        :param source_hash: хеш исходника страницы
+        :param sections: пары заголовок раздела, html код раздела
+        :param rendered_at: время конвертаций, по умолчанию текущее
+        :param fingerprint: отпечаток конвертера, создавшего html
+        """
+        if rendered_at is None:
+            rendered_at = time.time()
+
+        self._begin()
+        self._connection.execute('SAVEPOINT page')
+        try:
+            self._replace_page(name, section, source_hash, sections,
+                               rendered_at, fingerprint)
+        except BaseException:
+            self._connection.execute('ROLLBACK TO page')
+            raise
+        finally:
+            self._connection.execute('RELEASE page')
+
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def _replace_page(self, name: str, section: str, source_hash: str,
+                      sections: typing.Iterable[typing.Tuple[str, str]],
+                      rendered_at: float, fingerprint: str):
+        cursor = self._connection.execute(
+            'SELECT id FROM pages WHERE name = ? AND section = ?',
+            (name, section))
+        row = cursor.fetchone()
+        if row:
+            page_id = row[0]
+            self._connection.execute(
+                'UPDATE pages SET source_hash = ?, fingerprint = ?, '
+                'rendered_at = ? WHERE id = ?',
+                (source_hash, fingerprint, rendered_at, page_id))
+            self._connection.execute(
+                'DELETE FROM sections WHERE page_id = ?', (page_id,))
+        else:
+            page_id = self._connection.execute(
+                'INSERT INTO pages (name, section, source_hash, fingerprint, '
+                'rendered_at) VALUES (?, ?, ?, ?, ?)',
+                (name, section, source_hash, fingerprint,
+                 rendered_at)).lastrowid
+
+        self._connection.executemany(
+            'INSERT INTO sections (page_id, position, header, html) '
+            'VALUES (?, ?, ?, ?)',
+            ((page_id, position, header, html)
+             for position, (header, html) in enumerate(sections)))
+
+    def add_man_page(self, name: str, section: str, source: bytes,
+                     page: str = None) -> bool:
+        """
+        Конвертирует man страницу по разделам конвертером хранилища и
+        сохраняет её
+
+        Страница декодируется и её .so разворачиваются так же, как в
+        batch.convert_page: байты не в utf-8 заменяются, а страница-
+        перенаправление сохраняется с разделами страницы, на которую она
+        указывает. Если страница с таким же хешем исходника (после
+        развёртывания .so), сконвертированная конвертером с тем же
+        отпечатком, уже есть в хранилище, то повторно она не
+        конвертируется
+
+        :param name: имя страницы
+        :param section: раздел руководства
+        :param source: содержимое man страницы
+        :param page: путь к man странице, от которого ищутся файлы .so; по
+                     умолчанию они ищутся от текущей директорий
+        :return: True, если страница была сконвертирована
+        """
+        man_page = io.StringIO(source.decode('utf-8', errors='replace'))
+        lines = list(self.include_resolver.expand(
+            man_page, page if page is not None else '-'))
+        digest = source_hash(''.join(lines).encode('utf-8'))
+        row = self._connection.execute(
+            'SELECT source_hash, fingerprint FROM pages '
+            'WHERE name = ? AND section = ?', (name, section)).fetchone()
+        if row == (digest, self._fingerprint):
+            return False
+
+        sections = ((s.header, self.converter.convert_section(s))
+                    for s in self.converter.get_sections(lines))
+        self.add_page(name, section, digest, sections,
+                      fingerprint=self._fingerprint)
+
+        return True
+
+    def flush(self):
+        """
+        Фиксирует накопленную транзакцию
+        """
+        if self._connection.in_transaction:
+            self._connection.execute('COMMIT')
+        self._pending = 0
+
+    def rollback(self):
+        """
+        Отменяет накопленную транзакцию
+        """
+        if self._connection.in_transaction:
+            self._connection.execute('ROLLBACK')
+        self._pending = 0
+
+    def close(self):
+        """
+        Фиксирует накопленные изменения и закрывает базу
+        """
+        self.flush()
+        self._connection.close()
+
+    def get_source_hash(self, name: str, section: str) -> typing.Optional[str]:
+        """
+        :return: хеш исходника сохранённой страницы или None, если её нет
+        """
+        row = self._connection.execute(
+            'SELECT source_hash FROM pages WHERE name = ? AND section = ?',
+            (name, section)).fetchone()
+
+        return row[0] if row else None
+
+    def get_page(self, name: str, section: str) -> typing.Optional[str]:
+        """
+        Возвращает html код всех разделов страницы
+
+        :param name: имя страницы
+        :param section: раздел руководства
+        :return: html код страницы или None, если её нет
+        """
+        if self.get_source_hash(name, section) is None:
+            return None
+
+        rows = self._connection.execute(
+            'SELECT sections.html FROM sections '
+            'JOIN pages ON pages.id = sections.page_id '
+            'WHERE pages.name = ? AND pages.section = ? '
+            'ORDER BY sections.position',
+            (name, section))
+
+        return ''.join(html for html, in rows)
+
+    def get_section(self, name: str, section: str, header: str) -> \
+            typing.Optional[str]:
+        """
+        Возвращает html код одного раздела страницы
+
+        :param name: имя страницы
+        :param section: раздел руководства
+        :param header: заголовок раздела страницы
+        :return: html код раздела или None, если его нет
+        """
+        row = self._connection.execute(
+            'SELECT sections.html FROM sections '
+            'JOIN pages ON pages.id = sections.page_id '
+            'WHERE pages.name = ? AND pages.section = ? '
+            'AND sections.header = ? '
+            'ORDER BY sections.position LIMIT 1',
+            (name, section, header)).fetchone()
+
+        return row[0] if row else None
+
+    def _begin(self):
+        if not self._connection.in_transaction:
+            self._connection.execute('BEGIN')
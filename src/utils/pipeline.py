@@ -0,0 +1,176 @@
+import queue
+import threading
+import time
+import typing
+from collections import namedtuple
+
+from src.utils.metrics import Metrics
+
+# этап конвейера: function(item) -> item следующего этапа, workers -
+# количество потоков этапа
+Stage = namedtuple('Stage', ['name', 'function', 'workers'])
+
+
+class StageStats(namedtuple('StageStats', ['name', 'workers', 'items', 'busy',
+                                           'starved', 'blocked'])):
+    """
+    Время потоков этапа в секундах: busy - обработка, starved - ожидание
+    входной очереди (этап быстрее предыдущих), blocked - ожидание места в
+    выходной очереди (этап быстрее следующих)
+    """
+
+    __slots__ = ()
+
+    @property
+    def utilization(self) -> float:
+        """
+        :return: доля времени, которую потоки этапа были заняты работой;
+                 у узкого места конвейера она ближе всего к 1
+        """
+        total = self.busy + self.starved + self.blocked
+
+        return self.busy / total if total else 0.0
+
+
+# состояния потоков этапа, см. StageStats
+states = ('busy', 'starved', 'blocked')
+
+# конец входных данных этапа
+_done = object()
+
+
+class Pipeline:
+    """
+    Конвейер этапов в отдельных потоках, соединённых очередями
+    ограниченной длины
+
+    Пока один этап ждёт ввода-вывода (например, чтения с сетевого диска),
+    другие продолжают работу, а ограниченные очереди не дают быстрому
+    этапу уйти далеко вперёд и накопить в памяти много страниц
+    """
+
+    def __init__(self, stages: typing.Iterable[Stage], queue_size: int = 8,
+                 metrics: Metrics = None):
+        """
+        :param stages: этапы по порядку
+        :param queue_size: длина очереди перед каждым этапом и после
+                           последнего
+        :param metrics: метрики, в которые записывается время этапов
+                        (pipeline_seconds)
+        """
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._failed = threading.Event()
+        self._error = None
+
+    def run(self, items: typing.Iterable) -> typing.Iterator:
+        """
+        Пропускает items через все этапы
+
+        Если этап выбросил исключение, новые элементы не обрабатываются, а
+        исключение выбрасывается после остановки всех потоков
+
+        :param items: входные элементы первого этапа
+        :return: результаты последнего этапа в порядке готовности
+        """
+        queues = [queue.Queue(self.queue_size)
+                  for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed,
+                                    args=(items, queues[0]), daemon=True)]
+        for stage, inbox, outbox in zip(self.stages, queues, queues[1:]):
+            remaining = [stage.workers]
+            threads.extend(
+                threading.Thread(target=self._work,
+                                 args=(stage, inbox, outbox, remaining),
+                                 name=f'pipeline-{stage.name}', daemon=True)
+                for _ in range(stage.workers))
+        for thread in threads:
+            thread.start()
+
+        item = None
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _done:
+                    break
+                if not self._failed.is_set():
+                    yield item
+        finally:
+            # потребитель мог остановиться раньше - потоки дочитывают
+            # очереди до конца и завершаются
+            if item is not _done:
+                self._failed.set()
+                while queues[-1].get() is not _done:
+                    pass
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._failed.set()
+
+    def _feed(self, items, inbox):
+        try:
+            for item in items:
+                if self._failed.is_set():
+                    break
+                inbox.put(item)
+        except BaseException as error:
+            self._fail(error)
+        inbox.put(_done)
+
+    def _work(self, stage: Stage, inbox, outbox, remaining):
+        items = 0
+        busy = starved = blocked = 0.0
+        while True:
+            start = time.perf_counter()
+            item = inbox.get()
+            got = time.perf_counter()
+            starved += got - start
+            if item is _done:
+                # конец увидят и остальные потоки этапа
+                inbox.put(_done)
+                break
+            if self._failed.is_set():
+                continue
+
+            try:
+                result = stage.function(item)
+            except BaseException as error:
+                self._fail(error)
+                continue
+            done = time.perf_counter()
+            busy += done - got
+            outbox.put(result)
+            blocked += time.perf_counter() - done
+            items += 1
+
+        self._add_stats(stage, items, busy, starved, blocked)
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            outbox.put(_done)
+
+    def _add_stats(self, stage, items, busy, starved, blocked):
+        with self._lock:
+            old = self.stats.get(stage.name,
+                                 StageStats(stage.name, stage.workers,
+                                            0, 0.0, 0.0, 0.0))
+            self.stats[stage.name] = old._replace(
+                items=old.items + items, busy=old.busy + busy,
+                starved=old.starved + starved,
+                blocked=old.blocked + blocked)
+
+        if self.metrics:
+            for state, seconds in zip(states, (busy, starved, blocked)):
+                self.metrics.pipeline_seconds.inc(seconds, stage=stage.name,
+                                                  state=state)
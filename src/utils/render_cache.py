@@ -0,0 +1,267 @@
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import typing
+from collections import namedtuple
+from os import path
+
+from src.converters import to_html
+from src.utils.metrics import Metrics
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+CacheStats = namedtuple('CacheStats', ['entries', 'size', 'oldest', 'newest'])
+
+# суффикс готовых файлов кеша; временные файлы записи его не имеют
+entry_suffix = '.html'
+
+# файл с суммарным размером файлов кеша; его общий для всех процессов
+# счётчик обновляется под блокировкой файла (flock)
+size_file_name = 'size'
+
+# до какой доли max_size подрезается переполненный кеш, чтобы директория
+# обходилась не при каждой записи
+prune_target = 0.8
+
+# блокировка потоков процесса (без fcntl - единственная); не хранится в
+# самом кеше, чтобы его можно было передать в процесс исполнителя (pickle)
+_size_lock = threading.Lock()
+
+
+class RenderCache:
+    """
+    Общий для нескольких процессов кеш html на диске
+
+    Ключ - sha256 исходника (с развёрнутыми .so), css файла и отпечатка
+    конвертера (to_html.Converter.fingerprint), поэтому одинаковые страницы
+    конвертируются один раз для всех программ, использующих директорию
+    кеша. Файлы пишутся во временный файл и атомарно переименовываются, так
+    что читатель видит либо весь html, либо ничего. При чтении у файла
+    обновляется mtime, и prune удаляет давно не читавшиеся файлы (LRU)
+
+    Суммарный размер файлов хранится в директории кеша и обновляется
+    каждой записью, поэтому ограничение max_size действует и тогда, когда
+    в кеш пишут несколько процессов (в том числе копии кеша в процессах
+    исполнителей). Директория обходится только при переполнении
+    """
+
+    def __init__(self, directory: str, max_size: int = None):
+        """
+        :param directory: директория кеша, создаётся если её нет
+        :param max_size: наибольший размер кеша в байтах, None - без
+                         ограничения
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(lines: typing.Iterable[str], stylesheet: str,
+            converter: to_html.Converter) -> str:
+        """
+        :param lines: строки man страницы
+        :param stylesheet: css файл
+        :param converter: конвертер
+        :return: ключ html страницы в кеше
+        """
+        digest = hashlib.sha256()
+        digest.update(converter.fingerprint().encode('ascii'))
+        digest.update(b'\0')
+        digest.update(stylesheet.encode('utf-8'))
+        digest.update(b'\0')
+        for line in lines:
+            digest.update(line.encode('utf-8', 'surrogatepass'))
+
+        return digest.hexdigest()
+
+    def _file_name(self, key: str) -> str:
+        return path.join(self.directory, key[:2], key + entry_suffix)
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        """
+        :return: html из кеша или None
+        """
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, 'rb') as cached:
+                data = cached.read()
+        except FileNotFoundError:
+            return None
+
+        # файл мог удалить prune другого процесса
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(file_name)
+
+        return data
+
+    @contextlib.contextmanager
+    def _locked_size(self) -> typing.Iterator[typing.BinaryIO]:
+        """
+        Блокирует счётчик размера кеша для всех процессов и потоков
+
+        :return: открытый файл счётчика
+        """
+        with _size_lock, \
+                open(path.join(self.directory, size_file_name),
+                     'a+b') as size_file:
+            if fcntl is not None:
+                fcntl.flock(size_file, fcntl.LOCK_EX)
+            yield size_file
+
+    @staticmethod
+    def _read_size(size_file: typing.BinaryIO) -> typing.Optional[int]:
+        size_file.seek(0)
+        try:
+            return int(size_file.read())
+        except ValueError:
+            # счётчика ещё нет (или его запись прервалась)
+            return None
+
+    @staticmethod
+    def _write_size(size_file: typing.BinaryIO, size: int):
+        size_file.seek(0)
+        size_file.truncate()
+        size_file.write(str(size).encode('ascii'))
+
+    def put(self, key: str, data: bytes):
+        """
+        Атомарно сохраняет html в кеш; если кеш стал больше max_size, он
+        подрезается до prune_target от max_size
+        """
+        file_name = self._file_name(key)
+        os.makedirs(path.dirname(file_name), exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=path.dirname(file_name),
+                                         suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            with self._locked_size() as size_file:
+                size = self._read_size(size_file)
+                replaced = 0
+                with contextlib.suppress(FileNotFoundError):
+                    replaced = path.getsize(file_name)
+                os.replace(temp_name, file_name)
+
+                if size is None:
+                    size = sum(s for _, s, _ in self._entries())
+                else:
+                    size += len(data) - replaced
+                if self.max_size is not None and size > self.max_size:
+                    *_, size = self._prune(int(self.max_size * prune_target))
+                self._write_size(size_file, size)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_name)
+            raise
+
+    def render(self, lines: typing.Iterable[str], stylesheet: str,
+               converter: to_html.Converter,
+               stage: typing.Callable[[str], typing.ContextManager] =
+               contextlib.nullcontext,
+               metrics: Metrics = None,
+               fragments=None) -> typing.Iterator[bytes]:
+        """
+        Отдаёт html из кеша или конвертирует страницу, отдавая html по
+        частям, и сохраняет его в кеш, когда все части отданы
+
+        :param lines: строки man страницы
+        :param stylesheet: css файл
+        :param converter: конвертер
+        :param stage: фабрика контекстных менеджеров этапов конвертаций
+        :param metrics: метрики обращений к кешу
+        :param fragments: кеш html разделов для конвертаций
+        :return: части html в utf-8
+        """
+        lines = list(lines)
+        key = self.key(lines, stylesheet, converter)
+        data = self.get(key)
+        if metrics:
+            metrics.render_cache_requests.inc(
+                result='miss' if data is None else 'hit')
+        if data is not None:
+            yield data
+            return
+
+        chunks = []
+        for chunk in converter.convert(lines, stylesheet, stage, fragments):
+            data = chunk.encode('utf-8')
+            chunks.append(data)
+            yield data
+
+        self.put(key, b''.join(chunks))
+
+    def _entries(self) -> typing.List[typing.Tuple[float, int, str]]:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(entry_suffix):
+                    continue
+                file_name = path.join(root, name)
+                with contextlib.suppress(FileNotFoundError):
+                    stat = os.stat(file_name)
+                    entries.append((stat.st_mtime, stat.st_size, file_name))
+
+        return entries
+
+    def stats(self) -> CacheStats:
+        """
+        :return: количество и суммарный размер файлов кеша, время
+                 последнего чтения самого старого и самого нового из них
+        """
+        entries = self._entries()
+        times = [mtime for mtime, _, _ in entries]
+
+        return CacheStats(len(entries), sum(size for _, size, _ in entries),
+                          min(times, default=None), max(times, default=None))
+
+    def prune(self, max_size: int = None,
+              max_age: float = None) -> typing.Tuple[int, int]:
+        """
+        Удаляет давно не читавшиеся файлы, пока кеш больше max_size, и
+        файлы, которые не читались дольше max_age секунд
+
+        :param max_size: наибольший размер кеша в байтах, по умолчанию
+                         self.max_size
+        :param max_age: наибольший возраст файла в секундах
+        :return: количество и размер удалённых файлов
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        with self._locked_size() as size_file:
+            removed, removed_size, size = self._prune(max_size, max_age)
+            self._write_size(size_file, size)
+
+        return removed, removed_size
+
+    def _prune(self, max_size: typing.Optional[int],
+               max_age: float = None) -> typing.Tuple[int, int, int]:
+        """
+        prune под блокировкой счётчика
+
+        :return: количество и размер удалённых файлов и размер кеша после
+                 подрезки
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        deadline = time.time() - max_age if max_age is not None else None
+        removed = removed_size = 0
+
+        for mtime, size, file_name in entries:
+            too_big = max_size is not None and total > max_size
+            too_old = deadline is not None and mtime < deadline
+            if not too_big and not too_old:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_name)
+                removed += 1
+                removed_size += size
+            total -= size
+
+        return removed, removed_size, total
@@ -0,0 +1,156 @@
+import concurrent.futures
+import heapq
+import typing
+from collections import namedtuple
+from os import path
+
+Task = namedtuple('Task', ['page', 'size', 'memory'])
+
+policies = ('largest', 'fifo')
+
+# во сколько раз пик памяти конвертаций больше размера страницы; оценка
+# сверху по замерам tests/memory_budgets.json (gcc.1: 800 КБ -> 16 МиБ)
+memory_factor = 20
+
+
+def estimate_memory(size: int) -> int:
+    """
+    :param size: размер man страницы в байтах
+    :return: оценка пика памяти её конвертаций в байтах
+    """
+    return size * memory_factor
+
+
+def make_tasks(pages: typing.Iterable[str],
+               policy: str = 'largest') -> typing.List[Task]:
+    """
+    :param pages: пути к man страницам
+    :param policy: largest - от больших страниц к маленьким (самая долгая
+                   страница не окажется последней), fifo - в порядке pages
+    :return: задачи в порядке запуска
+    """
+    tasks = []
+    for page in pages:
+        size = path.getsize(page)
+        tasks.append(Task(page, size, estimate_memory(size)))
+
+    if policy == 'largest':
+        # сортировка устойчива: у равных по размеру порядок pages
+        tasks.sort(key=lambda t: -t.size)
+
+    return tasks
+
+
+class Scheduler:
+    """
+    Запускает задачи в пуле процессов (или другом Executor) не больше jobs
+    одновременно
+
+    Задачи запускаются в заданном порядке, но суммарная оценка памяти
+    выполняющихся задач не превышает memory_budget: если очередная задача
+    не помещается, запускается следующая по порядку, которая помещается.
+    Задача, которая больше всего бюджета, запускается одна
+    """
+
+    def __init__(self, jobs: int, memory_budget: int = None):
+        """
+        :param jobs: наибольшее число одновременных задач
+        :param memory_budget: бюджет памяти в байтах, None - без
+                              ограничения
+        """
+        self.jobs = jobs
+        self.memory_budget = memory_budget
+
+    def fits(self, task: Task, running_memory: int, running: int) -> bool:
+        if running >= self.jobs:
+            return False
+        if self.memory_budget is None or running == 0:
+            return True
+
+        return running_memory + task.memory <= self.memory_budget
+
+    def run(self, tasks: typing.Iterable[Task],
+            function: typing.Callable,
+            executor: concurrent.futures.Executor) -> \
+            typing.Iterator[typing.Tuple[Task, typing.Any]]:
+        """
+        Выполняет function(task.page) для всех задач
+
+        Если задача завершилась исключением, новые задачи не запускаются,
+        а исключение выбрасывается после завершения выполняющихся
+
+        :param tasks: задачи в порядке запуска
+        :param function: функция задачи
+        :param executor: пул, в котором выполняются задачи
+        :return: пары задача - результат в порядке завершения
+        """
+        pending = list(tasks)
+        running = {}
+        running_memory = 0
+        error = None
+
+        while pending or running:
+            while error is None:
+                task = next((t for t in pending
+                             if self.fits(t, running_memory, len(running))),
+                            None)
+                if task is None:
+                    break
+                pending.remove(task)
+                running[executor.submit(function, task.page)] = task
+                running_memory += task.memory
+
+            if not running:
+                break
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                running_memory -= task.memory
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    pending = []
+                    continue
+                yield task, future.result()
+
+        if error is not None:
+            raise error
+
+
+def simulate(tasks: typing.Iterable[Task], jobs: int,
+             memory_budget: int = None,
+             duration: typing.Callable[[Task], float] =
+             lambda task: task.size) -> float:
+    """
+    Моделирует выполнение задач планировщиком без их запуска
+
+    :param tasks: задачи в порядке запуска
+    :param jobs: наибольшее число одновременных задач
+    :param memory_budget: бюджет памяти в байтах
+    :param duration: длительность задачи, по умолчанию её размер
+    :return: время завершения последней задачи
+    """
+    scheduler = Scheduler(jobs, memory_budget)
+    pending = list(tasks)
+    running = []  # куча (время завершения, номер, задача)
+    running_memory = 0
+    now = 0.0
+    number = 0
+
+    while pending or running:
+        while True:
+            task = next((t for t in pending
+                         if scheduler.fits(t, running_memory, len(running))),
+                        None)
+            if task is None:
+                break
+            pending.remove(task)
+            heapq.heappush(running, (now + duration(task), number, task))
+            number += 1
+            running_memory += task.memory
+
+        now, _, task = heapq.heappop(running)
+        running_memory -= task.memory
+
+    return now
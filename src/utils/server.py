@@ -0,0 +1,347 @@
+import collections
+import contextlib
+import hashlib
+import os
+import threading
+import time
+import typing
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from urllib.parse import unquote, urlsplit
+
+from src.converters import to_html
+from src.utils import isolation
+from src.utils.archive import ArchiveReader
+from src.utils.includes import IncludeResolver
+from src.utils.metrics import Metrics
+from src.utils.render_cache import RenderCache
+from src.utils.single_flight import SingleFlight
+
+CachedPage = collections.namedtuple('CachedPage', ['body', 'etag'])
+
+metrics_content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+# сколько страниц, превысивших ограничения, помнит PageService
+failure_cache_size = 1024
+
+
+def render_page(page: str, stylesheet: str, converter: to_html.Converter,
+                metrics: Metrics = None,
+                include_resolver: IncludeResolver = None,
+                render_cache: RenderCache = None) -> bytes:
+    """
+    :param page: путь к man странице
+    :param stylesheet: css файл
+    :param converter: конвертер
+    :param metrics: метрики, в которые записываются длительности этапов
+    :param include_resolver: кеш подключаемых .so файлов
+    :param render_cache: кеш html на диске, None - без него
+    :return: html страницы в utf-8
+    """
+    if include_resolver is None:
+        include_resolver = IncludeResolver()
+    stage = metrics.stage if metrics else contextlib.nullcontext
+
+    with open(page, encoding='utf-8', errors='replace') as man_page:
+        lines = include_resolver.expand(man_page, page)
+        if render_cache is not None:
+            return b''.join(render_cache.render(lines, stylesheet, converter,
+                                                stage, metrics))
+        return ''.join(converter.convert(lines, stylesheet,
+                                         stage)).encode('utf-8')
+
+
+class PageCache:
+    """
+    LRU кеш сконвертированных страниц в памяти, ограниченный суммарным
+    размером страниц в байтах
+    """
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key: typing.Hashable) -> typing.Optional[CachedPage]:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key: typing.Hashable, page: CachedPage):
+        if len(page.body) > self.max_size:
+            return
+
+        with self._lock:
+            old_page = self._pages.pop(key, None)
+            if old_page is not None:
+                self.size -= len(old_page.body)
+            self._pages[key] = page
+            self.size += len(page.body)
+            while self.size > self.max_size:
+                _, evicted = self._pages.popitem(last=False)
+                self.size -= len(evicted.body)
+
+
+class PageService:
+    """
+    Конвертирует man страницы директорий по запросу, кешируя результат и
+    записывая метрики
+    """
+
+    def __init__(self, input_dir: str, stylesheet: str,
+                 converter: to_html.Converter = to_html.default_converter,
+                 metrics: Metrics = None,
+                 cache: PageCache = None,
+                 render_cache: RenderCache = None,
+                 limits: isolation.Limits = None,
+                 coalesce: bool = True):
+        """
+        :param input_dir: директория с man страницами
+        :param stylesheet: css файл, раздаётся по пути из ссылки страниц
+        :param converter: конвертер
+        :param metrics: метрики, по умолчанию новые
+        :param cache: кеш страниц, по умолчанию новый
+        :param render_cache: кеш html на диске (общий с конвертацией
+                             директорий), None - без него
+        :param limits: ограничения конвертаций одной страницы, с ними
+                       страница конвертируется в процессе пула (см.
+                       isolation.IsolatedPool; одновременно работает не
+                       больше процессов, чем процессоров, остальные
+                       запросы ждут), None - в потоке запроса
+        :param coalesce: объединять одновременные конвертаций одной
+                         страницы (см. SingleFlight): страницу конвертирует
+                         один запрос, остальные ждут его html
+        """
+        self.input_dir = path.abspath(input_dir)
+        self.stylesheet = stylesheet
+        self.stylesheet_url = '/' + stylesheet.replace('\\', '/').lstrip('/')
+        self.converter = converter
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.cache = cache if cache is not None else PageCache()
+        self.render_cache = render_cache
+        self.pool = isolation.IsolatedPool(limits) if limits else None
+        self.include_resolver = IncludeResolver()
+        self.flights = SingleFlight(self.metrics) if coalesce else None
+        # страницы, превысившие ограничения, по тому же ключу, что и в
+        # cache: повторные запросы сразу получают ошибку, пока страница
+        # не изменится
+        self.failures = collections.OrderedDict()
+        self._failures_lock = threading.Lock()
+
+    def find_page(self, url_path: str) -> typing.Optional[str]:
+        """
+        :param url_path: путь запроса, например /man1/bash.1.html
+        :return: путь к man странице или None, если такой нет (в том числе
+                 если путь выходит за пределы input_dir)
+        """
+        if not url_path.endswith('.html'):
+            return None
+
+        relative_name = unquote(url_path[:-len('.html')]).lstrip('/')
+        page = path.normpath(path.join(self.input_dir, relative_name))
+        if path.commonpath([page, self.input_dir]) != self.input_dir:
+            return None
+
+        return page if path.isfile(page) else None
+
+    def get_page(self, page: str) -> CachedPage:
+        """
+        Возвращает html страницы из кеша или конвертирует её. Страница
+        конвертируется заново, если файл изменился. Запросы страницы,
+        пришедшие во время её конвертаций, ждут её результат
+
+        :param page: путь к man странице
+        :return: html и его ETag
+        :raise isolation.PageLimitError: если страница превысила
+                                         ограничения
+        """
+        stat = os.stat(page)
+        key = (page, stat.st_mtime_ns, stat.st_size)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.metrics.cache_requests.inc(result='hit')
+            return cached
+        with self._failures_lock:
+            failure = self.failures.get(key)
+        if failure is not None:
+            self.metrics.page_failures.inc()
+            raise isolation.PageLimitError(*failure.args)
+        self.metrics.cache_requests.inc(result='miss')
+
+        try:
+            if self.flights is None:
+                return self._convert(page, key, stat.st_size)
+            cached, _ = self.flights.do(key, self._convert, page, key,
+                                        stat.st_size)
+        except Exception:
+            self.metrics.page_failures.inc()
+            raise
+
+        return cached
+
+    def _convert(self, page: str, key: typing.Tuple, size: int) -> \
+            CachedPage:
+        """
+        Конвертирует страницу для get_page и сохраняет её в кеш (или
+        ошибку превышения ограничений - в failures)
+        """
+        start = time.perf_counter()
+        try:
+            if self.pool is not None:
+                body = self.pool.run(
+                    render_page, page, self.metrics,
+                    stylesheet=self.stylesheet, converter=self.converter,
+                    render_cache=self.render_cache)
+            else:
+                body = render_page(page, self.stylesheet, self.converter,
+                                   self.metrics, self.include_resolver,
+                                   self.render_cache)
+        except isolation.PageLimitError as error:
+            with self._failures_lock:
+                self.failures[key] = error
+                while len(self.failures) > failure_cache_size:
+                    self.failures.popitem(last=False)
+            raise
+
+        self.metrics.page_seconds.observe(time.perf_counter() - start)
+        self.metrics.pages_converted.inc()
+        self.metrics.input_bytes.inc(size)
+
+        cached = CachedPage(body, f'"{hashlib.sha256(body).hexdigest()}"')
+        self.cache.put(key, cached)
+
+        return cached
+
+
+class ArchivePageService:
+    """
+    Отдаёт уже сконвертированные страницы из zip архива (см.
+    archive.convert_directory), не распаковывая его
+    """
+
+    def __init__(self, archive_file: str, stylesheet: str,
+                 metrics: Metrics = None,
+                 cache: PageCache = None):
+        """
+        :param archive_file: путь к архиву
+        :param stylesheet: css файл, раздаётся по пути из ссылки страниц
+        :param metrics: метрики, по умолчанию новые
+        :param cache: кеш прочитанных страниц, по умолчанию новый
+        """
+        self.archive = ArchiveReader(archive_file)
+        self.stylesheet = stylesheet
+        self.stylesheet_url = '/' + stylesheet.replace('\\', '/').lstrip('/')
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.cache = cache if cache is not None else PageCache()
+
+    def find_page(self, url_path: str) -> typing.Optional[str]:
+        """
+        :param url_path: путь запроса, например /man1/bash.1.html
+        :return: имя страницы в архиве или None, если такой нет
+        """
+        name = unquote(url_path).lstrip('/')
+
+        return name if name in self.archive.names else None
+
+    def get_page(self, name: str) -> CachedPage:
+        """
+        :param name: имя страницы в архиве
+        :return: html и его ETag (из манифеста архива)
+        """
+        cached = self.cache.get(name)
+        if cached is not None:
+            self.metrics.cache_requests.inc(result='hit')
+            return cached
+        self.metrics.cache_requests.inc(result='miss')
+
+        body = self.archive.read(name)
+        etag = self.archive.get_etag(name)
+        if etag is None:
+            etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        cached = CachedPage(body, etag)
+        self.cache.put(name, cached)
+
+        return cached
+
+
+class PageRequestHandler(BaseHTTPRequestHandler):
+    """
+    Отдаёт страницы (/<путь к man странице>.html), стили и метрики
+    (/metrics)
+    """
+
+    def do_GET(self):
+        service = self.server.service
+        url_path = urlsplit(self.path).path
+
+        if url_path == '/metrics':
+            self._send(HTTPStatus.OK, metrics_content_type,
+                       service.metrics.render().encode('utf-8'))
+            return
+
+        if url_path == service.stylesheet_url and \
+                path.isfile(service.stylesheet):
+            with open(service.stylesheet, 'rb') as stylesheet:
+                self._send(HTTPStatus.OK, 'text/css; charset=utf-8',
+                           stylesheet.read())
+            return
+
+        page = service.find_page(url_path)
+        if page is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        try:
+            cached = service.get_page(page)
+        except isolation.PageLimitError as error:
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR,
+                            explain=str(error))
+            return
+        except Exception:
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+
+        if self.headers.get('If-None-Match') == cached.etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', cached.etag)
+            self.end_headers()
+            return
+
+        service.metrics.output_bytes.inc(len(cached.body))
+        self._send(HTTPStatus.OK, 'text/html; charset=utf-8', cached.body,
+                   cached.etag)
+
+    def _send(self, status, content_type, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(service: typing.Union[PageService, ArchivePageService],
+                  host: str = '127.0.0.1',
+                  port: int = 8000) -> ThreadingHTTPServer:
+    """
+    :param service: страницы, которые раздаёт сервер
+    :param host: адрес
+    :param port: порт, 0 - любой свободный
+    :return: сервер, запускается вызовом serve_forever()
+    """
+    server = ThreadingHTTPServer((host, port), PageRequestHandler)
+    server.service = service
+
+    return server
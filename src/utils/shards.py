@@ -0,0 +1,182 @@
+import contextlib
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import typing
+from os import path
+
+from src.utils import batch, file_manager
+from src.utils.includes import IncludeResolver
+
+
+def parse_shard(value: str) -> typing.Tuple[int, int]:
+    """
+    :param value: номер шарда и количество шардов вида i/N, 1 <= i <= N
+    :return: пара (i, N)
+    :raises ValueError: если значение имеет другой вид
+    """
+    index, separator, count = value.partition('/')
+    if not separator or not index.isdigit() or not count.isdigit():
+        raise ValueError(f'shard must look like i/N, got {value!r}')
+
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f'shard number must be in 1..{count}, got {index}')
+
+    return index, count
+
+
+def stable_hash(name: str) -> str:
+    """
+    :return: хеш имени, одинаковый на всех машинах и во всех запусках
+             (в отличие от hash())
+    """
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+
+def common_root(paths: typing.Iterable[str]) -> str:
+    """
+    :param paths: man страницы и директорий с ними
+    :return: общая директория путей (абсолютная), относительно которой
+             assign_shards считает порядок страниц одинаково, из какой бы
+             директорий ни был запущен узел
+    """
+    return path.commonpath([p if path.isdir(p) else path.dirname(p)
+                            for p in map(path.abspath, paths)])
+
+
+def assign_shards(pages: typing.Iterable[str], count: int,
+                  input_dir: str,
+                  include_resolver: IncludeResolver = None) -> \
+        typing.List[typing.List[str]]:
+    """
+    Распределяет man страницы по count шардам
+
+    Псевдонимы (см. batch.find_aliases) попадают в шард своей основной
+    страницы, поэтому каждый шард может записать их ссылками. Группы
+    распределяются жадно, от самой большой к самой маленькой, в шард с
+    наименьшим суммарным размером исходников; при равных размерах порядок
+    задаёт стабильный хеш пути относительно input_dir. Поэтому разбиение
+    зависит только от содержимого директорий, а не от машины или порядка
+    обхода
+
+    :param pages: пути к man страницам
+    :param count: количество шардов
+    :param input_dir: директория с man страницами
+    :param include_resolver: кеш подключаемых .so файлов
+    :return: списки страниц шардов (в порядке find_man_pages)
+    """
+    pages = list(pages)
+    if include_resolver is None:
+        include_resolver = IncludeResolver()
+
+    alias_of = batch.find_aliases(pages, include_resolver)
+    groups = {}
+    for page in pages:
+        groups.setdefault(alias_of.get(page, page), []).append(page)
+
+    def order(primary):
+        size = path.getsize(include_resolver.get_source(primary))
+        name = path.relpath(primary, input_dir).replace(os.sep, '/')
+        return -size, stable_hash(name)
+
+    loads = [0] * count
+    shard_of = {}
+    for primary in sorted(groups, key=order):
+        shard = min(range(count), key=lambda s: (loads[s], s))
+        loads[shard] += -order(primary)[0]
+        for page in groups[primary]:
+            shard_of[page] = shard
+
+    shards = [[] for _ in range(count)]
+    for page in pages:
+        shards[shard_of[page]].append(page)
+
+    return shards
+
+
+def merge_outputs(shard_dirs: typing.Iterable[str], output_dir: str,
+                  manifest_name: str = 'manifest.json') -> typing.Dict:
+    """
+    Собирает выходные директорий шардов в одну: файлы переносятся
+    жёсткими ссылками (или копируются), манифесты объединяются (вместе
+    со страницами, которые шарды не смогли сконвертировать)
+
+    :param shard_dirs: выходные директорий шардов
+    :param output_dir: общая выходная директория
+    :param manifest_name: имя манифеста в директориях
+    :return: записи общего манифеста
+    :raises ValueError: если в разных шардах есть разные файлы с одним
+                        именем или незавершённая конвертация (журнал)
+    """
+    entries = {}
+    failures = {}
+    for shard_dir in shard_dirs:
+        if path.exists(path.join(shard_dir, '.poncho-journal.jsonl')):
+            raise ValueError(f'{shard_dir}: conversion is not finished')
+
+        with open(path.join(shard_dir, manifest_name),
+                  encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+
+        for name, entry in manifest['pages'].items():
+            if name in entries and entries[name]['etag'] != entry['etag']:
+                raise ValueError(f'{name}: different pages in shards')
+            entries[name] = entry
+            for file_name in entry['files']:
+                _merge_file(path.join(shard_dir, file_name),
+                            path.join(output_dir, file_name))
+        failures.update(manifest.get('failures', {}))
+
+    os.makedirs(output_dir, exist_ok=True)
+    file_manager.update_manifest(path.join(output_dir, manifest_name),
+                                 entries, failures)
+
+    return entries
+
+
+def _merge_file(source: str, destination: str):
+    if path.exists(destination):
+        if not filecmp.cmp(source, destination, shallow=False):
+            raise ValueError(f'{destination}: different files in shards')
+        return
+
+    os.makedirs(path.dirname(destination), exist_ok=True)
+    temp_name = destination + file_manager.partial_suffix
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temp_name)
+    try:
+        os.link(source, temp_name)
+    except OSError:
+        shutil.copyfile(source, temp_name)
+    os.replace(temp_name, destination)
+
+
+def merge_whatis(index_files: typing.Iterable[str],
+                 output_file: str) -> int:
+    """
+    Объединяет индексы whatis шардов, упорядочивая записи по разделу и
+    именам, чтобы результат не зависел от разбиения
+
+    :param index_files: индексы шардов
+    :param output_file: общий индекс
+    :return: количество записей
+    """
+    lines = []
+    for index_file in index_files:
+        with open(index_file, encoding='utf-8') as index:
+            lines.extend(line.rstrip('\n') for line in index if line.strip())
+
+    def order(line):
+        entry = json.loads(line)
+        return entry['section'], entry['names'], line
+
+    lines.sort(key=order)
+    with open(output_file, 'w', encoding='utf-8') as index:
+        for line in lines:
+            index.write(line)
+            index.write('\n')
+
+    return len(lines)
@@ -0,0 +1,77 @@
+import threading
+import typing
+
+from src.utils.metrics import Metrics
+
+
+class _Call:
+    """
+    Вычисление, которого ждут запросы с тем же ключом
+    """
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вычисления с одинаковым ключом: первый запрос
+    (ведущий) вычисляет результат, а запросы, пришедшие до его окончания,
+    ждут и получают тот же результат (или то же исключение)
+
+    Результат не кешируется: запрос, пришедший после окончания вычисления,
+    запускает новое. Можно использовать из нескольких потоков
+    """
+
+    def __init__(self, metrics: Metrics = None):
+        """
+        :param metrics: метрики, в которые записываются запросы по роли
+                        (coalesced_requests: leader - вычислил результат,
+                        follower - дождался чужого)
+        """
+        self.metrics = metrics
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key: typing.Hashable, function: typing.Callable,
+           *args, **kwargs) -> typing.Tuple[typing.Any, bool]:
+        """
+        :param key: ключ вычисления
+        :param function: вычисление, function(*args, **kwargs)
+        :return: результат и True, если он получен от вычисления другого
+                 запроса
+        :raise: исключение вычисления
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if self.metrics:
+            self.metrics.coalesced_requests.inc(
+                role='leader' if leader else 'follower')
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
@@ -0,0 +1,134 @@
+import os
+import pytest
+import sys
+import zipfile
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import archive, server
+from src.utils.archive import ArchiveReader
+from src.utils.metrics import Metrics
+
+man_page = '\n'.join([
+    '.SH NAME',
+    r'test \- check things',
+    '.SH DESCRIPTION',
+    'Checks things',
+])
+
+
+class FailingConverter(to_html.Converter):
+    """
+    Конвертер, который падает на страницах со строкой FAIL
+    """
+
+    def __reduce__(self):
+        return FailingConverter, super().__reduce__()[1]
+
+    def convert(self, lines, stylesheet, stage=None, fragments=None):
+        lines = list(lines)
+        if any('FAIL' in line for line in lines):
+            raise ValueError('FAIL')
+        return super().convert(lines, stylesheet, stage, fragments)
+
+
+@pytest.fixture
+def man_dir(tmp_path):
+    man_dir = tmp_path / 'man'
+    (man_dir / 'man1').mkdir(parents=True)
+    (man_dir / 'man1' / 'test.1').write_text(man_page)
+    (man_dir / 'man1' / 'alias.1').write_text('.so man1/test.1\n')
+    (man_dir / 'other.2').write_text(man_page + '\nother')
+
+    return man_dir
+
+
+class TestConvertDirectory:
+    """
+    Конвертация директорий в zip архив
+    """
+
+    @pytest.mark.parametrize('stored, compression', [
+        (False, zipfile.ZIP_DEFLATED),
+        (True, zipfile.ZIP_STORED),
+    ])
+    def test_pages_match_convert(self, tmp_path, man_dir, stored,
+                                 compression):
+        """
+        Страницы в архиве совпадают с результатом to_html.convert
+        """
+        archive_file = str(tmp_path / 'html.zip')
+        metrics = Metrics()
+
+        entries = archive.convert_directory(str(man_dir), archive_file,
+                                            'main.css', stored,
+                                            metrics=metrics)
+
+        with zipfile.ZipFile(archive_file) as zip_file:
+            names = zip_file.namelist()
+            content = zip_file.read('man1/test.1.html').decode('utf-8')
+            infos = [zip_file.getinfo(n) for n in names]
+        assert names == ['other.2.html', 'man1/test.1.html',
+                         'man1/alias.1.html', 'manifest.json']
+        assert content == ''.join(to_html.convert(man_page.splitlines(True),
+                                                  'main.css'))
+        assert {info.compress_type for info in infos} == {compression}
+        assert entries['man1/alias.1.html']['alias_of'] == 'man1/test.1.html'
+        assert metrics.pages_converted.get() == 2
+        assert sorted(os.listdir(str(tmp_path))) == ['html.zip', 'man']
+
+    def test_archive_is_reproducible(self, tmp_path, man_dir):
+        first = tmp_path / 'first.zip'
+        second = tmp_path / 'second.zip'
+
+        archive.convert_directory(str(man_dir), str(first), 'main.css')
+        archive.convert_directory(str(man_dir), str(second), 'main.css')
+
+        assert first.read_bytes() == second.read_bytes()
+
+    def test_failed_conversion_leaves_no_archive(self, tmp_path, man_dir):
+        (man_dir / 'broken.3').write_text('.SH NAME\nFAIL\n')
+
+        with pytest.raises(ValueError):
+            archive.convert_directory(str(man_dir),
+                                      str(tmp_path / 'html.zip'), 'main.css',
+                                      converter=FailingConverter())
+
+        assert sorted(os.listdir(str(tmp_path))) == ['man']
+
+
+class TestArchiveReader:
+    """
+    Чтение страниц из архива
+    """
+
+    def test_read_page_and_etag(self, tmp_path, man_dir):
+        archive_file = str(tmp_path / 'html.zip')
+        entries = archive.convert_directory(str(man_dir), archive_file,
+                                            'main.css')
+
+        with ArchiveReader(archive_file) as reader:
+            assert 'manifest.json' not in reader.names
+            assert len(reader.read('other.2.html')) == entries[
+                'other.2.html']['size']
+            assert reader.get_etag('other.2.html') == entries[
+                'other.2.html']['etag']
+
+    def test_archive_page_service(self, tmp_path, man_dir):
+        """
+        Сервер находит страницы архива по пути запроса и кеширует их
+        """
+        archive_file = str(tmp_path / 'html.zip')
+        archive.convert_directory(str(man_dir), archive_file, 'main.css')
+        service = server.ArchivePageService(archive_file, 'main.css')
+
+        name = service.find_page('/man1/test.1.html')
+        first = service.get_page(name)
+        second = service.get_page(name)
+
+        assert service.find_page('/man1/missing.1.html') is None
+        assert service.find_page('/manifest.json') is None
+        assert first is second
+        assert b'Checks things' in first.body
+        assert service.metrics.cache_requests.get(result='hit') == 1
@@ -34,3 +34,159 @@ def test_if_output_file_specified_parse_it():
     args = arg_parser.parse_arguments(argv)
 
     assert args.output_file == 'groff_html'
+
+
+def test_usual_conversion_command_is_convert():
+    argv = ['bash.1']
+
+    args = arg_parser.parse_arguments(argv)
+
+    assert args.command == 'convert'
+
+
+def test_parse_whatis_command():
+    argv = ['whatis', 'man', '/usr/share/man', '-o', 'index.jsonl']
+
+    args = arg_parser.parse_arguments(argv)
+
+    assert args.command == 'whatis'
+    assert args.input_files == ['man', '/usr/share/man']
+    assert args.output_file == 'index.jsonl'
+
+
+def test_parse_options_command():
+    args = arg_parser.parse_arguments(['options', 'man', '-o', 'opts.jsonl'])
+
+    assert args.command == 'options'
+    assert args.input_files == ['man']
+    assert args.output_file == 'opts.jsonl'
+
+
+def test_no_html_requires_compression():
+    with pytest.raises(SystemExit):
+        arg_parser.parse_arguments(['bash.1', '--no-html'])
+
+
+def test_parse_compression_formats():
+    argv = ['bash.1', '--compress', 'gzip', '--no-html']
+
+    args = arg_parser.parse_arguments(argv)
+
+    assert args.compress == ['gzip']
+    assert not args.html
+
+
+def test_parse_metrics_file():
+    argv = ['man', '-o', 'html', '--metrics-file', 'poncho.prom']
+
+    args = arg_parser.parse_arguments(argv)
+
+    assert args.metrics_file == 'poncho.prom'
+
+
+def test_parse_serve_command():
+    argv = ['serve', 'man', '--port', '0']
+
+    args = arg_parser.parse_arguments(argv)
+
+    assert args.command == 'serve'
+    assert args.input_dir == 'man'
+    assert args.port == 0
+    assert args.host == '127.0.0.1'
+
+
+def test_parse_resume():
+    args = arg_parser.parse_arguments(['man', '-o', 'html', '--resume'])
+
+    assert args.resume
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['man'], 'link'),
+    (['man', '--aliases', 'redirect'], 'redirect'),
+])
+def test_parse_aliases(argv, expected):
+    assert arg_parser.parse_arguments(argv).aliases == expected
+
+
+def test_zip_output_does_not_support_compression():
+    with pytest.raises(SystemExit):
+        arg_parser.parse_arguments(['man', '-o', 'html.zip',
+                                    '--compress', 'gzip'])
+
+
+def test_db_does_not_support_toc():
+    with pytest.raises(SystemExit):
+        arg_parser.parse_arguments(['man', '--db', 'pages.db', '--toc'])
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['-'], '-'),
+    (['-', '-o', 'page.html'], 'page.html'),
+    (['bash.1', '-o', '-'], '-'),
+], ids=['stdin_to_stdout', 'stdin_to_file', 'file_to_stdout'])
+def test_pipe_mode(argv, expected):
+    args = arg_parser.parse_arguments(argv)
+
+    assert args.output_file == expected
+
+
+def test_stdout_does_not_support_compression():
+    with pytest.raises(SystemExit):
+        arg_parser.parse_arguments(['-', '--compress', 'gzip'])
+
+
+def test_parse_jobs_and_schedule():
+    argv = ['man', '-o', 'html', '-j', '4', '--memory-budget', '256',
+            '--schedule', 'fifo']
+
+    args = arg_parser.parse_arguments(argv)
+
+    assert (args.jobs, args.memory_budget, args.schedule) == (4, 256, 'fifo')
+
+
+def test_render_cache_defaults_to_environment(monkeypatch):
+    monkeypatch.setenv('PONCHO_RENDER_CACHE', 'cache')
+
+    args = arg_parser.parse_arguments(['serve', 'man'])
+
+    assert (args.render_cache, args.render_cache_size) == ('cache', None)
+
+
+@pytest.mark.parametrize('argv, action', [
+    (['cache', 'stats', 'cache'], 'stats'),
+    (['cache', 'prune', 'cache', '--max-size', '100'], 'prune'),
+])
+def test_parse_cache_command(argv, action):
+    args = arg_parser.parse_arguments(argv)
+
+    assert (args.command, args.action, args.directory) == \
+        ('cache', action, 'cache')
+
+
+@pytest.mark.parametrize('argv', [
+    ['man', '-o', 'html', '--page-timeout', '2.5', '--page-memory', '512'],
+    ['serve', 'man', '--page-timeout', '2.5', '--page-memory', '512'],
+], ids=['convert', 'serve'])
+def test_parse_page_limits(argv):
+    args = arg_parser.parse_arguments(argv)
+
+    assert (args.page_timeout, args.page_cpu, args.page_memory) == \
+        (2.5, None, 512)
+
+
+@pytest.mark.parametrize('argv', [
+    ['-', '--page-cpu', '1'],
+    ['man', '-o', 'html.zip', '--page-timeout', '1'],
+], ids=['stdin', 'zip'])
+def test_page_limits_need_files(argv):
+    with pytest.raises(SystemExit):
+        arg_parser.parse_arguments(argv)
+
+
+def test_pipeline_does_not_support_limits():
+    assert arg_parser.parse_arguments(['man', '-o', 'html',
+                                       '--pipeline']).pipeline
+    with pytest.raises(SystemExit):
+        arg_parser.parse_arguments(['man', '-o', 'html', '--pipeline',
+                                    '--page-timeout', '1'])
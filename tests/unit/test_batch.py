@@ -0,0 +1,374 @@
+import gzip
+import hashlib
+import json
+import os
+import io
+import pytest
+import subprocess
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import batch, file_manager
+from src.utils.metrics import Metrics
+
+man_page = '\n'.join([
+    '.SH NAME',
+    r'test \- check things',
+    '.SH DESCRIPTION',
+    r'Checks \(bu things',
+])
+
+
+class FailingConverter(to_html.Converter):
+    """
+    Конвертер, который падает на страницах со строкой FAIL
+    """
+
+    def __reduce__(self):
+        return FailingConverter, super().__reduce__()[1]
+
+    def convert(self, lines, stylesheet, stage=None, fragments=None):
+        lines = list(lines)
+        if any('FAIL' in line for line in lines):
+            raise ValueError('FAIL')
+        return super().convert(lines, stylesheet, stage, fragments)
+
+
+class TestOutputWriter:
+    """
+    Запись html вместе со сжатыми копиями
+    """
+    chunks = ['<html>', '<p>•</p>', '</html>']
+    content = ''.join(chunks).encode('utf-8')
+
+    def write(self, file_name, **kwargs):
+        with file_manager.OutputWriter(file_name, **kwargs) as writer:
+            for chunk in self.chunks:
+                writer.write(chunk)
+
+        return writer
+
+    def test_compressed_copy_matches_html(self, tmp_path):
+        """
+        Сжатая копия содержит тот же html, что и обычный файл
+        """
+        file_name = str(tmp_path / 'page.html')
+
+        writer = self.write(file_name, compress=['gzip'])
+
+        assert writer.files == [file_name, f'{file_name}.gz']
+        with open(file_name, 'rb') as html_file:
+            assert html_file.read() == self.content
+        with gzip.open(f'{file_name}.gz') as gzip_file:
+            assert gzip_file.read() == self.content
+
+    def test_compressed_copy_is_reproducible(self, tmp_path):
+        """
+        Одинаковый html даёт байт в байт одинаковую сжатую копию
+        """
+        first = str(tmp_path / 'first.html')
+        second = str(tmp_path / 'second.html')
+
+        self.write(first, compress=['gzip'])
+        self.write(second, compress=['gzip'])
+
+        with open(f'{first}.gz', 'rb') as f, open(f'{second}.gz', 'rb') as s:
+            assert f.read() == s.read()
+
+    def test_only_compressed(self, tmp_path):
+        """
+        С html=False пишутся только сжатые копий
+        """
+        file_name = str(tmp_path / 'page.html')
+
+        self.write(file_name, html=False, compress=['gzip'])
+
+        assert sorted(os.listdir(str(tmp_path))) == ['page.html.gz']
+
+    def test_etag(self, tmp_path):
+        """
+        ETag - sha256 несжатого содержимого в кавычках
+        """
+        writer = self.write(str(tmp_path / 'page.html'), compress=['gzip'])
+
+        assert writer.etag == f'"{hashlib.sha256(self.content).hexdigest()}"'
+        assert writer.size == len(self.content)
+
+    def test_failed_write_leaves_no_files(self, tmp_path):
+        """
+        Если запись прервалась исключением, ни готовых, ни временных
+        файлов не остаётся, а прежний html не изменяется
+        """
+        file_name = tmp_path / 'page.html'
+        file_name.write_bytes(b'old')
+
+        with pytest.raises(RuntimeError):
+            with file_manager.OutputWriter(str(file_name),
+                                           compress=['gzip']) as writer:
+                writer.write('<html>')
+                raise RuntimeError
+
+        assert os.listdir(str(tmp_path)) == ['page.html']
+        assert file_name.read_bytes() == b'old'
+
+
+class TestConvertDirectory:
+    """
+    Конвертация директорий с man страницами
+    """
+    @pytest.fixture
+    def man_dir(self, tmp_path):
+        man_dir = tmp_path / 'man'
+        (man_dir / 'man1').mkdir(parents=True)
+        (man_dir / 'man1' / 'test.1').write_text(man_page)
+        (man_dir / 'other.2').write_text(man_page)
+
+        return man_dir
+
+    def test_convert_directory(self, tmp_path, man_dir):
+        """
+        batch.convert_directory сохраняет структуру директорий и пишет
+        манифест с ETag каждой страницы
+        """
+        output_dir = tmp_path / 'html'
+
+        batch.convert_directory(str(man_dir), str(output_dir), 'main.css',
+                                compress=['gzip'])
+
+        with open(str(output_dir / 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        entry = manifest['pages'][os.path.join('man1', 'test.1.html')]
+        with open(str(output_dir / 'man1' / 'test.1.html'), 'rb') as html:
+            content = html.read()
+
+        assert sorted(manifest['pages']) == [
+            os.path.join('man1', 'test.1.html'), 'other.2.html']
+        assert entry['files'] == [os.path.join('man1', 'test.1.html'),
+                                  os.path.join('man1', 'test.1.html.gz')]
+        assert entry['etag'] == f'"{hashlib.sha256(content).hexdigest()}"'
+        assert entry['size'] == len(content)
+
+
+class TestResume:
+    """
+    Продолжение прерванной конвертаций директорий по журналу
+    """
+    @pytest.fixture
+    def man_dir(self, tmp_path):
+        man_dir = tmp_path / 'man'
+        man_dir.mkdir()
+        (man_dir / 'first.1').write_text(man_page)
+        # FailingConverter прерывает конвертацию на второй странице
+        (man_dir / 'second.1').write_text('.SH NAME\nFAIL\n')
+
+        return man_dir
+
+    def test_resume_skips_finished_pages(self, tmp_path, man_dir):
+        output_dir = tmp_path / 'html'
+        with pytest.raises(ValueError):
+            batch.convert_directory(str(man_dir), str(output_dir), 'main.css',
+                                    converter=FailingConverter())
+        assert sorted(os.listdir(str(output_dir))) == [
+            '.poncho-journal.jsonl', 'first.1.html']
+
+        (man_dir / 'second.1').write_text(man_page + '\nsecond')
+        metrics = Metrics()
+        entries = batch.convert_directory(str(man_dir), str(output_dir),
+                                          'main.css', metrics=metrics,
+                                          resume=True)
+
+        assert sorted(entries) == ['first.1.html', 'second.1.html']
+        assert metrics.cache_requests.get(result='hit') == 1
+        assert metrics.pages_converted.get() == 1
+        assert sorted(os.listdir(str(output_dir))) == [
+            'first.1.html', 'manifest.json', 'second.1.html']
+
+    def test_changed_page_is_converted_again(self, tmp_path, man_dir):
+        output_dir = tmp_path / 'html'
+        with pytest.raises(ValueError):
+            batch.convert_directory(str(man_dir), str(output_dir), 'main.css',
+                                    converter=FailingConverter())
+
+        (man_dir / 'first.1').write_text(man_page + '\nchanged')
+        (man_dir / 'second.1').write_text(man_page)
+        metrics = Metrics()
+        batch.convert_directory(str(man_dir), str(output_dir), 'main.css',
+                                metrics=metrics, resume=True)
+
+        assert metrics.pages_converted.get() == 2
+
+    def test_torn_journal_line_is_dropped(self, tmp_path):
+        """
+        Недописанная при падении последняя строка журнала отбрасывается
+        """
+        page = tmp_path / 'first.1'
+        page.write_text(man_page)
+        journal_file = str(tmp_path / 'journal.jsonl')
+        with batch.Journal(journal_file) as journal:
+            journal.add('first.1.html', str(page), {'files': []})
+        with open(journal_file, 'a') as journal:
+            journal.write('{"name": "sec')
+
+        with batch.Journal(journal_file, resume=True) as journal:
+            journal.add('second.1.html', str(page), {'files': []})
+
+        with batch.Journal(journal_file, resume=True) as journal:
+            assert sorted(journal.records) == ['first.1.html',
+                                               'second.1.html']
+            assert journal.get_entry('first.1.html', str(page)) == {
+                'files': []}
+
+
+class TestAliases:
+    """
+    Страницы-псевдонимы конвертируются один раз
+    """
+    @pytest.fixture
+    def man_dir(self, tmp_path):
+        man_dir = tmp_path / 'man'
+        (man_dir / 'man1').mkdir(parents=True)
+        (man_dir / 'man1' / 'real.1').write_text(man_page)
+        (man_dir / 'man1' / 'copy.1').write_text(man_page)
+        (man_dir / 'man1' / 'so.1').write_text('.so man1/real.1\n')
+        (man_dir / 'man1' / 'link.1').symlink_to(man_dir / 'man1' / 'real.1')
+
+        return man_dir
+
+    def test_aliases_are_hard_links(self, tmp_path, man_dir):
+        output_dir = tmp_path / 'html'
+        metrics = Metrics()
+
+        entries = batch.convert_directory(str(man_dir), str(output_dir),
+                                          'main.css', compress=['gzip'],
+                                          metrics=metrics)
+
+        real = output_dir / 'man1' / 'real.1.html'
+        for name in ('copy.1', 'so.1', 'link.1'):
+            entry = entries[os.path.join('man1', f'{name}.html')]
+            assert entry['alias_of'] == os.path.join('man1', 'real.1.html')
+            assert entry['etag'] == entries[
+                os.path.join('man1', 'real.1.html')]['etag']
+            assert os.path.samefile(
+                str(output_dir / 'man1' / f'{name}.html'), str(real))
+            assert os.path.samefile(
+                str(output_dir / 'man1' / f'{name}.html.gz'), f'{real}.gz')
+        assert metrics.pages_converted.get() == 1
+        assert metrics.alias_pages.get() == 3
+        assert metrics.saved_input_bytes.get() == 3 * len(man_page)
+
+    def test_aliases_are_redirects(self, tmp_path, man_dir):
+        output_dir = tmp_path / 'html'
+
+        entries = batch.convert_directory(str(man_dir), str(output_dir),
+                                          'main.css', aliases='redirect')
+
+        content = (output_dir / 'man1' / 'so.1.html').read_text()
+        assert 'url=real.1.html' in content
+        assert entries[os.path.join('man1', 'so.1.html')]['size'] == len(
+            content)
+
+    @pytest.mark.parametrize('threads', [False, True],
+                             ids=['processes', 'threads'])
+    def test_parallel_conversion_matches_sequential(self, tmp_path, man_dir,
+                                                    threads):
+        """
+        С несколькими процессами или потоками результат и метрики те же,
+        что при последовательной конвертаций
+        """
+        (man_dir / 'other.2').write_text(man_page + '\nother')
+        sequential = tmp_path / 'sequential'
+        parallel = tmp_path / 'parallel'
+        metrics = Metrics()
+
+        expected = batch.convert_directory(str(man_dir), str(sequential),
+                                           'main.css')
+        entries = batch.convert_directory(str(man_dir), str(parallel),
+                                          'main.css', metrics=metrics,
+                                          jobs=2, threads=threads)
+
+        assert entries == expected
+        assert metrics.pages_converted.get() == 2
+        assert metrics.stage_seconds.count(stage='output') > 0
+        assert (parallel / 'man1' / 'so.1.html').read_bytes() == (
+            sequential / 'man1' / 'so.1.html').read_bytes()
+
+    def test_without_aliases_every_page_is_converted(self, tmp_path, man_dir):
+        metrics = Metrics()
+
+        batch.convert_directory(str(man_dir), str(tmp_path / 'html'),
+                                'main.css', metrics=metrics, aliases=None)
+
+        assert metrics.pages_converted.get() == 4
+
+
+class FlushCounter(io.BytesIO):
+    """
+    Поток, считающий вызовы flush
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = []
+
+    def flush(self):
+        self.flushes.append(self.tell())
+        super().flush()
+
+
+class TestPipe:
+    """
+    Конвертация из стандартного ввода в стандартный вывод
+    """
+    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+
+    def test_sections_are_flushed(self, monkeypatch):
+        """
+        Стандартный вывод сбрасывается после каждого раздела, а байты
+        не зависят от кодировки терминала
+        """
+        stdin = io.TextIOWrapper(io.BytesIO(man_page.encode('utf-8')),
+                                 encoding='ascii')
+        stdout = io.TextIOWrapper(FlushCounter(), encoding='ascii')
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        monkeypatch.setattr(sys, 'stdout', stdout)
+
+        entry = batch.convert_page('-', '-', 'main.css')
+
+        output = stdout.buffer.getvalue()
+        assert output.decode('utf-8') == ''.join(to_html.convert(
+            man_page.splitlines(True), 'main.css'))
+        assert entry['size'] == len(output)
+        # начало страницы, два раздела и конец
+        assert len(set(stdout.buffer.flushes)) == 4
+        assert not stdin.closed
+
+    def test_cponcho_pipe(self):
+        """
+        cponcho.py - читает стандартный ввод и пишет стандартный вывод
+        """
+        with open(os.path.join(self.root_dir, 'man', 'chmod.2'),
+                  'rb') as man_file:
+            source = man_file.read()
+
+        result = subprocess.run(
+            [sys.executable, 'cponcho.py', '-', '--style', 'main.css'],
+            input=source, stdout=subprocess.PIPE, cwd=self.root_dir,
+            check=True)
+
+        assert result.stdout.decode('utf-8') == ''.join(to_html.convert(
+            source.decode('utf-8').splitlines(True), 'main.css'))
+
+    def test_cponcho_pipe_non_utf8(self):
+        """
+        Байты не в utf-8 на стандартном вводе заменяются, а не обрывают
+        конвертацию
+        """
+        result = subprocess.run(
+            [sys.executable, 'cponcho.py', '-', '--style', 'main.css'],
+            input=b'.SH NAME\nfoo \\- caf\xe9\n', stdout=subprocess.PIPE,
+            cwd=self.root_dir, check=True)
+
+        assert 'caf\ufffd' in result.stdout.decode('utf-8')
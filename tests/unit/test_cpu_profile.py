@@ -0,0 +1,130 @@
+import os
+import pickle
+import pstats
+import pytest
+import subprocess
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.utils import arg_parser, batch, cpu_profile
+from src.utils.cpu_profile import CpuProfiler
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+man_dir = os.path.join(root_dir, 'man')
+
+
+def calls(stats: pstats.Stats, name: str) -> int:
+    """
+    :return: количество вызовов функции name по профилю
+    """
+    return sum(nc for (_, _, function), (_, nc, _, _, _)
+               in stats.stats.items() if function == name)
+
+
+class TestCpuProfiler:
+    """
+    Профиль конвертаций в формате pstats и свёрнутые стеки
+    """
+
+    def test_page_profile(self, tmp_path):
+        profile_file = str(tmp_path / 'page.prof')
+
+        with CpuProfiler(interval=0.001) as profiler:
+            batch.convert_page(os.path.join(man_dir, 'bash.1'),
+                               str(tmp_path / 'bash.html'), 'main.css',
+                               profiler=profiler)
+            folded_file = profiler.write(profile_file)
+
+        assert calls(pstats.Stats(profile_file), 'convert_line') > 1000
+        assert folded_file == profile_file + cpu_profile.folded_suffix
+        with open(folded_file, encoding='utf-8') as folded:
+            lines = folded.read().splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            assert stack.startswith('convert_page (batch.py:')
+            assert int(count) > 0
+        assert not os.path.exists(profiler.directory)
+
+    @pytest.mark.parametrize('jobs, threads, pipelined', [
+        (2, False, False), (2, True, False), (2, False, True),
+    ], ids=['processes', 'threads', 'pipeline'])
+    def test_workers_are_aggregated(self, tmp_path, jobs, threads,
+                                    pipelined):
+        with CpuProfiler() as sequential:
+            batch.convert_directory(man_dir, str(tmp_path / 'sequential'),
+                                    'main.css', profiler=sequential)
+            sequential.write(str(tmp_path / 'sequential.prof'))
+
+        with CpuProfiler() as profiler:
+            batch.convert_directory(man_dir, str(tmp_path / 'parallel'),
+                                    'main.css', jobs=jobs, threads=threads,
+                                    pipelined=pipelined, profiler=profiler)
+            profiler.write(str(tmp_path / 'parallel.prof'))
+
+        assert calls(pstats.Stats(str(tmp_path / 'parallel.prof')),
+                     'convert_line') == \
+            calls(pstats.Stats(str(tmp_path / 'sequential.prof')),
+                  'convert_line')
+
+    def test_torn_worker_record_is_dropped(self, tmp_path):
+        function = ('to_html.py', 1, 'convert')
+        with CpuProfiler('sampling') as profiler:
+            with open(os.path.join(profiler.directory, '1.prof'),
+                      'wb') as dump:
+                pickle.dump(({}, {(function,): 3}), dump)
+                dump.write(pickle.dumps(({}, {(function,): 5}))[:-4])
+
+            profiler.write(str(tmp_path / 'torn.prof'))
+
+        assert profiler.stacks == {(function,): 3}
+
+    def test_sampled_stats(self):
+        main = ('a.py', 1, 'main')
+        parse = ('a.py', 2, 'parse')
+        convert = ('a.py', 3, 'convert')
+
+        stats = cpu_profile.sampled_stats(
+            {(main, parse): 2, (main, convert): 1, (main,): 1}, 0.5)
+
+        assert stats[main][:4] == (4, 4, 0.5, 2.0)
+        assert stats[parse][:4] == (2, 2, 1.0, 1.0)
+        assert stats[convert][4] == {main: (1, 1, 0.5, 0.5)}
+
+    def test_page_store_is_profiled(self, tmp_path):
+        """
+        --cpu-profile профилирует и сохранение страниц в базу (--db)
+        """
+        profile_file = str(tmp_path / 'db.prof')
+
+        subprocess.run([sys.executable, 'cponcho.py', 'man', '--db',
+                        str(tmp_path / 'pages.db'), '--cpu-profile',
+                        profile_file], cwd=root_dir, check=True,
+                       stderr=subprocess.DEVNULL)
+
+        assert calls(pstats.Stats(profile_file), 'convert_line') > 1000
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            CpuProfiler('tracing')
+
+
+class TestProfileArguments:
+    """
+    Параметры --cpu-profile
+    """
+
+    def test_profile_file_and_mode(self):
+        args = arg_parser.parse_arguments(['man', '-o', 'html',
+                                           '--cpu-profile', 'conv.prof',
+                                           '--cpu-profile-mode', 'sampling'])
+
+        assert (args.cpu_profile, args.cpu_profile_mode) == \
+            ('conv.prof', 'sampling')
+
+    def test_rejected_with_zip(self):
+        with pytest.raises(SystemExit):
+            arg_parser.parse_arguments(['man', '-o', 'html.zip',
+                                        '--cpu-profile', 'conv.prof'])
@@ -0,0 +1,142 @@
+import json
+import os
+import pickle
+import pytest
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import arg_parser, batch, fragment_cache
+from src.utils.fragment_cache import FragmentCache
+from src.utils.metrics import Metrics
+
+copyright_text = ('.SH COPYRIGHT\nCopyright \\(co 2020 Free Software '
+                  'Foundation.\n.PP\nThis is free software.\n'
+                  '.SS Warranty\nThere is NO WARRANTY.\n')
+
+
+def page_text(name, description):
+    return (f'.TH {name.upper()} 1\n.SH NAME\n{name} \\- {description}\n'
+            f'.SH DESCRIPTION\n\\fB{name}\\fR {description}.\n'
+            f'.SS Warranty\nsee below\n' + copyright_text)
+
+
+class TestFragmentCache:
+    """
+    Кеш html разделов
+    """
+
+    @pytest.mark.parametrize('converter', [
+        to_html.Converter(),
+        to_html.Converter(compact=True),
+        to_html.Converter(toc=True),
+        to_html.Converter(compact=True, toc=True),
+    ], ids=['default', 'compact', 'toc', 'compact-toc'])
+    def test_output_is_identical(self, converter):
+        fragments = FragmentCache()
+
+        for name in ('ls', 'cp', 'ls'):
+            lines = page_text(name, 'copy files').splitlines(True)
+            assert ''.join(converter.convert(lines, 'main.css',
+                                             fragments=fragments)) == \
+                ''.join(converter.convert(lines, 'main.css'))
+
+        stats = fragments.pop_stats()
+        assert stats.hits >= 4
+        assert stats.saved_bytes > 0
+        assert fragments.pop_stats() == (0, 0, 0, 0.0, 0.0)
+
+    def test_anchors_are_part_of_key(self):
+        converter = to_html.Converter(toc=True)
+        fragments = FragmentCache()
+        section = to_html.Section('COPYRIGHT', [])
+        first = to_html.Anchors()
+        second = to_html.Anchors()
+        second.add('COPYRIGHT')
+
+        assert fragments.convert_section(converter, section, first) != \
+            fragments.convert_section(converter, section, second)
+        assert fragments.pop_stats().misses == 2
+
+    def test_size_is_limited(self):
+        converter = to_html.Converter()
+        fragments = FragmentCache(max_size=200)
+
+        for number in range(20):
+            fragments.convert_section(
+                converter, to_html.Section(f'SECTION {number}', []))
+
+        assert 0 < len(fragments) < 20
+        assert fragments.size <= 200
+
+    def test_pickles_to_process_cache(self):
+        fragments = FragmentCache(1024)
+
+        copy = pickle.loads(pickle.dumps(fragments))
+
+        assert copy is fragment_cache.process_cache(1024)
+        assert copy is not fragments
+
+
+class TestBatchFragments:
+    """
+    Кеш разделов при конвертаций директорий
+    """
+
+    @pytest.fixture
+    def man_dir(self, tmp_path):
+        man_dir = tmp_path / 'man'
+        (man_dir / 'man1').mkdir(parents=True)
+        for number in range(6):
+            (man_dir / 'man1' / f'tool{number}.1').write_text(
+                page_text(f'tool{number}', f'tool number {number}'))
+
+        return man_dir
+
+    @pytest.mark.parametrize('jobs, pipelined', [
+        (1, False), (2, False), (1, True),
+    ], ids=['sequential', 'processes', 'pipeline'])
+    def test_output_matches_uncached(self, man_dir, tmp_path, jobs,
+                                     pipelined):
+        metrics = Metrics()
+        converter = to_html.Converter(toc=True)
+        batch.convert_directory(str(man_dir), str(tmp_path / 'plain'),
+                                'main.css', converter=converter)
+
+        batch.convert_directory(str(man_dir), str(tmp_path / 'cached'),
+                                'main.css', converter=converter,
+                                metrics=metrics, jobs=jobs,
+                                pipelined=pipelined,
+                                fragments=FragmentCache())
+
+        plain = json.loads((tmp_path / 'plain' / 'manifest.json')
+                           .read_text())
+        assert json.loads((tmp_path / 'cached' / 'manifest.json')
+                          .read_text()) == plain
+        for entry in plain['pages'].values():
+            for name in entry['files']:
+                assert (tmp_path / 'cached' / name).read_bytes() == \
+                    (tmp_path / 'plain' / name).read_bytes()
+        assert metrics.fragment_requests.get(result='hit') > 0
+        assert metrics.fragment_requests.get(result='hit') + \
+            metrics.fragment_requests.get(result='miss') == 6 * 4
+        assert metrics.fragment_saved_bytes.get() > 0
+        assert metrics.fragment_seconds.get(kind='key') > 0
+
+
+class TestFragmentArguments:
+    """
+    Параметр --fragment-cache
+    """
+
+    def test_size(self):
+        args = arg_parser.parse_arguments(['man', '-o', 'html',
+                                           '--fragment-cache', '16'])
+
+        assert args.fragment_cache == 16
+
+    def test_rejected_with_zip(self):
+        with pytest.raises(SystemExit):
+            arg_parser.parse_arguments(['man', '-o', 'html.zip',
+                                        '--fragment-cache', '16'])
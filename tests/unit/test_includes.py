@@ -0,0 +1,110 @@
+import concurrent.futures
+import os
+import pytest
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.utils.includes import IncludeResolver
+
+
+@pytest.fixture
+def man_dir(tmp_path):
+    """
+    man/man1/real.1, перенаправление man/man1/alias.1 на неё и страница
+    man/man8/uses.8, подключающая общий фрагмент
+    """
+    man_dir = tmp_path / 'man'
+    (man_dir / 'man1').mkdir(parents=True)
+    (man_dir / 'man8').mkdir()
+    (man_dir / 'man1' / 'real.1').write_text('.SH NAME\nreal \\- page\n')
+    (man_dir / 'man1' / 'alias.1').write_text(
+        '.\\" перенаправление\n.so man1/real.1\n')
+    (man_dir / 'man8' / 'common.inc').write_text('common text\n')
+    (man_dir / 'man8' / 'uses.8').write_text(
+        '.SH NAME\nuses\n.so man8/common.inc\nend\n.so man8/common.inc\n')
+
+    return man_dir
+
+
+class TestExpand:
+    """
+    Разворачивание .so
+    """
+
+    def test_includes_are_expanded_and_cached(self, man_dir):
+        resolver = IncludeResolver()
+        page = str(man_dir / 'man8' / 'uses.8')
+
+        with open(page) as man_page:
+            lines = list(resolver.expand(man_page, page))
+
+        assert lines == ['.SH NAME\n', 'uses\n', 'common text\n', 'end\n',
+                         'common text\n']
+        assert (resolver.hits, resolver.misses) == (1, 1)
+
+    def test_counters_from_threads(self, man_dir):
+        resolver = IncludeResolver()
+        include = str(man_dir / 'man8' / 'common.inc')
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda _: resolver.read_lines(include),
+                              range(1000)))
+
+        assert resolver.hits + resolver.misses == 1000
+
+    def test_changed_include_is_read_again(self, man_dir):
+        resolver = IncludeResolver()
+        include = man_dir / 'man8' / 'common.inc'
+        resolver.read_lines(str(include))
+
+        include.write_text('new common text\n')
+
+        assert resolver.read_lines(str(include)) == ('new common text\n',)
+
+    def test_cycle_stops_at_max_depth(self, man_dir):
+        page = man_dir / 'man1' / 'loop.1'
+        page.write_text('x\n.so man1/loop.1\n')
+        resolver = IncludeResolver(max_depth=3)
+
+        lines = list(resolver.expand(['.so man1/loop.1\n'], str(page)))
+
+        assert lines == ['x\n'] * 3
+
+    def test_missing_include_is_dropped(self, man_dir):
+        resolver = IncludeResolver()
+        page = str(man_dir / 'man1' / 'real.1')
+
+        assert list(resolver.expand(['a\n', '.so man1/none.1\n'],
+                                    page)) == ['a\n']
+
+
+class TestSource:
+    """
+    Поиск настоящего файла страницы
+    """
+
+    @pytest.mark.parametrize('name, is_redirect', [
+        ('alias.1', True),
+        ('real.1', False),
+    ])
+    def test_get_redirect(self, man_dir, name, is_redirect):
+        resolver = IncludeResolver()
+
+        target = resolver.get_redirect(str(man_dir / 'man1' / name))
+
+        assert target == (str(man_dir / 'man1' / 'real.1')
+                          if is_redirect else None)
+
+    def test_page_with_text_and_include_is_not_redirect(self, man_dir):
+        resolver = IncludeResolver()
+
+        assert resolver.get_redirect(str(man_dir / 'man8' / 'uses.8')) is None
+
+    def test_get_source_follows_symlinks_and_redirects(self, man_dir):
+        link = man_dir / 'man1' / 'link.1'
+        link.symlink_to(man_dir / 'man1' / 'alias.1')
+        resolver = IncludeResolver()
+
+        assert resolver.get_source(str(link)) == os.path.realpath(
+            str(man_dir / 'man1' / 'real.1'))
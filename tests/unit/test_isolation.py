@@ -0,0 +1,218 @@
+import concurrent.futures
+import json
+import os
+import pytest
+import signal
+import sys
+import time
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import batch, file_manager, isolation
+from src.utils.isolation import Limits, PageLimitError
+from src.utils.metrics import Metrics
+from src.utils.server import PageService
+
+page_text = '.TH PAGE 1\n.SH NAME\npage \\- test page\n'
+
+
+def spin(page, metrics):
+    with metrics.stage('spin'):
+        while True:
+            pass
+
+
+def allocate(page, metrics):
+    blocks = []
+    with metrics.stage('allocate'):
+        while True:
+            blocks.append(bytearray(1024 * 1024))
+
+
+def measure(page, metrics, value):
+    with metrics.stage('measure'):
+        return os.path.getsize(page) + value
+
+
+def kill_self(page, metrics):
+    with metrics.stage('kill'):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+
+def get_pid(page, metrics):
+    return os.getpid()
+
+
+def get_pid_slowly(page, metrics):
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def fail(page, metrics):
+    raise ValueError(page)
+
+
+class HangingConverter(to_html.Converter):
+    """
+    Конвертер, который зависает на страницах со строкой HANG
+    """
+
+    def __reduce__(self):
+        return HangingConverter, super().__reduce__()[1]
+
+    def convert(self, lines, stylesheet, stage=None, fragments=None):
+        lines = list(lines)
+        if any('HANG' in line for line in lines):
+            with stage('convert_section'):
+                while True:
+                    pass
+        return super().convert(lines, stylesheet, stage, fragments)
+
+
+@pytest.fixture
+def page(tmp_path):
+    page = tmp_path / 'page.1'
+    page.write_text(page_text)
+
+    return str(page)
+
+
+@pytest.fixture
+def man_dir(tmp_path):
+    """
+    Директория с обычной страницей, зависающей страницей и её псевдонимом
+    """
+    man_dir = tmp_path / 'man'
+    (man_dir / 'man1').mkdir(parents=True)
+    (man_dir / 'man1' / 'one.1').write_text(page_text)
+    (man_dir / 'man1' / 'hang.1').write_text(page_text + 'HANG\n')
+    (man_dir / 'man1' / 'link.1').symlink_to(man_dir / 'man1' / 'hang.1')
+
+    return man_dir
+
+
+class TestRunLimited:
+    """
+    Выполнение функции в отдельном процессе с ограничениями
+    """
+
+    def test_returns_result_and_metrics(self, page):
+        metrics = Metrics()
+
+        result = isolation.run_limited(measure, page, Limits(10, 10, None),
+                                       metrics, value=1)
+
+        assert result == len(page_text) + 1
+        assert metrics.stage_seconds.count(stage='measure') == 1
+
+    @pytest.mark.parametrize('function, limits, reason, stage', [
+        (spin, Limits(0.5, None, None), 'wall_time', 'spin'),
+        (spin, Limits(None, 1, None), 'cpu_time', 'spin'),
+        (allocate, Limits(None, None, 256 * 1024 * 1024), 'memory',
+         'allocate'),
+    ], ids=['wall_time', 'cpu_time', 'memory'])
+    def test_violation_stops_process(self, page, function, limits, reason,
+                                     stage):
+        metrics = Metrics()
+
+        with pytest.raises(PageLimitError) as error:
+            isolation.run_limited(function, page, limits, metrics)
+
+        assert (error.value.reason, error.value.stage, error.value.size) == \
+            (reason, stage, len(page_text))
+        assert metrics.page_limit_violations.get(reason=reason,
+                                                 stage=stage) == 1
+
+    def test_kill_is_not_cpu_time(self, page):
+        """
+        Процесс, убитый SIGKILL, останавливается по причине killed, даже
+        если задано ограничение процессорного времени
+        """
+        metrics = Metrics()
+
+        with pytest.raises(PageLimitError) as error:
+            isolation.run_limited(kill_self, page, Limits(None, 10, None),
+                                  metrics)
+
+        assert (error.value.reason, error.value.stage) == ('killed', 'kill')
+        assert metrics.page_limit_violations.get(reason='killed',
+                                                 stage='kill') == 1
+
+    def test_pool_replaces_only_stopped_process(self, page):
+        with isolation.IsolatedPool(Limits(0.5, None, None)) as pool:
+            pid = pool.run(get_pid, page)
+            assert pool.run(get_pid, page) == pid
+
+            with pytest.raises(PageLimitError):
+                pool.run(spin, page)
+
+            assert pool.run(get_pid, page) != pid
+
+    def test_pool_limits_concurrent_workers(self, page):
+        with isolation.IsolatedPool(Limits(10, None, None),
+                                    max_idle=2, max_workers=2) as pool:
+            with concurrent.futures.ThreadPoolExecutor(6) as executor:
+                pids = list(executor.map(
+                    lambda _: pool.run(get_pid_slowly, page), range(6)))
+
+        assert len(set(pids)) <= 2
+
+    def test_other_errors_are_raised(self, page):
+        with pytest.raises(ValueError):
+            isolation.run_limited(fail, page, Limits(10, None, None))
+
+
+class TestLimitedConversion:
+    """
+    Страницы, превысившие ограничения, пропускаются
+    """
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_batch_skips_page(self, man_dir, tmp_path, jobs):
+        output_dir = tmp_path / 'html'
+        metrics = Metrics()
+
+        entries = batch.convert_directory(
+            str(man_dir), str(output_dir), 'main.css',
+            converter=HangingConverter(), metrics=metrics, jobs=jobs,
+            limits=Limits(1, None, None))
+
+        manifest = json.loads((output_dir / 'manifest.json').read_text())
+        assert list(entries) == ['man1/one.1.html']
+        assert list(manifest['pages']) == ['man1/one.1.html']
+        assert manifest['failures']['man1/hang.1.html'] == {
+            'source': str(man_dir / 'man1' / 'hang.1'),
+            'reason': 'wall_time', 'stage': 'convert_section',
+            'size': len(page_text) + len('HANG\n')}
+        assert manifest['failures']['man1/link.1.html']['alias_of'] == \
+            'man1/hang.1.html'
+        assert metrics.pages_converted.get() == 1
+        assert metrics.page_failures.get() == 1
+        assert not (output_dir / 'man1' / 'hang.1.html').exists()
+
+    def test_failure_is_removed_after_conversion(self, tmp_path):
+        manifest_file = str(tmp_path / 'manifest.json')
+        file_manager.update_manifest(manifest_file, {},
+                                     {'a.1.html': {'reason': 'wall_time'}})
+
+        file_manager.update_manifest(manifest_file, {'a.1.html': {}})
+
+        with open(manifest_file, encoding='utf-8') as manifest:
+            assert json.load(manifest) == {'pages': {'a.1.html': {}}}
+
+    def test_server_remembers_failure(self, man_dir):
+        service = PageService(str(man_dir), 'main.css', HangingConverter(),
+                              limits=Limits(1, None, None))
+
+        with pytest.raises(PageLimitError):
+            service.get_page(str(man_dir / 'man1' / 'hang.1'))
+        start = time.perf_counter()
+        with pytest.raises(PageLimitError):
+            service.get_page(str(man_dir / 'man1' / 'hang.1'))
+
+        assert time.perf_counter() - start < 1
+        assert service.get_page(str(man_dir / 'man1' / 'one.1')).body
+        assert service.metrics.page_failures.get() == 2
+        assert service.metrics.page_limit_violations.get(
+            reason='wall_time', stage='convert_section') == 1
@@ -0,0 +1,68 @@
+import os
+import pytest
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.utils import memory_profile
+from src.utils.memory_profile import StageMemory
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+man_dir = os.path.join(root_dir, 'man')
+# другой файл бюджетов можно задать переменной окружения
+budgets_file = os.environ.get(
+    'PONCHO_MEMORY_BUDGETS',
+    os.path.join(root_dir, 'tests', 'memory_budgets.json'))
+
+
+class TestMemoryBudgets:
+    """
+    Потребление памяти этапами конвертаций встроенных man страниц
+    """
+    budgets = memory_profile.load_budgets(budgets_file)
+
+    @pytest.mark.parametrize('page_name', sorted(os.listdir(man_dir)))
+    def test_conversion_fits_budget(self, page_name):
+        """
+        Ни один этап конвертаций страницы не выходит за её бюджет памяти
+        """
+        results = memory_profile.profile_conversion(
+            os.path.join(man_dir, page_name))
+        budget = memory_profile.get_page_budget(self.budgets, page_name)
+
+        assert set(results) == set(memory_profile.stages)
+        assert memory_profile.check_budget(results, budget) == []
+
+
+class TestBudgetChecks:
+    """
+    Сравнение замеров с бюджетом
+    """
+    results = {'get_sections': StageMemory(100, 10),
+               'output': StageMemory(300, 0)}
+
+    def test_page_budget_overrides_default(self):
+        """
+        memory_profile.get_page_budget дополняет бюджет по умолчанию
+        значениями страницы
+        """
+        budgets = {'default': {'peak': 1, 'retained': 2},
+                   'pages': {'gcc.1': {'peak': 3}}}
+
+        assert memory_profile.get_page_budget(budgets, 'gcc.1') == {
+            'peak': 3, 'retained': 2}
+
+    @pytest.mark.parametrize('budget, expected', [
+        ({'peak': 300, 'retained': 10}, []),
+        ({'peak': 200},
+         ['output: peak 300 B exceeds budget 200 B']),
+        ({'peak': {'get_sections': 50}, 'retained': 5},
+         ['get_sections: peak 100 B exceeds budget 50 B',
+          'get_sections: retained 10 B exceeds budget 5 B']),
+    ], ids=['fits', 'common_limit', 'stage_limit'])
+    def test_check_budget(self, budget, expected):
+        """
+        memory_profile.check_budget находит этапы, превысившие бюджет
+        """
+        assert memory_profile.check_budget(self.results, budget) == expected
@@ -0,0 +1,229 @@
+import os
+import pytest
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import batch, server
+from src.utils.metrics import Metrics
+
+man_page = '\n'.join([
+    '.SH NAME',
+    r'test \- check things',
+    '.SH DESCRIPTION',
+    'Checks things',
+])
+
+
+class FailingConverter(to_html.Converter):
+    """
+    Конвертер, который падает на страницах со строкой FAIL
+    """
+
+    def __reduce__(self):
+        return FailingConverter, super().__reduce__()[1]
+
+    def convert(self, lines, stylesheet, stage=None, fragments=None):
+        lines = list(lines)
+        if any('FAIL' in line for line in lines):
+            raise ValueError('FAIL')
+        return super().convert(lines, stylesheet, stage, fragments)
+
+
+def parse_samples(text):
+    """
+    :return: словарь строка образца (имя с метками) - значение
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+
+    return samples
+
+
+class TestMetrics:
+    """
+    Выгрузка метрик в формате Prometheus
+    """
+
+    def test_counters(self):
+        """
+        Счётчики с метками и без выгружаются своими образцами
+        """
+        metrics = Metrics()
+        metrics.pages_converted.inc()
+        metrics.pages_converted.inc(2)
+        metrics.cache_requests.inc(result='hit')
+
+        text = metrics.render()
+
+        assert '# TYPE poncho_pages_converted_total counter' in text
+        samples = parse_samples(text)
+        assert samples['poncho_pages_converted_total'] == 3
+        assert samples['poncho_cache_requests_total{result="hit"}'] == 1
+
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        Корзины гистограммы накопительные, +Inf равна количеству
+        """
+        metrics = Metrics()
+        for value in (0.0001, 0.003, 20):
+            metrics.stage_seconds.observe(value, stage='get_sections')
+
+        samples = parse_samples(metrics.render())
+        prefix = 'poncho_stage_duration_seconds'
+        labels = 'stage="get_sections"'
+
+        assert samples[f'{prefix}_bucket{{{labels},le="0.0005"}}'] == 1
+        assert samples[f'{prefix}_bucket{{{labels},le="0.005"}}'] == 2
+        assert samples[f'{prefix}_bucket{{{labels},le="10"}}'] == 2
+        assert samples[f'{prefix}_bucket{{{labels},le="+Inf"}}'] == 3
+        assert samples[f'{prefix}_count{{{labels}}}'] == 3
+        assert samples[f'{prefix}_sum{{{labels}}}'] == pytest.approx(20.0031)
+
+    @pytest.mark.parametrize('hits, misses, expected', [
+        (0, 0, 0.0),
+        (3, 1, 0.75),
+    ])
+    def test_cache_hit_rate(self, hits, misses, expected):
+        metrics = Metrics()
+        metrics.cache_requests.inc(hits, result='hit')
+        metrics.cache_requests.inc(misses, result='miss')
+
+        assert metrics.cache_hit_rate() == expected
+
+    def test_write(self, tmp_path):
+        """
+        Metrics.write записывает то же, что возвращает render
+        """
+        metrics = Metrics()
+        metrics.page_failures.inc()
+        file_name = tmp_path / 'poncho.prom'
+
+        metrics.write(str(file_name))
+
+        assert file_name.read_text(encoding='utf-8') == metrics.render()
+        assert os.listdir(tmp_path) == ['poncho.prom']
+
+
+class TestBatchMetrics:
+    """
+    Метрики пакетной конвертаций
+    """
+
+    def test_convert_directory_records_metrics(self, tmp_path):
+        input_dir = tmp_path / 'man'
+        input_dir.mkdir()
+        for name in ('a.1', 'b.1'):
+            (input_dir / name).write_text(f'{man_page}\n{name}',
+                                          encoding='utf-8')
+        metrics = Metrics()
+
+        entries = batch.convert_directory(str(input_dir),
+                                          str(tmp_path / 'html'),
+                                          'main.css', metrics=metrics)
+
+        assert metrics.pages_converted.get() == 2
+        assert metrics.input_bytes.get() == 2 * (len(man_page) + 4)
+        assert metrics.output_bytes.get() == sum(
+            entry['size'] for entry in entries.values())
+        assert metrics.page_seconds.count() == 2
+        for stage in ('get_sections', 'convert_section', 'output'):
+            assert metrics.stage_seconds.count(stage=stage) > 0
+
+    def test_failure_is_counted(self, tmp_path):
+        page = tmp_path / 'broken.1'
+        page.write_text('.SH NAME\nFAIL\n')
+        metrics = Metrics()
+
+        with pytest.raises(ValueError):
+            batch.convert_page(str(page), str(tmp_path / 'broken.1.html'),
+                               'main.css', converter=FailingConverter(),
+                               metrics=metrics)
+
+        assert metrics.page_failures.get() == 1
+        assert metrics.pages_converted.get() == 0
+
+
+class TestPageCache:
+    """
+    LRU кеш страниц сервера
+    """
+
+    def test_evicts_least_recently_used(self):
+        cache = server.PageCache(max_size=10)
+        cache.put('a', server.CachedPage(b'12345', 'a'))
+        cache.put('b', server.CachedPage(b'12345', 'b'))
+        cache.get('a')
+
+        cache.put('c', server.CachedPage(b'12345', 'c'))
+
+        assert cache.get('b') is None
+        assert cache.get('a') is not None
+        assert cache.size == 10
+
+
+class TestServer:
+    """
+    Сервер страниц с /metrics
+    """
+
+    @pytest.fixture
+    def base_url(self, tmp_path):
+        (tmp_path / 'test.1').write_text(man_page, encoding='utf-8')
+        service = server.PageService(str(tmp_path), 'main.css')
+        http_server = server.create_server(service, port=0)
+        thread = threading.Thread(target=http_server.serve_forever)
+        thread.start()
+
+        yield f'http://127.0.0.1:{http_server.server_port}'
+
+        http_server.shutdown()
+        http_server.server_close()
+        thread.join()
+
+    def get(self, url, headers=None):
+        request = urllib.request.Request(url, headers=headers or {})
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+
+    def test_page_and_metrics(self, base_url):
+        """
+        Страница конвертируется один раз, повторный запрос - попадание в
+        кеш, что видно в /metrics
+        """
+        status, headers, body = self.get(f'{base_url}/test.1.html')
+        self.get(f'{base_url}/test.1.html')
+        _, metrics_headers, metrics_body = self.get(f'{base_url}/metrics')
+
+        assert status == 200
+        assert b'Checks things' in body
+        assert metrics_headers['Content-Type'].startswith('text/plain')
+        samples = parse_samples(metrics_body.decode('utf-8'))
+        assert samples['poncho_pages_converted_total'] == 1
+        assert samples['poncho_cache_requests_total{result="hit"}'] == 1
+        assert samples['poncho_cache_requests_total{result="miss"}'] == 1
+        assert samples['poncho_output_bytes_total'] == 2 * len(body)
+
+    def test_not_modified(self, base_url):
+        _, headers, _ = self.get(f'{base_url}/test.1.html')
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            self.get(f'{base_url}/test.1.html',
+                     {'If-None-Match': headers['ETag']})
+
+        assert error.value.code == 304
+
+    @pytest.mark.parametrize('url_path', [
+        '/missing.1.html', '/test.1', '/..%2Fetc%2Fpasswd.html'])
+    def test_not_found(self, base_url, url_path):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            self.get(base_url + url_path)
+
+        assert error.value.code == 404
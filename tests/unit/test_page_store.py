@@ -0,0 +1,244 @@
+import os
+import pytest
+import sqlite3
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import file_manager
+from src.utils.page_store import PageStore, source_hash
+
+man_page = '\n'.join([
+    '.TH TEST 1',
+    '.SH NAME',
+    r'test \- check things',
+    '.SH DESCRIPTION',
+    '.PP',
+    r'Checks \fIthings\fP',
+]).encode('utf-8')
+
+
+@pytest.fixture
+def store(tmp_path):
+    with PageStore(str(tmp_path / 'pages.db'), batch_size=2) as s:
+        yield s
+
+
+class TestPageStore:
+    """
+    Сохранение и чтение страниц из базы SQLite
+    """
+    def test_database_is_in_wal_mode(self, tmp_path, store):
+        """
+        База открывается в режиме WAL
+        """
+        connection = sqlite3.connect(str(tmp_path / 'pages.db'))
+        mode = connection.execute('PRAGMA journal_mode').fetchone()[0]
+        connection.close()
+
+        assert mode == 'wal'
+
+    def test_get_page(self, store):
+        """
+        PageStore.get_page возвращает разделы страницы в исходном порядке
+        """
+        store.add_page('test', '1', 'hash', [('NAME', '<a>'),
+                                             ('DESCRIPTION', '<b>')])
+
+        assert store.get_page('test', '1') == '<a><b>'
+
+    def test_get_section(self, store):
+        """
+        PageStore.get_section возвращает один раздел страницы по заголовку
+        """
+        store.add_page('test', '1', 'hash', [('NAME', '<a>'),
+                                             ('DESCRIPTION', '<b>')])
+
+        assert store.get_section('test', '1', 'DESCRIPTION') == '<b>'
+
+    @pytest.mark.parametrize('key', [('test', '2'), ('other', '1')],
+                             ids=['other_section', 'other_name'])
+    def test_missing_page(self, store, key):
+        """
+        Для отсутствующей страницы возвращается None
+        """
+        store.add_page('test', '1', 'hash', [('NAME', '<a>')])
+
+        assert store.get_page(*key) is None
+        assert store.get_section(*key, 'NAME') is None
+
+    def test_add_page_replaces_previous_version(self, store):
+        """
+        Повторное добавление страницы заменяет её разделы и метаданные
+        """
+        store.add_page('test', '1', 'old', [('NAME', '<a>'),
+                                            ('DESCRIPTION', '<b>')])
+        store.add_page('test', '1', 'new', [('NAME', '<c>')])
+
+        assert store.get_page('test', '1') == '<c>'
+        assert store.get_section('test', '1', 'DESCRIPTION') is None
+        assert store.get_source_hash('test', '1') == 'new'
+
+    def test_pages_are_visible_after_reopen(self, tmp_path):
+        """
+        Незафиксированная пачка фиксируется при закрытий хранилища
+        """
+        file_name = str(tmp_path / 'pages.db')
+        with PageStore(file_name, batch_size=100) as store:
+            store.add_page('test', '1', 'hash', [('NAME', '<a>')])
+
+        with PageStore(file_name) as store:
+            assert store.get_page('test', '1') == '<a>'
+
+    def test_add_man_page(self, store):
+        """
+        PageStore.add_man_page сохраняет сконвертированные разделы страницы
+        и хеш исходника
+        """
+        converted = store.add_man_page('test', '1', man_page)
+
+        assert converted
+        assert store.get_source_hash('test', '1') == source_hash(man_page)
+        assert 'things' in store.get_section('test', '1', 'DESCRIPTION')
+
+    def test_add_unchanged_man_page_is_skipped(self, store):
+        """
+        Страница с неизменившимся исходником повторно не конвертируется
+        """
+        store.add_man_page('test', '1', man_page)
+
+        assert not store.add_man_page('test', '1', man_page)
+
+
+    def test_changed_converter_rebuilds_page(self, tmp_path):
+        """
+        Страница, сохранённая конвертером с другим отпечатком,
+        конвертируется заново
+        """
+        file_name = str(tmp_path / 'pages.db')
+        with PageStore(file_name) as store:
+            store.add_man_page('test', '1', man_page)
+
+        converter = to_html.Converter(compact=True)
+        with PageStore(file_name, converter=converter) as store:
+            assert store.add_man_page('test', '1', man_page)
+            assert not store.add_man_page('test', '1', man_page)
+            html = store.get_page('test', '1')
+
+        assert 'paragraph"' not in html
+
+    def test_database_without_fingerprints(self, tmp_path):
+        """
+        Страницы базы без столбца отпечатков конвертируются заново
+        """
+        file_name = str(tmp_path / 'pages.db')
+        connection = sqlite3.connect(file_name)
+        connection.execute(
+            'CREATE TABLE pages (id INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+            'section TEXT NOT NULL, source_hash TEXT NOT NULL, '
+            'rendered_at REAL NOT NULL, UNIQUE (name, section))')
+        connection.execute(
+            "INSERT INTO pages (name, section, source_hash, rendered_at) "
+            "VALUES ('test', '1', ?, 0)", (source_hash(man_page),))
+        connection.commit()
+        connection.close()
+
+        with PageStore(file_name) as store:
+            assert store.add_man_page('test', '1', man_page)
+
+    def test_failed_page_keeps_previous_version(self, store):
+        """
+        Если конвертация страницы прервалась, прежняя версия остаётся
+        """
+        store.add_page('test', '1', 'old', [('NAME', '<a>')])
+
+        def sections():
+            yield 'NAME', '<b>'
+            raise ValueError('conversion failed')
+
+        with pytest.raises(ValueError):
+            store.add_page('test', '1', 'new', sections())
+
+        assert store.get_page('test', '1') == '<a>'
+        assert store.get_source_hash('test', '1') == 'old'
+
+    def test_error_rolls_back_batch(self, tmp_path):
+        """
+        При выходе из хранилища по исключению незафиксированная пачка
+        отменяется
+        """
+        file_name = str(tmp_path / 'pages.db')
+        with PageStore(file_name) as store:
+            store.add_page('kept', '1', 'hash', [('NAME', '<a>')])
+
+        with pytest.raises(ValueError):
+            with PageStore(file_name) as store:
+                store.add_page('test', '1', 'hash', [('NAME', '<b>')])
+                raise ValueError('conversion failed')
+
+        with PageStore(file_name) as store:
+            assert store.get_page('test', '1') is None
+            assert store.get_page('kept', '1') == '<a>'
+
+    def test_man_page_not_in_utf8(self, store):
+        """
+        Байты не в utf-8 заменяются, страница сохраняется, а не отменяет
+        пачку
+        """
+        source = man_page.replace(b'things', b'th\xffings')
+
+        assert store.add_man_page('test', '1', source)
+        assert 'th\ufffdings' in store.get_section('test', '1', 'DESCRIPTION')
+
+    def test_redirect_page_stores_target(self, tmp_path):
+        """
+        Страница-перенаправление .so сохраняется с разделами страницы, на
+        которую она указывает, и конвертируется заново при её изменений
+        """
+        file_name = str(tmp_path / 'pages.db')
+        (tmp_path / 'man1').mkdir()
+        target = tmp_path / 'man1' / 'test.1'
+        target.write_bytes(man_page)
+        redirect = tmp_path / 'man1' / 'alias.1'
+        redirect.write_text('.so man1/test.1\n')
+
+        for text in ('things', 'stuff'):
+            target.write_bytes(man_page.replace(b'things', text.encode()))
+            with PageStore(file_name) as store:
+                assert store.add_man_page('alias', '1',
+                                          redirect.read_bytes(),
+                                          str(redirect))
+                assert text in store.get_section('alias', '1',
+                                                 'DESCRIPTION')
+
+
+class TestPageNames:
+    """
+    Имена и поиск man страниц
+    """
+    @pytest.mark.parametrize('file_name, expected', [
+        ('man/bash.1', ('bash', '1')),
+        ('chmod.2', ('chmod', '2')),
+        ('open.3p', ('open', '3p')),
+        ('README', ('README', '')),
+    ])
+    def test_split_page_name(self, file_name, expected):
+        """
+        file_manager.split_page_name выделяет имя страницы и раздел
+        """
+        assert file_manager.split_page_name(file_name) == expected
+
+    def test_find_man_pages(self, tmp_path):
+        """
+        file_manager.find_man_pages находит только man страницы, рекурсивно
+        """
+        (tmp_path / 'man1').mkdir()
+        (tmp_path / 'man1' / 'ls.1').write_text('')
+        (tmp_path / 'cat.1').write_text('')
+        (tmp_path / 'notes.txt').write_text('')
+
+        pages = file_manager.find_man_pages(str(tmp_path))
+
+        assert pages == [str(tmp_path / 'cat.1'),
+                         str(tmp_path / 'man1' / 'ls.1')]
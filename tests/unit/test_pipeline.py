@@ -0,0 +1,159 @@
+import json
+import os
+import pytest
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import batch
+from src.utils.metrics import Metrics
+from src.utils.pipeline import Pipeline, Stage
+
+page_text = '.TH PAGE 1\n.SH NAME\npage \\- test page\n.SH DESCRIPTION\n'
+
+
+class FailingConverter(to_html.Converter):
+    """
+    Конвертер, который падает на страницах со строкой FAIL
+    """
+
+    def __reduce__(self):
+        return FailingConverter, super().__reduce__()[1]
+
+    def convert(self, lines, stylesheet, stage=None, fragments=None):
+        lines = list(lines)
+        if any('FAIL' in line for line in lines):
+            raise ValueError('FAIL')
+        return super().convert(lines, stylesheet, stage, fragments)
+
+
+def fail_on_three(item):
+    if item == 3:
+        raise ValueError(item)
+    return item
+
+
+class TestPipeline:
+    """
+    Конвейер этапов в потоках
+    """
+
+    def test_results_pass_all_stages(self):
+        stages = [Stage('double', lambda x: x * 2, 1),
+                  Stage('inc', lambda x: x + 1, 3)]
+
+        results = Pipeline(stages, queue_size=2).run(range(50))
+
+        assert sorted(results) == [x * 2 + 1 for x in range(50)]
+
+    def test_single_workers_keep_order(self):
+        stages = [Stage('same', lambda x: x, 1)] * 3
+
+        assert list(Pipeline(stages).run(range(50))) == list(range(50))
+
+    def test_queues_limit_items_in_flight(self):
+        pulled = []
+
+        def items():
+            for item in range(100):
+                pulled.append(item)
+                yield item
+
+        results = Pipeline([Stage('same', lambda x: x, 1)],
+                           queue_size=2).run(items())
+        next(results)
+        time.sleep(0.2)
+
+        # очереди по 2 элемента, по одному у подающего потока, потока
+        # этапа и у потребителя
+        assert len(pulled) <= 7
+        results.close()
+
+    def test_error_stops_pipeline(self):
+        threads = threading.active_count()
+        stages = [Stage('check', fail_on_three, 2),
+                  Stage('same', lambda x: x, 1)]
+
+        with pytest.raises(ValueError):
+            list(Pipeline(stages, queue_size=1).run(range(1000)))
+
+        assert threading.active_count() == threads
+
+    def test_consumer_can_stop_early(self):
+        threads = threading.active_count()
+
+        for item in Pipeline([Stage('same', lambda x: x, 1)],
+                             queue_size=1).run(range(1000)):
+            break
+
+        assert threading.active_count() == threads
+
+    def test_stats_show_bottleneck(self):
+        metrics = Metrics()
+        pipeline = Pipeline([Stage('fast', lambda x: x, 1),
+                             Stage('slow', lambda x: time.sleep(0.01), 1)],
+                            metrics=metrics)
+
+        list(pipeline.run(range(20)))
+
+        assert pipeline.stats['slow'].items == 20
+        assert pipeline.stats['slow'].utilization > \
+            pipeline.stats['fast'].utilization
+        assert metrics.pipeline_seconds.get(stage='slow', state='busy') >= \
+            0.2
+
+
+class TestPipelinedConversion:
+    """
+    Конвейерная конвертация директорий
+    """
+
+    @pytest.fixture
+    def man_dir(self, tmp_path):
+        man_dir = tmp_path / 'man'
+        (man_dir / 'man1').mkdir(parents=True)
+        for number in range(10):
+            (man_dir / 'man1' / f'page{number}.1').write_text(
+                page_text + f'\\fBpage\\fR {number}\n' * number)
+
+        return man_dir
+
+    @pytest.mark.parametrize('jobs, threads', [
+        (1, False), (2, False), (2, True),
+    ], ids=['single', 'processes', 'threads'])
+    def test_output_matches_sequential(self, man_dir, tmp_path, jobs,
+                                       threads):
+        metrics = Metrics()
+        batch.convert_directory(str(man_dir), str(tmp_path / 'sequential'),
+                                'main.css', compress=['gzip'])
+
+        batch.convert_directory(str(man_dir), str(tmp_path / 'pipeline'),
+                                'main.css', compress=['gzip'],
+                                metrics=metrics, jobs=jobs, pipelined=True,
+                                threads=threads)
+
+        sequential = json.loads(
+            (tmp_path / 'sequential' / 'manifest.json').read_text())
+        assert json.loads((tmp_path / 'pipeline' / 'manifest.json')
+                          .read_text()) == sequential
+        for entry in sequential['pages'].values():
+            for name in entry['files']:
+                assert (tmp_path / 'pipeline' / name).read_bytes() == \
+                    (tmp_path / 'sequential' / name).read_bytes()
+        assert metrics.pages_converted.get() == 10
+        for stage in batch.pipeline_stages:
+            assert metrics.pipeline_seconds.get(stage=stage, state='busy')
+
+    def test_failure_is_raised(self, man_dir, tmp_path):
+        (man_dir / 'man1' / 'broken.1').write_text('FAIL\n')
+        metrics = Metrics()
+
+        with pytest.raises(ValueError):
+            batch.convert_directory(str(man_dir), str(tmp_path / 'html'),
+                                    'main.css', converter=FailingConverter(),
+                                    metrics=metrics, pipelined=True)
+
+        assert metrics.page_failures.get() == 1
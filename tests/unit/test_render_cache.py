@@ -0,0 +1,191 @@
+import os
+import pytest
+import subprocess
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils import batch
+from src.utils.metrics import Metrics
+from src.utils.render_cache import RenderCache
+from src.utils.server import PageService
+
+page_lines = ['.TH PAGE 1\n', '.SH NAME\n', 'page \\- test page\n',
+              '.SH DESCRIPTION\n', '\\fBbold\\fR text\n']
+
+
+@pytest.fixture
+def man_dir(tmp_path):
+    """
+    Директория с двумя разными страницами
+    """
+    man_dir = tmp_path / 'man'
+    (man_dir / 'man1').mkdir(parents=True)
+    (man_dir / 'man1' / 'one.1').write_text(''.join(page_lines))
+    (man_dir / 'man1' / 'two.1').write_text(
+        ''.join(page_lines).replace('bold', 'other'))
+
+    return man_dir
+
+
+def render(render_cache, lines, converter=to_html.default_converter,
+           metrics=None):
+    return b''.join(render_cache.render(lines, 'main.css', converter,
+                                        metrics=metrics))
+
+
+class TestRenderCache:
+    """
+    Кеш html на диске
+    """
+
+    def test_hit_returns_same_html_as_conversion(self, tmp_path):
+        render_cache = RenderCache(str(tmp_path / 'cache'))
+        metrics = Metrics()
+        expected = ''.join(to_html.default_converter.convert(
+            page_lines, 'main.css')).encode('utf-8')
+
+        first = render(render_cache, page_lines, metrics=metrics)
+        second = render(RenderCache(str(tmp_path / 'cache')), page_lines,
+                        metrics=metrics)
+
+        assert first == second == expected
+        assert metrics.render_cache_requests.get(result='miss') == 1
+        assert metrics.render_cache_requests.get(result='hit') == 1
+
+    @pytest.mark.parametrize('stylesheet, converter', [
+        ('other.css', to_html.default_converter),
+        ('main.css', to_html.Converter(compact=True)),
+        ('main.css', to_html.Converter(toc=True)),
+    ], ids=['stylesheet', 'compact', 'toc'])
+    def test_key_depends_on_options(self, stylesheet, converter):
+        default_key = RenderCache.key(page_lines, 'main.css',
+                                      to_html.default_converter)
+
+        assert RenderCache.key(page_lines, stylesheet, converter) != \
+            default_key
+
+    def test_key_depends_on_converter_version(self, monkeypatch):
+        key = RenderCache.key(page_lines, 'main.css',
+                              to_html.default_converter)
+
+        monkeypatch.setattr(to_html, 'converter_version',
+                            to_html.converter_version + 1)
+
+        assert RenderCache.key(page_lines, 'main.css',
+                               to_html.default_converter) != key
+
+    def test_prune_removes_least_recently_read(self, tmp_path):
+        render_cache = RenderCache(str(tmp_path / 'cache'))
+        for number, key in enumerate(['aa1', 'bb2', 'cc3']):
+            render_cache.put(key, b'x' * 10)
+            os.utime(render_cache._file_name(key), (number, number))
+        render_cache.get('aa1')
+
+        removed = render_cache.prune(max_size=20)
+
+        assert removed == (1, 10)
+        assert render_cache.get('bb2') is None
+        assert render_cache.get('aa1') == b'x' * 10
+        assert render_cache.stats()[:2] == (2, 20)
+
+    def test_prune_by_age(self, tmp_path):
+        render_cache = RenderCache(str(tmp_path / 'cache'))
+        render_cache.put('aa1', b'old')
+        render_cache.put('bb2', b'new')
+        os.utime(render_cache._file_name('aa1'), (0, 0))
+
+        assert render_cache.prune(max_age=60) == (1, 3)
+        assert render_cache.stats().entries == 1
+
+    def test_unfinished_write_is_not_an_entry(self, tmp_path):
+        render_cache = RenderCache(str(tmp_path / 'cache'))
+        (tmp_path / 'cache' / 'aa').mkdir()
+        (tmp_path / 'cache' / 'aa' / 'tmp123.tmp').write_bytes(b'partial')
+
+        assert render_cache.stats().entries == 0
+
+    def test_put_keeps_size_bound(self, tmp_path):
+        render_cache = RenderCache(str(tmp_path / 'cache'), max_size=50)
+        for number in range(10):
+            render_cache.put(f'{number:03}', b'x' * 10)
+
+        assert render_cache.stats().size <= 50
+        assert render_cache.get('009') == b'x' * 10
+
+
+class TestSharedCache:
+    """
+    Один кеш у конвертаций директорий и сервера
+    """
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_second_conversion_uses_cache(self, man_dir, tmp_path, jobs):
+        render_cache = RenderCache(str(tmp_path / 'cache'))
+        batch.convert_directory(str(man_dir), str(tmp_path / 'first'),
+                                'main.css', render_cache=render_cache,
+                                jobs=jobs)
+        metrics = Metrics()
+
+        entries = batch.convert_directory(
+            str(man_dir), str(tmp_path / 'second'), 'main.css',
+            metrics=metrics, render_cache=render_cache, jobs=jobs)
+
+        assert metrics.render_cache_requests.get(result='hit') == 2
+        for name in entries:
+            assert (tmp_path / 'first' / name).read_bytes() == \
+                (tmp_path / 'second' / name).read_bytes()
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_size_bound_with_workers(self, tmp_path, jobs):
+        """
+        Ограничение размера действует и на копии кеша в процессах
+        исполнителей
+        """
+        man_dir = tmp_path / 'man'
+        man_dir.mkdir()
+        for number in range(40):
+            (man_dir / f'page{number}.1').write_text(
+                ''.join(page_lines).replace('bold', f'bold{number}'))
+        page_size = len(render(RenderCache(str(tmp_path / 'probe')),
+                               page_lines))
+        max_size = page_size * 5
+        render_cache = RenderCache(str(tmp_path / 'cache'), max_size)
+
+        batch.convert_directory(str(man_dir), str(tmp_path / 'html'),
+                                'main.css', render_cache=render_cache,
+                                jobs=jobs)
+
+        stats = render_cache.stats()
+        assert 0 < stats.size <= max_size
+        assert (tmp_path / 'cache' / 'size').read_text() == str(stats.size)
+
+    def test_server_reads_pages_converted_by_batch(self, man_dir, tmp_path):
+        render_cache = RenderCache(str(tmp_path / 'cache'))
+        batch.convert_directory(str(man_dir), str(tmp_path / 'html'),
+                                'main.css', render_cache=render_cache)
+        service = PageService(str(man_dir), 'main.css',
+                              render_cache=render_cache)
+
+        page = service.get_page(str(man_dir / 'man1' / 'one.1'))
+
+        assert service.metrics.render_cache_requests.get(result='hit') == 1
+        assert page.body == \
+            (tmp_path / 'html' / 'man1' / 'one.1.html').read_bytes()
+
+    def test_key_is_same_in_other_processes(self):
+        code = ('from src.converters import to_html; '
+                'from src.utils.render_cache import RenderCache; '
+                'print(RenderCache.key([], "main.css", '
+                'to_html.default_converter))')
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+
+        keys = {subprocess.run([sys.executable, '-c', code], cwd=root,
+                               env=dict(os.environ, PYTHONHASHSEED=seed),
+                               capture_output=True, text=True,
+                               check=True).stdout
+                for seed in ('1', '2')}
+
+        assert len(keys) == 1
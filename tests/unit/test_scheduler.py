@@ -0,0 +1,129 @@
+import os
+import pytest
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.utils import scheduler
+from src.utils.scheduler import Scheduler, Task
+
+
+def make_tasks(sizes):
+    return [Task(f'p{i}', size, size) for i, size in enumerate(sizes)]
+
+
+class TestMakeTasks:
+    """
+    Порядок задач
+    """
+
+    @pytest.mark.parametrize('policy, expected', [
+        ('largest', ['b.1', 'c.1', 'a.1']),
+        ('fifo', ['a.1', 'b.1', 'c.1']),
+    ])
+    def test_order(self, tmp_path, policy, expected):
+        for name, size in (('a.1', 1), ('b.1', 30), ('c.1', 30)):
+            (tmp_path / name).write_text('x' * size)
+        pages = [str(tmp_path / n) for n in ('a.1', 'b.1', 'c.1')]
+
+        tasks = scheduler.make_tasks(pages, policy)
+
+        assert [os.path.basename(t.page) for t in tasks] == expected
+        assert tasks[-1].memory == scheduler.estimate_memory(tasks[-1].size)
+
+
+class TestScheduler:
+    """
+    Запуск задач с ограничением по количеству и памяти
+    """
+
+    def run(self, tasks, jobs, memory_budget=None, fail=()):
+        """
+        :return: результаты и наибольшие одновременные число задач и
+                 память
+        """
+        lock = threading.Lock()
+        running = []
+        peaks = {'count': 0, 'memory': 0}
+        memory = {t.page: t.memory for t in tasks}
+
+        def work(page):
+            with lock:
+                running.append(page)
+                peaks['count'] = max(peaks['count'], len(running))
+                peaks['memory'] = max(peaks['memory'],
+                                      sum(memory[p] for p in running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(page)
+            if page in fail:
+                raise RuntimeError(page)
+            return page.upper()
+
+        with ThreadPoolExecutor(jobs) as executor:
+            results = dict(Scheduler(jobs, memory_budget).run(
+                tasks, work, executor))
+
+        return results, peaks
+
+    def test_all_tasks_run(self):
+        tasks = make_tasks([5, 4, 3, 2, 1])
+
+        results, peaks = self.run(tasks, jobs=2)
+
+        assert {t.page: r for t, r in results.items()} == {
+            t.page: t.page.upper() for t in tasks}
+        assert peaks['count'] <= 2
+
+    def test_memory_budget_limits_large_tasks(self):
+        """
+        Большие задачи не выполняются одновременно, а маленькие
+        запускаются рядом с ними
+        """
+        tasks = make_tasks([60, 50, 10, 10, 10])
+
+        results, peaks = self.run(tasks, jobs=4, memory_budget=80)
+
+        assert len(results) == 5
+        assert peaks['memory'] <= 80
+        assert peaks['count'] >= 2
+
+    def test_task_larger_than_budget_runs_alone(self):
+        tasks = make_tasks([200, 10])
+
+        results, peaks = self.run(tasks, jobs=2, memory_budget=100)
+
+        assert len(results) == 2
+        assert peaks['count'] == 1
+
+    def test_error_stops_scheduling(self):
+        tasks = make_tasks([3, 2, 1])
+
+        with pytest.raises(RuntimeError):
+            self.run(tasks, jobs=1, fail={'p0'})
+
+
+class TestSimulate:
+    """
+    Модель времени выполнения
+    """
+
+    def test_largest_first_beats_fifo(self):
+        """
+        Если большая задача идёт последней, FIFO ждёт её одну
+        """
+        sizes = [10] * 8 + [40]
+        fifo = scheduler.simulate(make_tasks(sizes), jobs=2)
+        largest = scheduler.simulate(
+            sorted(make_tasks(sizes), key=lambda t: -t.size), jobs=2)
+
+        assert (fifo, largest) == (80, 60)
+
+    def test_memory_budget_serializes_large_tasks(self):
+        tasks = make_tasks([40, 40])
+
+        assert scheduler.simulate(tasks, jobs=2) == 40
+        assert scheduler.simulate(tasks, jobs=2, memory_budget=50) == 80
@@ -0,0 +1,183 @@
+import json
+import os
+import pytest
+import subprocess
+import sys
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.utils import file_manager, shards
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+man_dir = os.path.join(root_dir, 'man')
+
+
+def run_cponcho(*argv):
+    subprocess.run([sys.executable, 'cponcho.py'] + list(argv),
+                   cwd=root_dir, check=True, stderr=subprocess.DEVNULL)
+
+
+def read_tree(directory):
+    """
+    :return: словарь путь относительно directory - содержимое файла
+    """
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            file_name = os.path.join(root, name)
+            with open(file_name, 'rb') as f:
+                files[os.path.relpath(file_name, directory)] = f.read()
+
+    return files
+
+
+class TestParseShard:
+    """
+    Разбор i/N
+    """
+
+    def test_parse_shard(self):
+        assert shards.parse_shard('2/3') == (2, 3)
+
+    @pytest.mark.parametrize('value', ['3', '0/3', '4/3', 'a/3', '1/'])
+    def test_invalid_shard(self, value):
+        with pytest.raises(ValueError):
+            shards.parse_shard(value)
+
+
+class TestAssignShards:
+    """
+    Распределение страниц по шардам
+    """
+
+    @pytest.fixture
+    def pages_dir(self, tmp_path):
+        pages_dir = tmp_path / 'man'
+        pages_dir.mkdir()
+        for number, size in enumerate([50, 40, 30, 20, 10, 10]):
+            (pages_dir / f'p{number}.1').write_text(f'{number}' * size)
+        (pages_dir / 'alias.1').write_text('.so p5.1\n')
+
+        return pages_dir
+
+    def test_every_page_in_one_shard(self, pages_dir):
+        pages = file_manager.find_man_pages(str(pages_dir))
+
+        assigned = shards.assign_shards(pages, 3, str(pages_dir))
+
+        assert sorted(p for shard in assigned for p in shard) == pages
+
+    def test_shards_are_balanced_by_size(self, pages_dir):
+        """
+        Большие страницы распределяются первыми, в наименее загруженный
+        шард: 50 | 40 + 10 | 30 + 20 + 10
+        """
+        pages = file_manager.find_man_pages(str(pages_dir))
+
+        assigned = shards.assign_shards(pages, 3, str(pages_dir))
+
+        sizes = sorted(sum(os.path.getsize(p) for p in shard
+                           if not p.endswith('alias.1'))
+                       for shard in assigned)
+        assert sizes == [50, 50, 60]
+
+    def test_alias_is_in_shard_of_its_page(self, pages_dir):
+        pages = file_manager.find_man_pages(str(pages_dir))
+
+        assigned = shards.assign_shards(pages, 3, str(pages_dir))
+
+        shard = next(s for s in assigned if str(pages_dir / 'p5.1') in s)
+        assert str(pages_dir / 'alias.1') in shard
+
+    def test_assignment_does_not_depend_on_order(self, pages_dir):
+        pages = file_manager.find_man_pages(str(pages_dir))
+
+        forward = shards.assign_shards(pages, 3, str(pages_dir))
+        backward = shards.assign_shards(pages[::-1], 3, str(pages_dir))
+
+        assert [sorted(s) for s in forward] == [sorted(s) for s in backward]
+
+
+    def test_common_root(self, pages_dir):
+        page = str(pages_dir / 'p0.1')
+
+        assert shards.common_root([page]) == str(pages_dir)
+        assert shards.common_root([page, str(pages_dir.parent)]) == \
+            str(pages_dir.parent)
+
+    def test_whatis_shard_does_not_depend_on_directory(self, tmp_path):
+        """
+        Узлы, запущенные из разных директорий, делят страницы одинакового
+        размера одинаково
+        """
+        pages_dir = tmp_path / 'man'
+        pages_dir.mkdir()
+        for number in range(8):
+            (pages_dir / f'p{number}.1').write_text(
+                f'.TH P{number} 1\n.SH NAME\np{number} \\- page\n')
+
+        indexes = []
+        for cwd, input_dir in ((tmp_path, 'man'), (pages_dir, os.curdir)):
+            index = str(tmp_path / f'whatis{len(indexes)}.jsonl')
+            subprocess.run([sys.executable,
+                            os.path.join(root_dir, 'cponcho.py'), 'whatis',
+                            input_dir, '-o', index, '--shard', '1/2'],
+                           cwd=str(cwd), check=True, stderr=subprocess.DEVNULL)
+            with open(index, encoding='utf-8') as index_file:
+                indexes.append(index_file.read())
+
+        assert indexes[0]
+        assert indexes[0] == indexes[1]
+
+class TestMerge:
+    """
+    Шарды, запущенные отдельными процессами, и их сборка
+    """
+
+    def test_merged_shards_match_single_run(self, tmp_path):
+        single = str(tmp_path / 'single')
+        run_cponcho('man', '-o', single)
+
+        shard_dirs = [str(tmp_path / f'shard{i}') for i in range(1, 4)]
+        processes = [subprocess.Popen(
+            [sys.executable, 'cponcho.py', 'man', '-o', shard_dir,
+             '--shard', f'{i}/3'], cwd=root_dir, stderr=subprocess.DEVNULL)
+            for i, shard_dir in enumerate(shard_dirs, 1)]
+        assert [p.wait() for p in processes] == [0, 0, 0]
+        merged = str(tmp_path / 'merged')
+        run_cponcho('merge', '-o', merged, *shard_dirs)
+
+        shard_pages = [set(read_tree(d)) - {'manifest.json'}
+                       for d in shard_dirs]
+        assert all(shard_pages)
+        assert read_tree(merged) == read_tree(single)
+
+    def test_merged_whatis_matches_single_run(self, tmp_path):
+        single = str(tmp_path / 'single.jsonl')
+        run_cponcho('whatis', 'man', '-o', single)
+        indexes = [str(tmp_path / f'whatis{i}.jsonl') for i in (1, 2)]
+        for i, index in enumerate(indexes, 1):
+            run_cponcho('whatis', 'man', '-o', index, '--shard', f'{i}/2')
+        merged = str(tmp_path / 'merged.jsonl')
+        run_cponcho('merge', '-o', merged, *indexes)
+
+        with open(single, encoding='utf-8') as single_file, \
+                open(merged, encoding='utf-8') as merged_file:
+            single_lines = single_file.readlines()
+            merged_lines = merged_file.readlines()
+        assert len(merged_lines) == len(os.listdir(man_dir))
+        assert sorted(merged_lines) == sorted(single_lines)
+
+    def test_conflicting_shards(self, tmp_path):
+        for name, text in (('a', 'first'), ('b', 'second')):
+            shard_dir = tmp_path / name
+            shard_dir.mkdir()
+            (shard_dir / 'page.1.html').write_text(text)
+            file_manager.update_manifest(
+                str(shard_dir / 'manifest.json'),
+                {'page.1.html': {'etag': text, 'files': ['page.1.html']}})
+
+        with pytest.raises(ValueError):
+            shards.merge_outputs([str(tmp_path / 'a'), str(tmp_path / 'b')],
+                                 str(tmp_path / 'merged'))
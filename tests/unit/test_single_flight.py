@@ -0,0 +1,122 @@
+import concurrent.futures
+import os
+import pytest
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html
+from src.utils.metrics import Metrics
+from src.utils.server import PageService
+from src.utils.single_flight import SingleFlight
+
+page_text = '.TH PAGE 1\n.SH NAME\npage \\- test page\n'
+
+
+class SlowConverter(to_html.Converter):
+    """
+    Конвертер, который считает конвертаций и замедляет их
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        SlowConverter.calls = []
+
+    def convert(self, lines, stylesheet, stage=None, fragments=None):
+        SlowConverter.calls.append(lines)
+        time.sleep(0.3)
+        return super().convert(lines, stylesheet, stage, fragments)
+
+
+def run_together(function, count):
+    """
+    Вызывает function одновременно из count потоков
+
+    :return: результаты вызовов
+    """
+    barrier = threading.Barrier(count)
+
+    def call(_):
+        barrier.wait()
+        return function()
+
+    with concurrent.futures.ThreadPoolExecutor(count) as executor:
+        return list(executor.map(call, range(count)))
+
+
+class TestSingleFlight:
+    """
+    Объединение одновременных вычислений одного ключа
+    """
+
+    def test_one_call_for_concurrent_requests(self):
+        metrics = Metrics()
+        flights = SingleFlight(metrics)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.3)
+            return object()
+
+        results = run_together(lambda: flights.do('key', compute), 10)
+
+        assert len(calls) == 1
+        assert len({id(result) for result, _ in results}) == 1
+        assert sorted(shared for _, shared in results) == [False] + [True] * 9
+        assert metrics.coalesced_requests.get(role='leader') == 1
+        assert metrics.coalesced_requests.get(role='follower') == 9
+        assert len(flights) == 0
+
+    def test_different_keys_are_not_coalesced(self):
+        flights = SingleFlight()
+        keys = iter(range(4))
+        lock = threading.Lock()
+
+        def request():
+            with lock:
+                key = next(keys)
+            return flights.do(key, time.sleep, 0.1)
+
+        assert [shared for _, shared in run_together(request, 4)] == \
+            [False] * 4
+
+    def test_error_is_shared_and_not_remembered(self):
+        flights = SingleFlight()
+
+        def fail():
+            time.sleep(0.3)
+            raise ValueError('page')
+
+        def request():
+            with pytest.raises(ValueError):
+                flights.do('key', fail)
+
+        run_together(request, 5)
+
+        assert flights.do('key', lambda: 1) == (1, False)
+
+
+class TestServerCoalescing:
+    """
+    Сервер конвертирует одновременно запрошенную страницу один раз
+    """
+
+    @pytest.mark.parametrize('coalesce, calls', [(True, 1), (False, 8)])
+    def test_burst(self, tmp_path, coalesce, calls):
+        page = tmp_path / 'page.1'
+        page.write_text(page_text)
+        service = PageService(str(tmp_path), 'main.css', SlowConverter(),
+                              coalesce=coalesce)
+
+        pages = run_together(lambda: service.get_page(str(page)), 8)
+
+        assert len(SlowConverter.calls) == calls
+        assert len({cached.etag for cached in pages}) == 1
+        assert service.metrics.pages_converted.get() == calls
+        assert service.metrics.cache_requests.get(result='miss') == 8
+        if coalesce:
+            assert service.metrics.coalesced_requests.get(
+                role='follower') == 7
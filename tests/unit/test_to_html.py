@@ -1,7 +1,9 @@
 import os
+import pickle
 import pytest
 import sys
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
 from itertools import chain
 
 sys.path.append(os.path.dirname(
@@ -697,3 +699,515 @@ class TestParagraphs:
         paragraphs = [p for p in to_html.get_paragraphs(subsection_content)]
 
         assert paragraphs == expected_paragraphs
+
+
+man_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), 'man')
+man_pages = sorted(os.listdir(man_dir))
+
+
+class TestSectionIndex:
+    """
+    Индекс смещений разделов и конвертация одного раздела
+    """
+    man_content = '\n'.join([
+        '.de Sp',
+        '.sp',
+        '..',
+        '.SH NAME',
+        'name',
+        '.SH "SEE ALSO"',
+        'see',
+        '.SS Other',
+        'other',
+        ''
+    ])
+
+    def test_build_section_index(self):
+        """
+        to_html.build_section_index находит смещения всех .SH и .SS
+        """
+        index = to_html.build_section_index(
+            BytesIO(self.man_content.encode('utf-8')))
+
+        assert index == {
+            'sections': [
+                {'header': 'NAME', 'start': 14, 'end': 28,
+                 'subsections': []},
+                {'header': 'SEE ALSO', 'start': 28, 'end': 63,
+                 'subsections': [
+                     {'header': 'Other', 'start': 47, 'end': 63}
+                 ]}
+            ]
+        }
+
+    def test_index_is_saved_and_rebuilt_when_page_changes(self, tmp_path):
+        """
+        to_html.load_section_index сохраняет индекс рядом со страницей и
+        перестраивает его, когда страница меняется
+        """
+        page = tmp_path / 'test.1'
+        page.write_text(self.man_content)
+
+        to_html.load_section_index(str(page))
+        page.write_text('.SH NAME\n')
+        index = to_html.load_section_index(str(page))
+
+        assert (tmp_path / 'test.1.idx').exists()
+        assert [s['header'] for s in index['sections']] == ['NAME']
+
+    def test_render_missing_section(self, tmp_path):
+        """
+        to_html.render_section возвращает None для отсутствующего раздела
+        """
+        page = tmp_path / 'test.1'
+        page.write_text(self.man_content)
+
+        assert to_html.render_section(str(page), 'EXAMPLES') is None
+
+    def test_render_non_utf8_section(self, tmp_path):
+        """
+        Байты не в utf-8 заменяются так же, как при построении индекса
+        """
+        page = tmp_path / 'test.1'
+        page.write_bytes(b'.SH NAME\ncaf\xe9\n')
+
+        assert 'caf\ufffd' in to_html.render_section(str(page), 'NAME')
+
+    def test_render_redirect_page(self, tmp_path):
+        """
+        Для страницы-перенаправления (.so) конвертируется раздел страницы,
+        на которую она указывает
+        """
+        (tmp_path / 'man1').mkdir()
+        target = tmp_path / 'man1' / 'test.1'
+        target.write_text(self.man_content)
+        redirect = tmp_path / 'man1' / 'alias.1'
+        redirect.write_text('.so man1/test.1\n')
+
+        assert to_html.render_section(str(redirect), 'SEE ALSO') == \
+            to_html.render_section(str(target), 'SEE ALSO') is not None
+
+    @pytest.mark.parametrize('page_name', man_pages)
+    def test_render_section_matches_full_conversion(self, tmp_path,
+                                                    page_name):
+        """
+        to_html.render_section конвертирует каждый раздел и подраздел
+        страницы так же, как полная конвертация
+        """
+        page = tmp_path / page_name
+        with open(os.path.join(man_dir, page_name), 'rb') as man_page:
+            page.write_bytes(man_page.read())
+
+        with open(str(page)) as man_page:
+            sections = list(to_html.get_sections(man_page))
+
+        rendered_sections = set()
+        for section in sections:
+            if not section.header or section.header in rendered_sections:
+                continue
+            rendered_sections.add(section.header)
+
+            assert (to_html.render_section(str(page), section.header) ==
+                    to_html.convert_section(section))
+
+            for subsection in section.subsections:
+                if (not subsection.header or
+                        subsection.header in rendered_sections):
+                    continue
+                rendered_sections.add(subsection.header)
+
+                assert (to_html.render_section(str(page), subsection.header)
+                        == to_html.convert_subsection(subsection))
+
+
+class TestConverter:
+    """
+    Конвертер с собственными таблицами тегов
+    """
+    def test_custom_tables(self):
+        """
+        Converter использует переданные таблицы тегов и отступ
+        """
+        converter = to_html.Converter(single_tags={r'\(bu': '*'},
+                                      inline_tags={'.B': '<em>{}</em>'},
+                                      paragraph_indent=2)
+        paragraph = TaggedParagraph(None, r'.B \(bu', ['text'])
+
+        converted = converter.convert_paragraph(paragraph)
+
+        assert converted == ('<div class="tagged-paragraph-container">'
+                             '<span class="hang-tag"><em>*</em></span>'
+                             '<p class="tagged-paragraph paragraph" '
+                             'style="padding-left: 2em">text</p>'
+                             '</div>')
+
+    def test_tables_are_copied(self):
+        """
+        Изменение исходных таблиц после создания не влияет на конвертер
+        """
+        tags = {r'\(bu': '*'}
+        converter = to_html.Converter(single_tags=tags)
+
+        tags[r'\(bu'] = '+'
+
+        assert converter.convert_line(r'\(bu') == '*'
+
+    @pytest.mark.parametrize('line, expected', [
+        ('.B bold', '<b>bold</b>'),
+        ('.BI a b', '<i><b>a b</b></i>'),
+        (r'.\" comment', '<!--comment-->'),
+        ('.TH TITLE 1', '<span class="title">TITLE 1</span>'),
+        ('plain .B text', 'plain .B text'),
+    ])
+    def test_inline_tags_match_in_table_order(self, line, expected):
+        """
+        В начале строки заменяется первый подходящий по порядку таблицы тег
+        """
+        assert to_html.convert_line(line) == expected
+
+    def test_pickled_converter_converts_the_same(self):
+        """
+        Конвертер можно передать в другой процесс
+        """
+        converter = to_html.Converter(single_tags={r'\(bu': '*'},
+                                      paragraph_indent=2)
+
+        restored = pickle.loads(pickle.dumps(converter))
+
+        paragraph = HangingParagraph(None, r'\(bu', ['text'])
+        assert (restored.convert_paragraph(paragraph) ==
+                converter.convert_paragraph(paragraph))
+
+    def test_shared_between_threads(self):
+        """
+        Один конвертер даёт одинаковый результат из нескольких потоков
+        """
+        with open(os.path.join(man_dir, 'python.1')) as man_page:
+            lines = man_page.readlines()
+        expected = ''.join(to_html.convert(lines, 'main.css'))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(
+                lambda _: ''.join(to_html.convert(lines, 'main.css')),
+                range(8)))
+
+        assert results == [expected] * 8
+
+
+class TestFonts:
+    """
+    Отслеживание шрифтов и их span'ы
+    """
+    @pytest.mark.parametrize('line, expected', [
+        (r'\fBfoo\fR bar', '<span class="strong">foo</span> bar'),
+        (r'\fBfoo\fP bar', '<span class="strong">foo</span> bar'),
+        (r'\fIa\fB\fRb', '<span class="emphasis">a</span>b'),
+        (r'\fBa\fR\fBb\fR', '<span class="strong">ab</span>'),
+        (r'\fIa\fBb\fPc\fPd',
+         '<span class="emphasis">a</span><span class="strong">b</span>'
+         '<span class="emphasis">c</span><span class="strong">d</span>'),
+        (r'\f(CWcode\fP', '<span class="monospace">code</span>'),
+        (r'\f[BI]both\f[]', '<span class="strong emphasis">both</span>'),
+        (r'\fBunclosed', '<span class="strong">unclosed</span>'),
+        (r'\fXunknown', 'unknown'),
+        (r'\efB', r'\fB'),
+    ], ids=['roman', 'previous', 'empty_spans', 'merged', 'previous_chain',
+            'two_char_font', 'bracket_font', 'unclosed', 'unknown',
+            'escaped'])
+    def test_convert_line(self, line, expected):
+        """
+        to_html.convert_line заменяет смены шрифта сбалансированными
+        span'ами без пустых и вложенных span'ов
+        """
+        assert to_html.convert_line(line) == expected
+
+    def test_font_continues_across_paragraph_lines(self):
+        """
+        Шрифт действует в следующих строках параграфа, span'ы закрываются в
+        конце каждой строки
+        """
+        paragraph = SimpleParagraph([r'\fBfirst', r'second\fR third'])
+
+        converted = to_html.convert_simple_paragraph(paragraph)
+
+        assert converted == ('<p class="simple-paragraph paragraph">'
+                             '<span class="strong">first</span> '
+                             '<span class="strong">second</span> third'
+                             '</p>')
+
+    def test_font_does_not_leak_between_paragraphs(self):
+        """
+        Каждый параграф начинается с обычного шрифта
+        """
+        first = to_html.convert_simple_paragraph(SimpleParagraph([r'\fBa']))
+        second = to_html.convert_simple_paragraph(SimpleParagraph(['b']))
+
+        assert first.count('<span') == first.count('</span>') == 1
+        assert second == '<p class="simple-paragraph paragraph">b</p>'
+
+    def test_tag_font_continues_into_paragraph(self):
+        """
+        Шрифт, не закрытый в бирке параграфа, действует и в его тексте
+        """
+        paragraph = TaggedParagraph(None, r'\fB\-c', ['text'])
+
+        converted = to_html.convert_tagged_paragraph(paragraph)
+
+        assert ('<span class="hang-tag"><span class="strong">-c</span></span>'
+                in converted)
+        assert '<span class="strong">text</span></p>' in converted
+
+    def test_font_carried_into_request_lines(self):
+        """
+        Шрифт, перешедший с предыдущей строки, не мешает распознать запросы
+        в начале строки и действует только на текст их аргумента
+        """
+        converted = to_html.Converter().convert_lines(
+            [r'\fBfoo', '.B bar', r'.\" c', '.br', 'baz'])
+
+        assert converted == ('<span class="strong">foo</span> '
+                             '<b><span class="strong">bar</span></b> '
+                             '<!--c--> <br/> '
+                             '<span class="strong">baz</span>')
+
+    def test_disabled_font_tracking(self):
+        """
+        С пустой таблицей шрифтов смены шрифта не обрабатываются
+        """
+        converter = to_html.Converter(font_classes={})
+
+        assert converter.convert_line(r'\fBa\fP') == r'\fBa\fP'
+
+
+class TestCompact:
+    """
+    Компактная разметка
+    """
+    converter = to_html.Converter(compact=True)
+
+    @pytest.mark.parametrize('paragraph, expected', [
+        (SimpleParagraph(['a', r'.\" comment', 'b']), '<p class="p">a b</p>'),
+        (HangingParagraph(None, '', ['text']),
+         f'<p class="hp i{default_paragraph_indent}">text</p>'),
+        (TaggedParagraph(8, r'\fB\-c\fP', ['text']),
+         '<div class="tpc"><span class="ht"><span class="fb">-c</span>'
+         '</span><p class="tp i8">text</p></div>'),
+        (IndentedParagraph(40, None, ['text']),
+         '<div class="ipc"><p class="ip" style="padding-left:40em">text</p>'
+         '</div>'),
+    ], ids=['simple_without_comment', 'hanging_without_hang',
+            'tagged_with_indent_class', 'indented_with_large_indent'])
+    def test_convert_paragraph(self, paragraph, expected):
+        """
+        В компактном режиме отступы задаются классами, пустые бирки и
+        комментарии не выводятся
+        """
+        assert self.converter.convert_paragraph(paragraph) == expected
+
+    def test_convert_section(self):
+        """
+        В компактном режиме между элементами нет переводов строк, а у
+        безымянного подраздела нет заголовка
+        """
+        section = Section('NAME', [Subsection('', [SimpleParagraph(['a'])])])
+
+        converted = self.converter.convert_section(section)
+
+        assert converted == ('<div class="section-name">'
+                             '<h1 class="sh">NAME</h1>'
+                             '<div class="subsection-headless">'
+                             '<p class="p">a</p>'
+                             '</div>'
+                             '</div>')
+
+    def test_compact_is_smaller(self):
+        """
+        Компактная разметка встроенных страниц меньше обычной
+        """
+        with open(os.path.join(man_dir, 'gcc.1')) as man_page:
+            lines = man_page.readlines()
+
+        usual = ''.join(to_html.convert(lines, 'main.css'))
+        compact = ''.join(self.converter.convert(lines, 'main.css'))
+
+        assert len(compact) < len(usual) * 0.85
+
+    def test_stylesheet_has_compact_classes(self):
+        """
+        В стилях есть правила всех классов компактного режима
+        """
+        stylesheet_file = os.path.join(os.path.dirname(man_dir),
+                                       'css', 'main.css')
+        with open(stylesheet_file, encoding='utf-8') as stylesheet:
+            css = stylesheet.read()
+
+        assert to_html.indent_stylesheet() in css
+        for class_name, short_name in to_html.compact_class_names.items():
+            if f'.{class_name}' in css:
+                assert f'.{short_name} ' in css or f'.{short_name},' in css
+
+
+class TestToc:
+    """
+    Якоря, сворачиваемые разделы и оглавление
+    """
+    converter = to_html.Converter(toc=True)
+
+    @pytest.mark.parametrize('header, expected', [
+        ('NAME', 'name'),
+        ('SEE ALSO', 'see-also'),
+        (r'Options Controlling \*(C+ Dialect',
+         'options-controlling-cpp-dialect'),
+        (r'Debugging \s-1GCC\s0', 'debugging-gcc'),
+        ('"', 'section'),
+    ])
+    def test_make_anchor(self, header, expected):
+        assert to_html.make_anchor(header) == expected
+
+    def test_duplicate_anchors_get_suffix(self):
+        """
+        Повторяющиеся заголовки получают разные id
+        """
+        anchors = to_html.Anchors()
+        section = anchors.add('OPTIONS')
+
+        ids = [anchors.add('Options', section).anchor,
+               anchors.add('Options', section).anchor,
+               anchors.add('OPTIONS').anchor]
+
+        assert ids == ['options--options', 'options--options-2',
+                       'options-2']
+
+    def test_convert_section(self):
+        section = Section('NAME', [
+            Subsection('', [SimpleParagraph(['a'])]),
+            Subsection('Usage', [SimpleParagraph(['b'])])])
+        anchors = to_html.Anchors()
+
+        converted = self.converter.convert_section(section, anchors)
+
+        assert converted == '\n'.join([
+            '<details open class="section-name section" id="name">',
+            '<summary><h1 class="section-header">NAME</h1></summary>',
+            '<div class="subsection-headless subsection">',
+            '<h2 class="subsection-header"></h2>',
+            '<p class="simple-paragraph paragraph">a</p>',
+            '</div>',
+            '<details open class="subsection-usage subsection" '
+            'id="name--usage">',
+            '<summary><h2 class="subsection-header">Usage</h2></summary>',
+            '<p class="simple-paragraph paragraph">b</p>',
+            '</details>',
+            '</details>'])
+        assert self.converter.convert_toc(anchors) == (
+            '<nav class="toc"><ul><li><a href="#name">NAME</a>'
+            '<ul><li><a href="#name--usage">Usage</a></li></ul></li>'
+            '</ul></nav>')
+
+    def test_toc_is_first(self):
+        """
+        Оглавление выводится перед разделами, а без toc=True разметка не
+        меняется
+        """
+        lines = ['.SH NAME', 'a', '.SH SEE ALSO', 'b']
+
+        chunks = list(self.converter.convert(lines, 'main.css'))
+        usual = ''.join(to_html.convert(lines, 'main.css'))
+
+        assert chunks[1] == ('<nav class="toc"><ul>'
+                             '<li><a href="#name">NAME</a></li>'
+                             '<li><a href="#see-also">SEE ALSO</a></li>'
+                             '</ul></nav>')
+        assert 'id="name"' in chunks[2]
+        assert 'id=' not in usual and 'toc' not in usual
+
+    def test_anchors_are_stable(self):
+        with open(os.path.join(man_dir, 'gcc.1')) as man_page:
+            lines = man_page.readlines()
+
+        first = ''.join(self.converter.convert(lines, 'main.css'))
+        second = ''.join(self.converter.convert(lines, 'main.css'))
+
+        assert first == second
+        assert 'id="options--options-controlling-cpp-dialect"' in first
+
+
+class TestLexer:
+    """
+    Лексер и сборка разделов из его токенов
+    """
+
+    def test_tokenize(self):
+        lines = ['.TH T 1\n', '.SH NAME\n', 'name\n', '.SS Sub\n',
+                 '.TP 4\n', 'tag\n', 'text\r\n']
+
+        tokens = list(to_html.tokenize(lines))
+
+        assert tokens == [
+            ['.TH T 1'],
+            to_html.Token('section', ['.SH', 'NAME'], '.SH NAME'),
+            ['name'],
+            to_html.Token('subsection', ['.SS', 'Sub'], '.SS Sub'),
+            to_html.Token('paragraph', ['.TP', '4'], '.TP 4'),
+            ['tag', 'text'],
+        ]
+        assert (tokens[4].request, tokens[4].arguments) == ('.TP', ['4'])
+
+    def test_tokenize_only_given_kinds(self):
+        tokens = list(to_html.tokenize(['.SH A', '.PP', 'text'],
+                                       ('paragraph',)))
+
+        assert tokens == [['.SH A'],
+                          to_html.Token('paragraph', ['.PP'], '.PP'),
+                          ['text']]
+
+    @staticmethod
+    def divide(lines):
+        """
+        Разделы, собранные отдельными проходами divide_into_sections,
+        divide_into_subsection и поиском тегов параграфов
+        """
+        for header, content in to_html.divide_into_sections(lines):
+            subsections = []
+            for sub_header, sub_content in \
+                    to_html.divide_into_subsection(content):
+                paragraphs = []
+                paragraph_header = ''
+                paragraph = []
+                for line in sub_content:
+                    if line.startswith(to_html.paragraph_tags):
+                        if paragraph:
+                            paragraphs.append(to_html.get_paragraph(
+                                paragraph_header, paragraph))
+                        paragraph_header = line
+                        paragraph = []
+                    else:
+                        paragraph.append(line)
+                if paragraph:
+                    paragraphs.append(to_html.get_paragraph(
+                        paragraph_header, paragraph))
+                subsections.append(Subsection(sub_header.strip(' "'),
+                                              paragraphs))
+            yield Section(header.strip(' "'), subsections)
+
+    @pytest.mark.parametrize('page_name', sorted(os.listdir(os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))), 'man'))))
+    def test_same_sections_as_separate_passes(self, page_name):
+        page = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))), 'man', page_name)
+        with open(page, encoding='utf-8') as man_page:
+            lines = man_page.readlines()
+
+        assert list(to_html.get_sections(lines)) == list(self.divide(lines))
+
+    @pytest.mark.parametrize('lines', [
+        ['.SH', '.SH A'],
+        ['.SH ""', '.SS', '.PP'],
+        ['.SS', 'text', '.SH B', '.PD 0', 'x'],
+        ['.PP', '.TP', 'tag', '.SS C', '.SS D', '.IP'],
+    ], ids=['empty_header', 'quoted_header', 'unknown_paragraph_tag',
+            'empty_paragraphs'])
+    def test_empty_groups_as_separate_passes(self, lines):
+        assert list(to_html.get_sections(lines)) == list(self.divide(lines))
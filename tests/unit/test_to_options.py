@@ -0,0 +1,126 @@
+import json
+import os
+import pytest
+import sys
+from io import StringIO
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_options
+from src.converters.to_options import OptionEntry
+
+man_page = [
+    '.TH LS 1',
+    '.SH NAME',
+    r'ls \- list directory contents',
+    '.SH DESCRIPTION',
+    'List information about the FILEs.',
+    '.TP',
+    r'\fB\-a\fR, \fB\-\-all\fR',
+    'do not ignore entries starting with .',
+    '.TP',
+    r'\fB\-\-block\-size\fR=\fI\,SIZE\/\fR',
+    r'with \fB\-l\fR, scale sizes by SIZE',
+    '.TP',
+    r'\fB\-\-color\fR[=\fI\,WHEN\/\fR]',
+    'color the output WHEN',
+    '.SH AUTHOR',
+    '.TP',
+    r'\fB\-x\fR',
+    'not an option',
+]
+
+pod_page = [
+    '.TH TOOL 1',
+    '.SH OPTIONS',
+    '.IP "\\fB\\-i\\fR, \\fB\\-\\-ignore\\fR[=\\fIregex\\fR]" 4',
+    '.IX Item "-i, --ignore[=regex]"',
+    '.PD 0',
+    '.IP "\\fB\\-l\\fR\\fIfile\\fR" 4',
+    '.IX Item "-lfile"',
+    '.PD',
+    'Ignore files.',
+    '.IP "" 4',
+    'Continued description.',
+    '.IP "\\fB\\-c \\-\\-stdout\\fR" 4',
+    'Write to standard output.',
+    '.SH DESCRIPTION',
+    '.TP',
+    r'\fB\-d\fR',
+    'ignored: the page has an OPTIONS section',
+]
+
+
+class TestTags:
+    """
+    Разбор бирок пунктов списков опций
+    """
+    @pytest.mark.parametrize('tag, expected', [
+        ('-a, --all', (['-a', '--all'], '')),
+        ('--block-size=SIZE', (['--block-size'], 'SIZE')),
+        ('-o file', (['-o'], 'file')),
+        ('-c --stdout', (['-c', '--stdout'], '')),
+        ('--color[=WHEN]', (['--color'], '[WHEN]')),
+        ('-I, --ignore= PATTERN', (['-I', '--ignore'], 'PATTERN')),
+        ('+x', (['+x'], '')),
+        ('FILE', ([], '')),
+    ])
+    def test_parse_tag(self, tag, expected):
+        assert to_options.parse_tag(tag) == expected
+
+    def test_split_arguments(self):
+        assert to_options.split_arguments('.IP "a ""b"" c" 4') == \
+            ['.IP', 'a "b" c', '4']
+
+
+class TestOptions:
+    """
+    Извлечение опций из man страниц
+    """
+    def test_description_fallback(self):
+        """
+        Без разделов OPTIONS опции берутся из DESCRIPTION
+        """
+        entries = list(to_options.get_options(StringIO('\n'.join(man_page)),
+                                              'ls', '1'))
+
+        assert entries == [
+            OptionEntry('ls', '1', ['-a', '--all'], '',
+                        'do not ignore entries starting with .'),
+            OptionEntry('ls', '1', ['--block-size'], 'SIZE',
+                        'with -l, scale sizes by SIZE'),
+            OptionEntry('ls', '1', ['--color'], '[WHEN]',
+                        'color the output WHEN'),
+        ]
+
+    def test_pod_items(self):
+        """
+        Бирки .IP в кавычках, пункты с общим описанием и продолжения
+        описаний
+        """
+        entries = list(to_options.get_options(StringIO('\n'.join(pod_page)),
+                                              'tool', '1'))
+
+        assert entries == [
+            OptionEntry('tool', '1', ['-i', '--ignore', '-l'], '[regex]',
+                        'Ignore files. Continued description.'),
+            OptionEntry('tool', '1', ['-c', '--stdout'], '',
+                        'Write to standard output.'),
+        ]
+
+    def test_build_index(self, tmp_path):
+        """
+        to_options.build_index пишет по одной строке JSON на опцию
+        """
+        page = tmp_path / 'ls.1'
+        page.write_text('\n'.join(man_page))
+        index = StringIO()
+
+        count = to_options.build_index([str(page)], index)
+
+        lines = index.getvalue().splitlines()
+        assert count == len(lines) == 3
+        assert json.loads(lines[0]) == {
+            'page': 'ls', 'section': '1', 'flags': ['-a', '--all'],
+            'argument': '', 'description':
+                'do not ignore entries starting with .'}
@@ -0,0 +1,138 @@
+import os
+import pytest
+import sys
+from io import StringIO
+
+sys.path.append(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from src.converters import to_html, to_text, to_whatis
+from src.converters.to_html import Section, Subsection, SimpleParagraph
+from src.converters.to_whatis import WhatisEntry
+
+man_page = [
+    '.TH CHMOD 2',
+    '.SH NAME',
+    r'chmod, fchmod \- change permissions of a file',
+    '.SH SYNOPSIS',
+    '.B #include <sys/stat.h>',
+    '.sp',
+    '.BI "int chmod(const char *" path );',
+    '.SH DESCRIPTION',
+    'These system calls change the permissions of a file.',
+    '.SH ERRORS',
+    'None.',
+]
+
+
+def read_lines(lines, consumed):
+    """
+    Отдаёт строки по одной, запоминая сколько строк было прочитано
+    """
+    for line in lines:
+        consumed.append(line)
+        yield line
+
+
+class TestExtractSections:
+    """
+    Извлечение отдельных разделов без разбора всей страницы
+    """
+    def test_extract_sections(self):
+        """
+        to_html.extract_sections возвращает только запрошенные разделы
+        """
+        sections = to_html.extract_sections(StringIO('\n'.join(man_page)),
+                                            ['DESCRIPTION'])
+
+        assert sections == {
+            'DESCRIPTION': Section('DESCRIPTION', [Subsection('', [
+                SimpleParagraph([
+                    'These system calls change the permissions of a file.'
+                ])
+            ])])
+        }
+
+    def test_extract_sections_stops_reading(self):
+        """
+        to_html.extract_sections прекращает чтение, как только все
+        запрошенные разделы найдены
+        """
+        consumed = []
+
+        to_html.extract_sections(read_lines(man_page, consumed),
+                                 ('NAME', 'SYNOPSIS'))
+
+        # читается лишь заголовок следующего раздела
+        assert consumed == man_page[:man_page.index('.SH DESCRIPTION') + 1]
+
+    def test_missing_sections_are_absent(self):
+        """
+        Отсутствующих в странице разделов в результате нет
+        """
+        sections = to_html.extract_sections(StringIO('\n'.join(man_page)),
+                                            ['NAME', 'EXAMPLES'])
+
+        assert list(sections) == ['NAME']
+
+
+class TestText:
+    """
+    Конвертация строк в простой текст
+    """
+    @pytest.mark.parametrize('line, expected', [
+        (r'chmod \- change \fBpermissions\fP', 'chmod - change permissions'),
+        ('.BI "int chmod(const char *" path );',
+         'int chmod(const char * path );'),
+        ('.BR feature_test_macros (7)):', 'feature_test_macros (7)):'),
+        ('.IX Header "SYNOPSIS"', ''),
+        (r'.\" comment', ''),
+        ('.sp', ''),
+        ('a < b', 'a < b'),
+    ])
+    def test_convert_line(self, line, expected):
+        """
+        to_text.convert_line убирает разметку и неизвестные запросы
+        """
+        assert to_text.convert_line(line) == expected
+
+
+class TestWhatis:
+    """
+    Построение индекса whatis
+    """
+    def test_get_entry(self):
+        """
+        to_whatis.get_entry собирает имена, описание и синопсис страницы
+        """
+        entry = to_whatis.get_entry(StringIO('\n'.join(man_page)),
+                                    'chmod', '2')
+
+        assert entry == WhatisEntry(
+            ['chmod', 'fchmod'], '2', 'change permissions of a file',
+            '#include <sys/stat.h> int chmod(const char * path );')
+
+    def test_get_entry_without_name_section(self):
+        """
+        Без раздела NAME имя страницы берётся из имени файла
+        """
+        entry = to_whatis.get_entry(StringIO('.SH DESCRIPTION\ntext'),
+                                    'test', '1')
+
+        assert entry == WhatisEntry(['test'], '1', '', '')
+
+    def test_build_index(self, tmp_path):
+        """
+        to_whatis.build_index пишет по одной строке JSON на страницу
+        """
+        page = tmp_path / 'chmod.2'
+        page.write_text('\n'.join(man_page))
+        index = StringIO()
+
+        count = to_whatis.build_index([str(page)], index)
+
+        assert count == 1
+        assert index.getvalue() == (
+            '{"names": ["chmod", "fchmod"], "section": "2", '
+            '"description": "change permissions of a file", '
+            '"synopsis": "#include <sys/stat.h> '
+            'int chmod(const char * path );"}\n')